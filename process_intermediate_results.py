@@ -1,23 +1,25 @@
+import argparse
 import csv
-import heapq
 import json
-import math
 import os
-import statistics
-from PIL import Image
+
+import numpy as np
 import pandas as pd
 
+from xvolume import analytics
+from xvolume.journal import StateJournal
+
 
 def log_error(gt, estimate):
-    return abs(math.log2(1 + estimate) - math.log2(1 + gt))
+    return np.abs(np.log2(1 + estimate) - np.log2(1 + gt))
 
 
 def signed_log_error(gt, estimate):
-    return math.log2(1 + estimate) - math.log2(1 + gt)
+    return np.log2(1 + estimate) - np.log2(1 + gt)
 
 
 def rel_error(gt, estimate):
-    return abs(estimate - gt) / gt
+    return np.abs(estimate - gt) / gt
 
 
 def signed_rel_error(gt, estimate):
@@ -25,113 +27,83 @@ def signed_rel_error(gt, estimate):
 
 
 def process(gts, estimates, times, category):
-    relative_errors = []
-    signed_relative_errors = []
-
-    log_errors = []
-    signed_log_errors = []
-
-    for gt, estimate in zip(gts, estimates):
-        estimate = float(estimate)
-        gt = float(gt)
-
-        relative_errors.append(rel_error(gt, estimate))
-        signed_relative_errors.append(signed_rel_error(gt, estimate))
+    df = pd.DataFrame({"gt": np.asarray(gts, dtype=np.float64),
+                       "response": np.asarray(estimates, dtype=np.float64),
+                       "time": np.asarray(times, dtype=np.float64)})
+    summary = analytics.summarize(analytics.add_error_metrics(df))
+    analytics.print_summary(summary.iloc[0], category)
 
-        log_errors.append(log_error(gt, estimate))
-        signed_log_errors.append(signed_log_error(gt, estimate))
 
-    print(f"category: {category}")
-    print(f"{len(gts)} data points")
+def load_journal(category):
+    """
+    :param category: category of the experiment
+    :return: StateJournal with the checkpoint states/<category>_saved_state.json and the trials appended to the journal since
+    """
+    journal = StateJournal(category)
+    if not journal.load():
+        raise SystemExit(f"no saved state for {category} in the states folder")
+    return journal
 
-    print("-" * 20 + "relative error" + "-" * 20)
-    print(f"average time: {statistics.mean(times):.1f}")
-    print(f"average relative error: {statistics.mean(relative_errors) * 100:.2f}%")
-    print(f"median relative error: {statistics.median(relative_errors) * 100:.2f}%")
-    print(f"std relative error: {statistics.stdev(relative_errors) * 100:.2f}%")
-    print(f"average signed relative error: {statistics.mean(signed_relative_errors) * 100:.2f}%")
-    print(f"median signed relative error: {statistics.median(signed_relative_errors) * 100:.2f}%")
 
-    print("-" * 20 + "log error" + "-" * 20)
-    print(f"average log error: {statistics.mean(log_errors) * 100:.2f}%")
-    print(f"median log error: {statistics.median(log_errors) * 100:.2f}%")
-    print(f"std log error: {statistics.stdev(log_errors) * 100:.2f}%")
-    print(f"average signed log error: {statistics.mean(signed_log_errors) * 100:.2f}%")
-    print(f"median signed log error: {statistics.median(signed_log_errors) * 100:.2f}%")
-    print("\n\n")
+def load_state(category):
+    """
+    :param category: category of the experiment
+    :return: results table of the saved state
+    """
+    df = pd.DataFrame(load_journal(category).responses, columns=["image", "response", "gt", "time"])
+    return df.astype({"response": np.float64, "gt": np.float64, "time": np.float64})
 
 
 def process_intermediate(categorys):
     for category in categorys:
-        with open(f'states/{category}_saved_state.json', 'rb') as f:
-            results = json.load(fp=f)
-            responses = results["responses"]
-
-            gts = []
-            estimates = []
-            for name, estimate, gt, time in responses:
-                gts.append(gt)
-                estimates.append(estimate)
-
-            process(gts, estimates, category)
+        df = load_state(category)
+        process(df["gt"], df["response"], df["time"], category)
 
 
 def process_final(categories):
     for category in categories:
-        df = pd.read_csv(f"results/{category}_train.csv")
-
-        gts = list(df["GT"])
-        estimates = list(df["Response"])
-        times = list(df["Time"])
-
-        process(gts, estimates, times, category)
-        # with open("xvolume/data/bird.txt", "r") as f:
-        #     names = list(df["Image File"])
-        #     for i, line in enumerate(f.readlines()):
-        #         if line.strip() != names[i].split(".")[0].strip():
-        #             print(line.strip(), names[i].split(".")[0].strip(), "error")
+        df = analytics.read_results_csv(f"results/{category}_train.csv")
+        process(df["gt"], df["response"], df["time"], category)
 
 
-def process_intermediate_max_10(categorys):
+def process_intermediate_max_10(categorys, start=400):
     for category in categorys:
-        relative_errors = []
-        errors = []
-        with open(f'states/{category}_saved_state.json', 'rb') as f:
-            results = json.load(fp=f)
-            responses = results["responses"][400:]
-
-            for name, estimate, gt, time in responses:
-                gt = float(gt)
-                estimate = float(estimate)
-                relative_error = rel_error(gt, estimate)
-                signed_relative_error = signed_rel_error(gt, estimate)
-                heapq.heappush(relative_errors, (-relative_error, name, signed_relative_error))
-                errors.append(relative_error)
-
-            nsmallest = heapq.nsmallest(10, relative_errors)
-            # print(relative_errors)
-            for element in nsmallest:
-                print(f"{-element[0] * 100:.2f}%")
-            for element in nsmallest:
-                print(f"{element[2] * 100:.2f}%")
-            for element in nsmallest:
-                print(element[1].split(".")[0])
+        df = analytics.add_error_metrics(load_state(category).iloc[start:])
+        worst = analytics.top_k_worst(df, 10)
+        for relative_error in worst["relative_error"]:
+            print(f"{relative_error * 100:.2f}%")
+        for signed_relative_error in worst["signed_relative_error"]:
+            print(f"{signed_relative_error * 100:.2f}%")
+        for name in worst["image"]:
+            print(name.split(".")[0])
 
 
 def write_json_to_csv(csv_file, json_file):
-    with open(f'states/{json_file}.json', 'rb') as f:
-        results = json.load(fp=f)
-        responses = results["responses"]
-        with open(os.path.join("results", csv_file) + ".csv", 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['Image File', 'Response', 'GT', 'Time'])  # Writing header
-            for row in responses:
-                writer.writerow(row)
+    if json_file.endswith("_saved_state"):
+        responses = load_journal(json_file.removesuffix("_saved_state")).responses
+    else:
+        # a state saved under another name has no journal
+        with open(f'states/{json_file}.json', 'rb') as f:
+            responses = json.load(fp=f)["responses"]
+    with open(os.path.join("results", csv_file) + ".csv", 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Image File', 'Response', 'GT', 'Time'])  # Writing header
+        for row in responses:
+            writer.writerow(row)
 
 
 if __name__ == "__main__":
-    # process_intermediate(["bird"])
-    process_final(["bird"])
-    process_final(["dog"])
-    # process_final(["cat"])
-    # process_intermediate_max_10(["bird"])
+    parser = argparse.ArgumentParser("process intermediate results")
+    parser.add_argument("mode", choices=["final", "intermediate", "max10"],
+                        help="final: results/<category>_train.csv, intermediate: states/<category>_saved_state.json(l), "
+                             "max10: the 10 images with the largest relative error in the intermediate results")
+    parser.add_argument("categories", nargs="+", help="categories to process")
+    parser.add_argument("--start", type=int, default=400, help="first image considered by max10 (default 400)")
+    args = parser.parse_args()
+
+    if args.mode == "final":
+        process_final(args.categories)
+    elif args.mode == "intermediate":
+        process_intermediate(args.categories)
+    else:
+        process_intermediate_max_10(args.categories, args.start)
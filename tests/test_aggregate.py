@@ -0,0 +1,60 @@
+import csv
+import os
+
+import numpy as np
+
+from xvolume import aggregate, results
+from xvolume.journal import StateJournal
+from xvolume.utils import Scale
+
+
+def session(folder, answers, result_file=None):
+    """
+    This function saves the bird trials of a participant, as a finished session (results array and compacted state) if a result file is
+    given, else as a session in progress
+    :param answers: (image, size, gt, time) of each trial
+    """
+    os.makedirs(os.path.join(folder, "results"), exist_ok=True)
+    journal = StateJournal("bird", os.path.join(folder, "states"))
+    journal.reset()
+    responses, trials = [], []
+    for i, (image, size, gt, time) in enumerate(answers):
+        response = (f"{image}.jpg", str(round(size, 2)), f"{gt:.2f}", f"{time:.1f}")
+        trial = results.trial_metadata(size, size, gt, Scale.SMALL, 300, 200, time)
+        journal.append(i, response, time, trial)
+        responses.append(response)
+        trials.append(trial)
+    if result_file is None:
+        journal.close()
+        return
+    journal.compact()
+    results.save(os.path.join(folder, "results", result_file + ".npy"), results.to_array(responses, trials, "bird", "grid", "percent", 1200))
+
+
+def test_states_of_finished_sessions_are_dropped(tmp_path):
+    answers = [(f"2008_{i:06d}", 10.0 + i / 3, 20.0 + i / 7, 1.0 + i / 11) for i in range(6)]
+    session(str(tmp_path / "p1"), answers, "first")
+    df, _ = aggregate.aggregate([str(tmp_path)], str(tmp_path / "all.parquet"), workers=1)
+    assert len(df) == 6 and (df["kind"] == "results").all()
+
+
+def test_state_of_a_later_session_is_kept(tmp_path):
+    answers = [(f"2008_{i:06d}", 10.0 + i / 3, 20.0 + i / 7, 1.0 + i / 11) for i in range(6)]
+    session(str(tmp_path / "p1"), answers, "first")
+    # a second session of the category, with another tool, on the same images and with the same ground truth
+    session(str(tmp_path / "p1"), [(image, size * 2, gt, time + 0.5) for image, size, gt, time in answers[:3]])
+    df, _ = aggregate.aggregate([str(tmp_path)], str(tmp_path / "all.parquet"), workers=1)
+    assert (df["kind"] == "results").sum() == 6
+    assert (df["kind"] == "state").sum() == 3
+
+
+def test_result_csv_without_category(tmp_path):
+    answers = [(f"2008_{i:06d}", 10.0 + i / 3, 20.0 + i / 7, 1.0 + i / 11) for i in range(4)]
+    session(str(tmp_path / "p1"), answers, "first")
+    os.remove(tmp_path / "p1" / "results" / "first.npy")
+    with open(tmp_path / "p1" / "results" / "participant1.csv", 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Image File', 'Response', 'GT', 'Time'])
+        writer.writerows((f"{image}.jpg", str(round(size, 2)), f"{gt:.2f}", f"{time:.1f}") for image, size, gt, time in answers)
+    df, _ = aggregate.aggregate([str(tmp_path)], str(tmp_path / "all.parquet"), workers=1)
+    assert len(df) == 4 and np.array_equal(df["category"].astype(str).unique(), ["unknown"])
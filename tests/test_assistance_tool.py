@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from xvolume import backend
+from xvolume.headless import StubImageStim, StubTextStim, StubWindow, VOC_IMAGE_SIZES
+from xvolume.utils import AssistanceTool, ImageTool, Scale
+
+
+@pytest.fixture
+def window(monkeypatch):
+    monkeypatch.setattr(backend, "_modules", {})
+    backend.use(SimpleNamespace(ImageStim=StubImageStim, TextStim=StubTextStim), None, None)
+    monkeypatch.setattr(StubImageStim, "created", 0)
+    return StubWindow((1200, 900))
+
+
+@pytest.mark.parametrize("tool", ["grid", "absbox"])
+def test_overlays_are_created_once_per_scale(window, tool):
+    assistance_tool = AssistanceTool(tool, window)
+    for _ in range(10):
+        for width, height in VOC_IMAGE_SIZES:
+            width, height = ImageTool.resized_size(width, height, window.size[0])
+            for scale in (Scale.SMALL, Scale.LARGE, Scale.SMALL):
+                overlay = assistance_tool.overlay(width, height, scale)
+                assert tuple(overlay.size) == (width, height)
+                assert overlay.texture.shape == (height, width, 4)
+    assert StubImageStim.created == 2
+
+
+def test_overlay_is_rendered_for_the_current_size(window):
+    assistance_tool = AssistanceTool("grid", window)
+    small = assistance_tool.overlay(600, 450, Scale.SMALL).texture.copy()
+    assistance_tool.overlay(450, 600, Scale.SMALL)
+    assert np.array_equal(assistance_tool.overlay(600, 450, Scale.SMALL).texture, small)
+    assert not np.array_equal(assistance_tool.overlay(600, 450, Scale.LARGE).texture, small)
+
+
+def test_no_overlay_without_lines(window):
+    assistance_tool = AssistanceTool("none", window)
+    assert assistance_tool.overlay(600, 450, Scale.SMALL) is None
+    assert StubImageStim.created == 0
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from xvolume.gt_index import GroundTruthIndex, build_index
+
+
+def write_mask(dataset_path, image_id, rows):
+    mask = np.zeros((100, 200), dtype=np.uint8)
+    mask[:rows] = 3
+    Image.fromarray(mask, "L").convert("P").save(os.path.join(dataset_path, "SegmentationClassAug", image_id + ".png"))
+
+
+def dataset(path, ids):
+    os.makedirs(path / "SegmentationClassAug")
+    for rows, image_id in enumerate(ids, start=10):
+        write_mask(path, image_id, rows)
+    return str(path)
+
+
+def test_index_of_another_dataset_is_replaced(tmp_path):
+    index_file = str(tmp_path / "gt_index.npz")
+    first = dataset(tmp_path / "first", ["2008_000001", "2008_000002"])
+    index, computed, _ = build_index(first, ["2008_000001", "2008_000002"], index_file, workers=1)
+    assert computed == 2 and GroundTruthIndex.load(index_file).dataset_path == first
+
+    second = dataset(tmp_path / "second", ["2008_000002"])
+    index, computed, _ = build_index(second, ["2008_000002"], index_file, workers=1)
+    assert computed == 1
+    assert GroundTruthIndex.load(index_file).dataset_path == second
+    assert "2008_000001" not in index
+
+
+def test_changed_masks_are_left_out(tmp_path):
+    path = dataset(tmp_path / "voc", ["2008_000001", "2008_000002"])
+    index, _, _ = build_index(path, ["2008_000001", "2008_000002"], str(tmp_path / "gt_index.npz"), workers=1)
+    gt_files = [os.path.join(path, "SegmentationClassAug", f"2008_00000{i}.png") for i in (1, 2)]
+    assert index.unchanged(gt_files).percent("2008_000002", 3) == 11 * 200 / (100 * 200) * 100
+
+    write_mask(path, "2008_000002", 50)
+    os.utime(gt_files[1], (0, 0))
+    unchanged = index.unchanged(gt_files)
+    assert "2008_000001" in unchanged and "2008_000002" not in unchanged
@@ -0,0 +1,38 @@
+from xvolume.journal import StateJournal
+
+
+def response(index):
+    return [f"2008_{index:06d}.jpg", float(index), f"{index:.2f}", "1.0"]
+
+
+def test_resume_after_torn_line(tmp_path):
+    journal = StateJournal("bird", state_dir=str(tmp_path))
+    for index in range(3):
+        journal.append(index, response(index), float(index))
+    journal.close()
+    # the experiment was interrupted while the fourth record was written
+    with open(journal.journal_file, 'a') as f:
+        f.write('{"current_index": 3, "response": ["2008_0')
+
+    resumed = StateJournal("bird", state_dir=str(tmp_path))
+    assert resumed.load() and resumed.current_index == 2
+    for index in range(3, 5):
+        resumed.append(index, response(index), float(index))
+    resumed.close()
+
+    reloaded = StateJournal("bird", state_dir=str(tmp_path))
+    assert reloaded.load()
+    assert reloaded.current_index == 4
+    assert reloaded.responses == [response(index) for index in range(5)]
+
+
+def test_load_does_not_cut_the_journal(tmp_path):
+    # a reader may load the state while the last line is still written by the experiment
+    journal = StateJournal("bird", state_dir=str(tmp_path))
+    journal.append(0, response(0), 0.0)
+    with open(journal.journal_file, 'a') as f:
+        f.write('{"current_index": 1')
+    size = (tmp_path / "bird_saved_state.jsonl").stat().st_size
+    assert StateJournal("bird", state_dir=str(tmp_path)).load()
+    assert (tmp_path / "bird_saved_state.jsonl").stat().st_size == size
+    journal.close()
@@ -0,0 +1,71 @@
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from xvolume import aggregate, results
+from xvolume.journal import StateJournal
+from xvolume.scheduler import image_uncertainty, schedule
+from xvolume.utils import Scale
+
+IDS = [f"2008_{i:06d}" for i in range(10)]
+
+
+def finished_session(folder, images, seed):
+    """Results array, result CSV and compacted state of a finished bird session in a participant folder"""
+    rng = np.random.default_rng(seed)
+    cwd = os.getcwd()
+    os.makedirs(os.path.join(folder, "results"))
+    os.chdir(folder)
+    try:
+        journal = StateJournal("bird", checkpoint_interval=3)
+        responses, trials = [], []
+        for i, image in enumerate(images):
+            gt, size = rng.uniform(1, 60, 2)
+            response = (f"{image}.jpg", float(size), f"{gt:.2f}", "1.5")
+            trial = results.trial_metadata(size, float(size), float(gt), Scale.SMALL, 300, 200, 1.5)
+            journal.append(i, response, float(i), trial)
+            responses.append(response)
+            trials.append(trial)
+        journal.compact()
+        results.save(os.path.join("results", "responses.npy"), results.to_array(responses, trials, "bird", "grid", "percent", 1200))
+        with open(os.path.join("results", "responses.csv"), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Image File', 'Response', 'GT', 'Time'])
+            writer.writerows(responses)
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def participants(tmp_path):
+    # p1 answered every image, p2 the first half: the images of the second half have a single response
+    finished_session(tmp_path / "p1", IDS, seed=1)
+    finished_session(tmp_path / "p2", IDS[:5], seed=2)
+    return tmp_path
+
+
+def test_aggregated_history_counts_each_response_once(participants):
+    table = str(participants / "aggregated.parquet")
+    df, _ = aggregate.aggregate([str(participants)], table, workers=1)
+    assert len(df) == 15
+
+    uncertainty, gts = image_uncertainty([table], "bird", IDS)
+    expected, expected_gts = image_uncertainty([str(participants / p / "results" / "responses.npy") for p in ("p1", "p2")], "bird", IDS)
+    np.testing.assert_allclose(uncertainty, expected)
+    np.testing.assert_allclose(gts, expected_gts, atol=0.005)
+    assert np.isfinite(uncertainty[:5]).all() and np.isinf(uncertainty[5:]).all()
+
+
+def test_history_with_duplicated_states(participants):
+    # a table aggregated before the states of finished sessions were left out holds every response twice
+    sources = aggregate.find_sources([str(participants)])
+    table = str(participants / "duplicated.parquet")
+    aggregate.write_table(pd.concat([aggregate.read_source(file) for file in sources], ignore_index=True), table)
+
+    uncertainty, _ = image_uncertainty([table], "bird", IDS)
+    assert np.isinf(uncertainty[5:]).all()
+    order = schedule("uncertainty", IDS, np.full(len(IDS), np.nan), uncertainty)
+    assert sorted(order[:5]) == [5, 6, 7, 8, 9]
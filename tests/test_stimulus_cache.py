@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from xvolume.prefetch import prepare_trial
+from xvolume.stimulus_cache import StimulusCache
+from xvolume.utils import ImageTool
+
+
+def test_failed_write_leaves_the_stimulus_uncached(tmp_path):
+    image_file, gt_file = str(tmp_path / "2008_000001.jpg"), str(tmp_path / "2008_000001.png")
+    Image.new("RGB", (500, 375), (120, 80, 40)).save(image_file)
+    mask = np.zeros((375, 500), dtype=np.uint8)
+    mask[100:200, 100:300] = 3
+    Image.fromarray(mask, "L").convert("P").save(gt_file)
+
+    cache = StimulusCache(str(tmp_path / "cache"))
+    # the entry cannot replace a folder of the same name, as a full disk or a read-only cache folder the write fails
+    key = cache.key([image_file], 1200, "grid")
+    width, height = ImageTool.resized_size(500, 375, 1200)
+    os.makedirs(os.path.join(cache.cache_dir, f"{key}.{width}x{height}.npy"))
+    trial = prepare_trial(0, image_file, gt_file, 3, 1200, "grid", cache=cache)
+    assert trial.error is None
+    assert (trial.new_width, trial.new_height) == (width, height)
+    assert trial.gt == 100 * 200 / (500 * 375) * 100
+    assert not [name for name in os.listdir(cache.cache_dir) if name.endswith(".tmp")]
+    assert cache.get(key) is None
+
+
+def test_orphaned_writes_are_removed(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    (cache_dir / "0123.10x10.npy.140234.tmp").write_bytes(b"\x93NUMPY")
+    cache = StimulusCache(str(cache_dir))
+    assert len(cache) == 0
+    assert os.listdir(cache_dir) == []
@@ -1,56 +1,186 @@
 import csv
-import json
+import importlib
 import os
+import sys
+from time import perf_counter
 
-from psychopy import core
-
+from . import backend, results
 from .class_mapping import Index
+from .coordinator import StationClient
+from .gt_index import GroundTruthIndex, image_id
 from .instructions import *
+from .journal import JournalWriter, StateJournal
+from .manifest import Manifest, find_missing, listed_files, print_problems
+from .prefetch import CanvasPool, TrialCanvases, TrialPrefetcher, prepare_trial, warm_cache
+from .scheduler import trial_order
+from .profiling import profiler
+from .stimulus_cache import StimulusCache
+from .stimulus_pool import StimulusPool
 from .utils import *
 
 
+def quit_file_not_found(window, error, prefetcher, writer=None):
+    """
+    This function tells the observer which file is missing and quits the experiment, the intermediate results are saved
+    :param window: window
+    :param error: the OSError raised while preparing the trial
+    :param prefetcher: prefetcher to stop before quitting
+    :param writer: JournalWriter of the intermediate results, its queued records are written before quitting
+    """
+    prefetcher.close()
+    if writer is not None:
+        writer.close()
+    filename = error.filename if error.filename else str(error)
+    DisplayTool.display_file_not_found(window, os.sep.join(str(filename).split(os.sep)[-3:]))
+    window.close()
+    backend.core.quit()
+
+
+# subcommand to the module providing its main, the modules are only imported when their subcommand runs (the analysis modules import pandas)
+COMMANDS = {"index": "gt_index", "analyze": "analytics", "aggregate": "aggregate",
+            "significance": "significance", "headless": "headless",
+            "bench": "bench", "manifest": "manifest", "export": "results", "serve": "coordinator", "watch": "watch"}
+
+
 def main():
-    args = get_args()
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        importlib.import_module(f"xvolume.{COMMANDS[sys.argv[1]]}").main(sys.argv[2:])
+        return
 
+    args = get_args()
+    if args.profile:
+        profiler.enable()
+    try:
+        run(args)
+    finally:
+        # also written when the experiment is quit with ESC
+        if args.profile:
+            profiler.write(os.path.join("results", args.result_file))
+
+
+def dataset_files(args):
+    """
+    This function lists the files of the category and quits if some of them are missing
+    :param args: arguments from get_args
+    :return: image files, mask files, training image files, training mask files, GroundTruthIndex
+    """
+    # the files listed for the category, resolved and checked once by `python -m xvolume manifest` if a manifest of this dataset exists
+    dataset_manifest = Manifest.load(args.manifest)
+    if dataset_manifest is not None and (dataset_manifest.dataset_path != os.path.abspath(args.dataset_path)
+                                         or args.category not in dataset_manifest.lists):
+        print(f"{args.manifest} does not cover {args.category} in {args.dataset_path}, the files are checked instead")
+        dataset_manifest = None
+    if dataset_manifest is not None:
+        image_files, gt_files = dataset_manifest.files(args.category)
+        ob_training_image_files, ob_training_gt_files = dataset_manifest.files(args.category, training=True)
+        incomplete = [f"{i}: image or mask missing or unreadable" for i in dataset_manifest.incomplete(args.category)]
+        # ground truth areas of the masks, measured with the manifest
+        ground_truth_index = dataset_manifest.gt_index
+    else:
+        image_files, gt_files = listed_files(args.dataset_path, args.category)
+        ob_training_image_files, ob_training_gt_files = listed_files(args.dataset_path, args.category, training=True)
+        incomplete = [f"{file}: missing" for file in find_missing(image_files + gt_files + ob_training_image_files[:NUM_TRAINING_IMAGES] +
+                                                                  ob_training_gt_files[:NUM_TRAINING_IMAGES])]
+        # ground truth areas computed offline with `python -m xvolume index`, masks that are not indexed or changed since are decoded
+        ground_truth_index = GroundTruthIndex.load(args.gt_index)
+        if len(ground_truth_index) and ground_truth_index.dataset_path != os.path.abspath(args.dataset_path):
+            print(f"{args.gt_index} is not an index of {args.dataset_path}, the masks are decoded instead (run `python -m xvolume index` again)")
+            ground_truth_index = GroundTruthIndex()
+        else:
+            ground_truth_index = ground_truth_index.unchanged(gt_files + ob_training_gt_files[:NUM_TRAINING_IMAGES])
+    if incomplete:
+        print_problems(incomplete)
+        sys.exit(f"{len(incomplete)} files of the {args.category} experiment are missing, check the dataset path {args.dataset_path}")
+    return image_files, gt_files, ob_training_image_files, ob_training_gt_files, ground_truth_index
+
+
+def run(args, observer=None):
+    """
+    This function runs the training and the experiment of a category
+    :param args: arguments from get_args
+    :param observer: scripted observer of the headless mode, it is shown each trial once the image is on screen
+    """
     class_index = Index.get_index(args.category)
 
     window_width = int(args.window_size.split(",")[0])
 
-    # Set up the Window
-    assert "," in args.window_size and len(args.window_size.split(",")) == 2 and all([s.isdigit() for s in args.window_size.split(",")]), \
-        "window size argument must be two positive integers separated by ',' representing the display window size."
+    station = None
+    if args.station is not None:
+        # the stimuli, ground truth and order prepared once by the coordinator for all the stations
+        station = StationClient(args.station, args.authkey, args.result_file)
+        if station.store.category != args.category or station.store.window_width != window_width:
+            sys.exit(f"the coordinator serves {station.store.category} for a window width of {station.store.window_width}")
+        listed_image_files, listed_gt_files = station.store.image_files, station.store.gt_files
+        ob_training_image_files, ob_training_gt_files = station.store.training_image_files, station.store.training_gt_files
+        scheduled = station.order
+    else:
+        listed_image_files, listed_gt_files, ob_training_image_files, ob_training_gt_files, ground_truth_index = dataset_files(args)
+        scheduled = trial_order(args.order, [image_id(file) for file in listed_image_files], ground_truth_index, class_index, args.history,
+                                args.category, args.budget)
+
+    # the order of the images, computed at startup for a new experiment and saved with its state, so that it is resumed in the same order
+    journal = StateJournal(args.category)
+    saved = journal.load()
+    if saved:
+        order = journal.order if journal.order is not None else list(range(len(listed_image_files)))
+    else:
+        order = journal.order = scheduled
+    image_files, gt_files = [listed_image_files[k] for k in order], [listed_gt_files[k] for k in order]
+    n = len(image_files)
 
-    mywin = visual.Window(list(map(int, args.window_size.split(","))), monitor="testMonitor", units="pix")
+    if args.dry_run:
+        print(f"{args.category}: {n} of {len(listed_image_files)} images ({args.order} order), "
+              f"{min(NUM_TRAINING_IMAGES, len(ob_training_image_files))} training images, all files found")
+        if saved and journal.current_index + 1 < n:
+            print(f"the unfinished experiment resumes at image #{journal.current_index + 2} of {n} in its saved order")
+        return
+
+    # resized and padded stimuli shared by the sessions run with the same window size and assistance tool
+    stimulus_cache = StimulusCache(args.cache_dir, args.cache_size * 1024 ** 2) if args.cache_size > 0 else None
+
+    # padded frames are reused once their stimulus is uploaded, enough for the trials prepared ahead and the one on screen
+    canvases = CanvasPool(window_width, size=2 * (args.prefetch + 1)) if args.assistance_tool == "absbox" and not args.warm_cache else None
+    # the trials prepared ahead and never shown give their canvases back when a prefetcher is closed
+    discard = canvases.release_trial if canvases is not None else None
+
+    num_training_images = min(NUM_TRAINING_IMAGES, len(ob_training_image_files))
+
+    def prepare_training_trial(j):
+        if station is not None:
+            return station.store.trial(j, j, args.assistance_tool, training=True, canvases=canvases)
+        return prepare_trial(j, ob_training_image_files[j], ob_training_gt_files[j], class_index, window_width, args.assistance_tool,
+                             with_mask=True, gt_index=ground_truth_index, cache=stimulus_cache, canvases=canvases)
+
+    def prepare_experiment_trial(j):
+        if station is not None:
+            return station.store.trial(order[j], j, args.assistance_tool, canvases=canvases)
+        return prepare_trial(j, image_files[j], gt_files[j], class_index, window_width, args.assistance_tool,
+                             gt_index=ground_truth_index, cache=stimulus_cache, canvases=canvases)
+
+    if args.warm_cache:
+        assert stimulus_cache is not None, "--warm-cache needs a cache size larger than 0"
+        assert station is None, "the stimuli of a station are prepared by the coordinator"
+        # all the listed images, whatever the order and budget of the session
+        errors = warm_cache(prepare_training_trial, num_training_images) + \
+            warm_cache(lambda j: prepare_trial(j, listed_image_files[j], listed_gt_files[j], class_index, window_width, args.assistance_tool,
+                                               gt_index=ground_truth_index, cache=stimulus_cache), len(listed_image_files))
+        for error in errors:
+            print(error)
+        print(f"{len(stimulus_cache)} stimuli in {args.cache_dir}")
+        return
+
+    # prepare the training images in the background while PsychoPy is imported, the window opens and the instructions are shown
+    training_prefetcher = TrialPrefetcher(prepare_training_trial, n=num_training_images, depth=args.prefetch, discard=discard)
+    training_prefetcher.start(0)
+
+    # Set up the Window
+    mywin = backend.visual.Window(list(map(int, args.window_size.split(","))), monitor="testMonitor", units="pix")
 
     # initialize assistance tool
     assistance_tool = AssistanceTool(args.assistance_tool, mywin)
 
-    # Specify your image directory
-    base_dir = args.dataset_path
-    image_dir = os.path.join(base_dir, "JPEGImages" + os.sep)
-    gt_dir = os.path.join(base_dir, "SegmentationClassAug" + os.sep)
-
-    category_file = os.path.join(__package__, "data", F"{args.category}.txt")
-    image_files = []
-    gt_files = []
-
-    with open(category_file, 'r') as f:
-        for line in f.readlines():
-            file = line.strip()
-            image_files.append(os.path.join(image_dir, file + ".jpg"))
-            filename = file.split(".")[0]
-            gt_files.append(os.path.join(gt_dir, filename + ".png"))
-
-    n = len(image_files)
-
-    ob_training_image_files = []
-    ob_training_gt_files = []
-    with open(os.path.join(__package__, "data", f"{args.category}_training_images.txt"), 'r') as f:
-        for line in f.readlines():
-            ob_training_img_file = os.path.join(image_dir, line.strip() + ".jpg")
-            ob_training_gt_file = os.path.join(gt_dir, line.strip() + ".png")
-            ob_training_image_files.append(ob_training_img_file)
-            ob_training_gt_files.append(ob_training_gt_file)
+    # the image stimuli and the labels are created once and updated for each trial
+    stimuli = StimulusPool(mywin)
 
     # show training instructions
     DisplayTool.display_instructions(mywin, training_instruction(args.category))
@@ -59,261 +189,281 @@ def main():
     skip = False
     training_responses = []
     training_gts = []
-    for i in range(NUM_TRAINING_IMAGES):
+    for i in range(num_training_images):
         scale = Scale.SMALL
 
-        ob_training_img_file = ob_training_image_files[i]
-        ob_training_gt_file = ob_training_gt_files[i]
-
-        with Image.open(ob_training_img_file) as img:
-            original_width, original_height = img.size
-            image_stimulus, new_width, new_height = ImageTool.resize_image(original_width, original_height, window_width, img)
-            if args.assistance_tool == 'absbox':
-                image_stimulus = ImageTool.pad_image(window_width, image_stimulus)
-
-        with Image.open(ob_training_gt_file) as gt:
-            gt_ndarr = np.array(gt)
-            gt = (gt_ndarr == class_index).sum() / (original_width * original_height) * 100
-
-            gt_ndarr[gt_ndarr != class_index] = 0
-            mask = colorize_mask(gt_ndarr)
-            mask = mask.convert("RGB")
-            img = Image.open(ob_training_img_file)
-            img_mask = Image.blend(img, mask, alpha=0.8)
-            img_mask_stimulus, new_width, new_height = ImageTool.resize_image(original_width, original_height, window_width, img_mask)
-            if args.assistance_tool == 'absbox':
-                img_mask_stimulus = ImageTool.pad_image(window_width, img_mask_stimulus)
-            training_gts.append(float(gt))
-
-        # Ask for the observer's estimate after the image is shown
-        input_text = visual.TextStim(win=mywin, text='', pos=(0, (-window_width) // INPUT_TEXT_POSITION), height=window_width // IMAGE_FONT)
-
-        # display the number of image
-        num_img_text = visual.TextStim(win=mywin, text='', pos=(0, window_width // INPUT_TEXT_POSITION), height=window_width // IMAGE_FONT)
-
-        response = ''
-
-        # Create a visual stimulus for the image
-        stimulus = visual.ImageStim(win=mywin, image=image_stimulus, size=image_stimulus.size)
-        user_input_done = False
-
-        ground_truth_text = ""
-        keys = []
-        while True:  # Keep looping until they press 'enter'
-            keys = event.getKeys()
-            if 'escape' in keys:
-                skip = True
-                break
-
-            if not user_input_done:
-                if 'up' in keys:
-                    scale = Scale.LARGE
-
-                if 'down' in keys:
-                    scale = Scale.SMALL
-
-            if 'return' in keys:
-                if VerificationTool.valid_input(response, args.unit, args.assistance_tool, new_width, new_height, scale,
-                                                window_width):  # Check if the response is a float between 0 and 100
-                    # Display the ground truth size of the image
-                    if not user_input_done:
-                        user_input_done = True
-
-                        # Add response to the training_responses
-                        size = ComputeTool.compute_size(response,
-                                                        tool=args.assistance_tool,
-                                                        unit=args.unit,
-                                                        image_width=new_width,
-                                                        image_height=new_height,
-                                                        scale=scale,
-                                                        window_width=window_width)
-                        training_responses.append(float(size))
-
-                        # set ground truth text
-                        ground_truth_text = visual.TextStim(win=mywin, text='', pos=(0, (-window_width) / GROUND_TRUTH_TEXT_POSITION),
-                                                            height=window_width // IMAGE_FONT)
-                        ground_truth_text.setText(ComputeTool.compute_ground_truth_image_size(gt, args.assistance_tool, args.unit, new_width, new_height, scale, window_width))
-
-                        # set visual stimulus to the blend of image and mask
-                        stimulus = visual.ImageStim(win=mywin, image=img_mask_stimulus, size=img_mask_stimulus.size)
-                        keys.pop()
-                    else:
-                        break
-                else:  # If not a valid input, prompt the observer and reset the response
-                    response = ''
-                    prompt = visual.TextStim(win=mywin, pos=(0, 0), height=window_width // IMAGE_FONT, color=PROMPT_COLOR)
-                    prompt.setText(VerificationTool.invalid_input_value(args.unit, args.assistance_tool, new_width, new_height, scale, window_width))
-                    prompt.draw()
-                    mywin.flip()
-                    core.wait(INVALID_INPUT_DISPLAY_TIME)
-
-            elif 'backspace' in keys:
-                response = response[:-1]  # Remove the last character
-            elif len(keys) > 0:
-                if not user_input_done and VerificationTool.is_digit_or_dot(keys[0]):  # if the ground truth size is not shown, add keys to the response
-                    if keys[0] == "period":
-                        response += '.'
-                    else:
-                        response += keys[0]  # Add the pressed key to the string
+        trial_id = image_id(ob_training_image_files[i])
+        trial_start = perf_counter()
+        with profiler.span("wait", trial_id):
+            trial = training_prefetcher.get(i)
+        if trial.error is not None:
+            quit_file_not_found(mywin, trial.error, training_prefetcher)
+        with TrialCanvases(canvases, trial) as trial_canvases:
+            image_stimulus, img_mask_stimulus = trial.image_stimulus, trial.mask_stimulus
+            new_width, new_height, gt = trial.new_width, trial.new_height, trial.gt
+            training_gts.append(gt)
+            measurement = MeasurementContext(args.assistance_tool, args.unit, new_width, new_height, window_width)
+
+            # Ask for the observer's estimate after the image is shown
+            input_text = stimuli.text("training_input", "Your estimate: ", pos=(0, (-window_width) // INPUT_TEXT_POSITION), height=window_width // IMAGE_FONT)
+
+            # display the number of image
+            num_img_text = stimuli.text("training_counter", f"image# {i + 1} / {num_training_images}", pos=(0, window_width // INPUT_TEXT_POSITION),
+                                        height=window_width // IMAGE_FONT)
+
+            response = ''
+
+            # Show the image in the visual stimulus
+            with profiler.span("upload", trial_id):
+                stimulus = stimuli.image("image", image_stimulus)
+            trial_canvases.release(image_stimulus)
+            user_input_done = False
+
+            ground_truth_text = ""
+            # the screen is only redrawn when the response, the scale or the feedback changes
+            shown = None
+            on_screen = False
+            while True:  # Keep looping until they press 'enter'
+                state = (response, scale, user_input_done)
+                if state != shown:
+                    if shown is not None and response != shown[0]:
+                        input_text.setText("Your estimate: " + response)
+                    stimulus.draw()
+                    input_text.draw()
+                    num_img_text.draw()
+                    if user_input_done:
+                        ground_truth_text.draw()
+                    assistance_tool(stimulus, scale)
+                    profiler.flip(mywin, trial_id)
+                    if not on_screen:
+                        on_screen = True
+                        profiler.record("first_flip", trial_id, perf_counter() - trial_start)
+                        if observer is not None:
+                            observer.show(trial, training=True)
+                    shown = state
+
+                keys = backend.event.waitKeys(clearEvents=False)
+                if 'escape' in keys:
+                    skip = True
+                    break
 
-            input_text.setText("Your estimate: " + response)
-            num_img_text.setText(f"image# {i + 1} / {NUM_TRAINING_IMAGES}")
-            stimulus.draw()
-            input_text.draw()
-            num_img_text.draw()
-            if user_input_done:
-                ground_truth_text.draw()
-            assistance_tool(stimulus, scale)
-            mywin.flip()
+                if not user_input_done:
+                    if 'up' in keys:
+                        scale = Scale.LARGE
+
+                    if 'down' in keys:
+                        scale = Scale.SMALL
+
+                if 'return' in keys:
+                    if measurement.valid_input(response, scale):  # Check if the response is a number within the limit of the scale
+                        # Display the ground truth size of the image
+                        if not user_input_done:
+                            user_input_done = True
+
+                            # Add response to the training_responses
+                            size = measurement.size(response, scale)
+                            training_responses.append(float(size))
+
+                            # set ground truth text
+                            ground_truth_text = stimuli.text("ground_truth", measurement.ground_truth_text(gt, scale),
+                                                             pos=(0, (-window_width) / GROUND_TRUTH_TEXT_POSITION), height=window_width // IMAGE_FONT)
+
+                            # set visual stimulus to the blend of image and mask
+                            stimulus = stimuli.image("mask", img_mask_stimulus)
+                            trial_canvases.release(img_mask_stimulus)
+                        else:
+                            break
+                    else:  # If not a valid input, prompt the observer and reset the response
+                        response = ''
+                        prompt = stimuli.text("invalid_input", measurement.invalid_messages[scale], pos=(0, 0), height=window_width // IMAGE_FONT, color=PROMPT_COLOR)
+                        prompt.draw()
+                        mywin.flip()
+                        backend.core.wait(INVALID_INPUT_DISPLAY_TIME)
+                        input_text.setText("Your estimate: ")
+                        shown = None
+
+                elif 'backspace' in keys:
+                    response = response[:-1]  # Remove the last character
+                elif len(keys) > 0:
+                    if not user_input_done and VerificationTool.is_digit_or_dot(keys[0]):  # if the ground truth size is not shown, add keys to the response
+                        if keys[0] == "period":
+                            response += '.'
+                        else:
+                            response += keys[0]  # Add the pressed key to the string
 
         if skip:
             break
+    training_prefetcher.close()
     # show statistics of experimental results
     if not skip:
         avg = StatisticsTool.training_experimental_results_statistics(training_responses, training_gts)
         DisplayTool.display_training_statistics(mywin, avg)
 
+    # prepare the first images of the experiment while the instructions are shown, from the saved state if there is one
+    prefetcher = TrialPrefetcher(prepare_experiment_trial, n=n, depth=args.prefetch, discard=discard)
+    prefetcher.start(journal.current_index + 1)
+
     # show size estimation instructions
     DisplayTool.display_instructions(mywin, estimation_instruction(args.category))
 
     # Check for saved state
     double_confirm = False
-    try:
-        with open(os.path.join("states", f'{args.category}_saved_state.json'), 'r') as f:
-            saved_state = json.load(f)
-            start_index = saved_state['current_index'] + 1
-            responses = saved_state['responses']
-            saved_elapsed_time = saved_state['elapsed_time']
-
-            load_state = f"You have an UNFINISHED experiment! \n\n 1. Press Y to continue the unfinished experiment from the #{start_index + 1} image. " \
-                         f"\n 2. Press N to start a new experiment and your previous intermediate results may be deleted!"
-            prompt = visual.TextStim(win=mywin, text=load_state, pos=(0, 0), height=window_width // IMAGE_FONT, wrapWidth=window_width / INSTRUCTION_WIDTH,
-                                     color=PROMPT_COLOR)
-            while True:
-                prompt.draw()
-                mywin.flip()
-                keys = event.getKeys()
-                if 'y' in keys:
+    if saved:
+        start_index = journal.current_index + 1
+
+        load_state = f"You have an UNFINISHED experiment! \n\n 1. Press Y to continue the unfinished experiment from the #{start_index + 1} image. " \
+                     f"\n 2. Press N to start a new experiment and your previous intermediate results may be deleted!"
+        prompt = backend.visual.TextStim(win=mywin, text=load_state, pos=(0, 0), height=window_width // IMAGE_FONT, wrapWidth=window_width / INSTRUCTION_WIDTH,
+                                         color=PROMPT_COLOR)
+        while True:
+            prompt.draw()
+            mywin.flip()
+            keys = backend.event.waitKeys(keyList=['y', 'n'])
+            if 'y' in keys:
+                break
+            if 'n' in keys:
+                if not double_confirm:
+                    load_state = f"Are you sure you DON'T want to resume your UNFINISHED experiment? Your intermediate results will be deleted! Press Y to resume UNFINISHED experiment. Press N to delete intermediate results and start a new experiment."
+                    prompt = backend.visual.TextStim(win=mywin, text=load_state, pos=(0, 0), height=window_width // IMAGE_FONT,
+                                                     wrapWidth=window_width / INSTRUCTION_WIDTH,
+                                                     color=PROMPT_COLOR)
+                    double_confirm = True
+                else:
+                    journal.reset()
+                    start_index = 0
+                    if scheduled != order:
+                        # the new experiment is shown in the order computed for this session
+                        prefetcher.close()
+                        order = scheduled
+                        image_files, gt_files = [listed_image_files[k] for k in order], [listed_gt_files[k] for k in order]
+                        n = len(image_files)
+                        prefetcher = TrialPrefetcher(prepare_experiment_trial, n=n, depth=args.prefetch, discard=discard)
+                    journal.order = order
                     break
-                if 'n' in keys:
-                    if not double_confirm:
-                        load_state = f"Are you sure you DON'T want to resume your UNFINISHED experiment? Your intermediate results will be deleted! Press Y to resume UNFINISHED experiment. Press N to delete intermediate results and start a new experiment."
-                        prompt = visual.TextStim(win=mywin, text=load_state, pos=(0, 0), height=window_width // IMAGE_FONT,
-                                                 wrapWidth=window_width / INSTRUCTION_WIDTH,
-                                                 color=PROMPT_COLOR)
-                        double_confirm = True
-                    else:
-                        start_index = 0
-                        responses = []
-                        saved_elapsed_time = 0
-                        break
-    except FileNotFoundError:
+    else:
         start_index = 0
-        responses = []
-        saved_elapsed_time = 0
+    responses = journal.responses
+    saved_elapsed_time = journal.elapsed_time
+    if station is not None:
+        station.start(args.assistance_tool, args.unit, window_width, responses, journal.trials)
 
     # Start the timer with the saved elapsed time
-    experiment_timer = core.Clock()
+    experiment_timer = backend.core.Clock()
     experiment_timer.addTime(saved_elapsed_time)  # Adjust the timer by adding the saved elapsed time
 
+    # the responses are appended to the journal on a background thread
+    writer = JournalWriter(journal)
     for i in range(start_index, n):
         scale = Scale.SMALL
-        start_time = experiment_timer.getTime()
-        image_file = image_files[i]
-        gt_file = gt_files[i]
-        try:
-            with Image.open(image_file) as img:
-                original_width, original_height = img.size
-                image_stimulus, new_width, new_height = ImageTool.resize_image(original_width, original_height, window_width, img)
-                if args.assistance_tool == 'absbox':
-                    image_stimulus = ImageTool.pad_image(window_width, image_stimulus)
-        except FileNotFoundError:
-            image_path = os.sep.join(image_file.split(os.sep)[-3:])
-            DisplayTool.display_file_not_found(mywin, image_path)
-        except Exception as e:
-            print(e)
-
-        with Image.open(gt_file) as gt:
-            gt_ndarr = np.array(gt)
-            gt = (gt_ndarr == class_index).sum() / (original_width * original_height) * 100
-
-        # Ask for the observer's estimate after the image is shown
-        input_text = visual.TextStim(win=mywin, text='', pos=(0, (-window_width) / INPUT_TEXT_POSITION), height=window_width // IMAGE_FONT)
-
-        # display the number of image
-        num_img_text = visual.TextStim(win=mywin, text='', pos=(0, window_width / IMAGE_NUMBER_TEXT_POSITION), height=window_width // IMAGE_FONT)
-
-        # display the duration of time
-        time_display = visual.TextStim(win=mywin, pos=(0, window_width / TIME_TEXT_POSITION), color=PROMPT_COLOR, height=window_width // IMAGE_FONT)
-        response = ''
-
-        # Create a visual stimulus for the image
-        stimulus = visual.ImageStim(win=mywin, image=image_stimulus, size=image_stimulus.size)
-
-        while True:  # Keep looping until they press 'enter'
-            # keep displaying the elapsed time and listening for the key.
-            elapsed_time = experiment_timer.getTime()
-            time_display.text = f"Elapsed Time: {elapsed_time:.0f} seconds"
-
-            keys = event.getKeys()
-            if 'escape' in keys:
-                # Save the state
-                mywin.close()
-                core.quit()
-
-            if 'up' in keys:
-                scale = Scale.LARGE
-
-            if 'down' in keys:
-                scale = Scale.SMALL
-
-            if 'return' in keys:
-                if VerificationTool.valid_input(response, args.unit, args.assistance_tool, new_width, new_height, scale, window_width):
-                    break
-                else:  # If not a valid input, prompt the observer and reset the response
-                    response = ''
-                    prompt = visual.TextStim(win=mywin, pos=(0, 0), height=window_width // IMAGE_FONT, color=PROMPT_COLOR)
-                    prompt.setText(VerificationTool.invalid_input_value(args.unit, args.assistance_tool, new_width, new_height, scale, window_width))
-                    prompt.draw()
-                    mywin.flip()
-                    core.wait(INVALID_INPUT_DISPLAY_TIME)
-
-            elif 'backspace' in keys:
-                response = response[:-1]  # Remove the last character
-            elif len(keys) > 0 and VerificationTool.is_digit_or_dot(keys[0]):
-                if keys[0] == "period":
-                    response += '.'
-                else:
-                    response += keys[0]  # Add the pressed key to the string
-
-            input_text.setText("Your estimate: " + response)
-            num_img_text.setText(f"image# {i + 1} / {n}")
-            stimulus.draw()
-            time_display.draw()
-            input_text.draw()
-            num_img_text.draw()
-            assistance_tool(stimulus, scale)
-            mywin.flip()
+        trial_id = image_id(image_files[i])
+        trial_start = perf_counter()
+        with profiler.span("wait", trial_id):
+            trial = prefetcher.get(i)
+        if trial.error is not None:
+            quit_file_not_found(mywin, trial.error, prefetcher, writer)
+        with TrialCanvases(canvases, trial) as trial_canvases:
+            image_stimulus, new_width, new_height, gt = trial.image_stimulus, trial.new_width, trial.new_height, trial.gt
+            measurement = MeasurementContext(args.assistance_tool, args.unit, new_width, new_height, window_width)
+
+            # Ask for the observer's estimate after the image is shown
+            input_text = stimuli.text("input", "Your estimate: ", pos=(0, (-window_width) / INPUT_TEXT_POSITION), height=window_width // IMAGE_FONT)
+
+            # display the number of image
+            num_img_text = stimuli.text("counter", f"image# {i + 1} / {n}", pos=(0, window_width / IMAGE_NUMBER_TEXT_POSITION), height=window_width // IMAGE_FONT)
+
+            # display the duration of time
+            time_display = stimuli.text("time", pos=(0, window_width / TIME_TEXT_POSITION), color=PROMPT_COLOR, height=window_width // IMAGE_FONT)
+            response = ''
+
+            # Show the image in the visual stimulus
+            with profiler.span("upload", trial_id):
+                stimulus = stimuli.image("image", image_stimulus)
+            trial_canvases.release(image_stimulus)
+
+            # the time spent on the image starts once it is on screen
+            start_time = None
+            # the screen is only redrawn when the response, the scale or the displayed elapsed time (once per second) changes
+            shown = None
+            while True:  # Keep looping until they press 'enter'
+                elapsed_time = experiment_timer.getTime()
+                state = (response, scale, round(elapsed_time))
+                if state != shown:
+                    if shown is not None and response != shown[0]:
+                        input_text.setText("Your estimate: " + response)
+                    if shown is None or state[2] != shown[2]:
+                        time_display.text = f"Elapsed Time: {elapsed_time:.0f} seconds"
+                    stimulus.draw()
+                    time_display.draw()
+                    input_text.draw()
+                    num_img_text.draw()
+                    assistance_tool(stimulus, scale)
+                    profiler.flip(mywin, trial_id)
+                    if start_time is None:
+                        start_time = experiment_timer.getTime()
+                        profiler.record("first_flip", trial_id, perf_counter() - trial_start)
+                        if observer is not None:
+                            observer.show(trial, training=False)
+                    shown = state
+
+                # listen for keys until the displayed elapsed time changes
+                keys = backend.event.waitKeys(maxWait=round(elapsed_time) + 0.5 - elapsed_time, clearEvents=False) or []
+                if 'escape' in keys:
+                    # the state is saved once the queued responses are written
+                    prefetcher.close()
+                    writer.close()
+                    journal.close()
+                    mywin.close()
+                    backend.core.quit()
+
+                if 'up' in keys:
+                    scale = Scale.LARGE
+
+                if 'down' in keys:
+                    scale = Scale.SMALL
+
+                if 'return' in keys:
+                    if measurement.valid_input(response, scale):
+                        break
+                    else:  # If not a valid input, prompt the observer and reset the response
+                        response = ''
+                        prompt = stimuli.text("invalid_input", measurement.invalid_messages[scale], pos=(0, 0), height=window_width // IMAGE_FONT, color=PROMPT_COLOR)
+                        prompt.draw()
+                        mywin.flip()
+                        backend.core.wait(INVALID_INPUT_DISPLAY_TIME)
+                        input_text.setText("Your estimate: ")
+                        shown = None
+
+                elif 'backspace' in keys:
+                    response = response[:-1]  # Remove the last character
+                elif len(keys) > 0 and VerificationTool.is_digit_or_dot(keys[0]):
+                    if keys[0] == "period":
+                        response += '.'
+                    else:
+                        response += keys[0]  # Add the pressed key to the string
 
-        size = ComputeTool.compute_size(response,
-                                        tool=args.assistance_tool,
-                                        unit=args.unit,
-                                        image_width=new_width,
-                                        image_height=new_height,
-                                        scale=scale,
-                                        window_width=window_width)
-        end_time = experiment_timer.getTime()
-        time = end_time - start_time
-        responses.append((image_file.split(os.sep)[-1], size, f"{gt:.2f}", f"{time:.1f}"))
-        with open(os.path.join("states", f'{args.category}_saved_state.json'), 'w') as f:
-            elapsed_time = experiment_timer.getTime()
-            json.dump({'current_index': i, 'responses': responses, 'elapsed_time': elapsed_time}, f)
+            size = measurement.size(response, scale)
+            end_time = experiment_timer.getTime()
+            time = end_time - start_time
+            metadata = results.trial_metadata(response, measurement.percent(response, scale), gt, scale, new_width, new_height, time)
+            response = (trial.image_file.split(os.sep)[-1], size, f"{gt:.2f}", f"{time:.1f}")
+            with profiler.span("save", trial_id):
+                writer.append(i, response, experiment_timer.getTime(), metadata)
+                if station is not None:
+                    station.result(response, metadata, args.assistance_tool, args.unit)
+    prefetcher.close()
+    writer.close()
+    journal.compact()
 
     with open(os.path.join("results", args.result_file) + ".csv", 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(['Image File', 'Response', 'GT', 'Time'])  # Writing header
         for row in responses:
             writer.writerow(row)
+    # the same results with full precision and the metadata of each trial
+    results.save(os.path.join("results", args.result_file) + ".npy",
+                 results.to_array(responses, journal.trials, args.category, args.assistance_tool, args.unit, window_width))
+    if station is not None:
+        station.close()
 
     avg_error, total_time = StatisticsTool.experimental_results_statistics(responses)
     DisplayTool.display_final_statistics(mywin, avg_error, total_time)
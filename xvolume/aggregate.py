@@ -0,0 +1,153 @@
+"""
+Aggregation of the results of many participants into one columnar table
+
+    python -m xvolume aggregate <participant folders ...> -o results/all.parquet
+
+Every `results/*.csv`, `results/*.npy` and state (`states/*_saved_state.json` with its journal `*_saved_state.jsonl`) below the given
+folders is parsed (in parallel) and written to one Parquet or Feather table with the columns image, response, gt, time, category,
+participant, kind (results or state) and source, plus the trial metadata of the results arrays (see analytics.read_results_npy). A result
+CSV is skipped when the results array of the session exists, and the trials of a state that are also in a results file of the participant
+(the state of a finished session) are left out, so every trial is in the table once. Running it again only re-reads the files that were
+added or changed since the last run, and the states of the participants whose files changed.
+"""
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from xvolume import analytics
+
+
+def participant_from_file(file):
+    """The participant is the folder holding the results/states folder, or the file name for loose files"""
+    folder = os.path.dirname(os.path.abspath(file))
+    if os.path.basename(folder) in ("results", "states"):
+        return os.path.basename(os.path.dirname(folder))
+    return os.path.splitext(os.path.basename(file))[0]
+
+
+def find_sources(folders):
+    """
+    :param folders: folders to search recursively
+    :return: sorted list of result CSV, results array and state checkpoint files (the checkpoint may not exist yet)
+    """
+    files = set()
+    for folder in folders:
+        files.update(glob.glob(os.path.join(folder, "**", "results", "*.npy"), recursive=True))
+        # a state is named by its checkpoint, which is not written before the first 100 trials
+        for pattern in ("*_saved_state.json", "*_saved_state.jsonl"):
+            files.update(analytics.state_name(file) for file in glob.glob(os.path.join(folder, "**", "states", pattern), recursive=True))
+        for file in glob.glob(os.path.join(folder, "**", "results", "*.csv"), recursive=True):
+            # the results array has the same responses, CSV files exported from an array are not result files
+            if os.path.splitext(file)[0] + ".npy" not in files and not file.endswith("_trials.csv"):
+                files.add(file)
+    return sorted(os.path.abspath(file) for file in files)
+
+
+def read_source(file):
+    """
+    :param file: result CSV, results array or state checkpoint file
+    :return: results table of the file
+    """
+    if file.endswith(".json"):
+        df = analytics.read_state(file).assign(kind="state")
+    elif file.endswith(".npy"):
+        df = analytics.read_results_npy(file).assign(kind="results")
+    else:
+        df = analytics.read_results_csv(file).assign(kind="results")
+    return df.assign(participant=participant_from_file(file), source=file)
+
+
+def signature(file):
+    """
+    :param file: source file
+    :return: modification times and sizes of the file, and of the journal of a state
+    """
+    files = [file, os.path.splitext(file)[0] + ".jsonl"] if file.endswith(".json") else [file]
+    return [[stat.st_mtime_ns, stat.st_size] for stat in (os.stat(f) for f in files if os.path.exists(f))]
+
+
+def drop_finished_states(df):
+    """
+    :param df: aggregated table
+    :return: the table without the state rows of the trials that are also in a results file of the participant, the state of a finished
+             session holds the same trials as its results. Trials are matched on the whole response as it is written in the state
+             (participant, category, image, response and ground truth with 2 decimals, time with 1 decimal), so the state of a later
+             session of the category is kept. A result file whose name does not give its category matches states of any category
+    """
+    state = (df["kind"] == "state").to_numpy()
+    if not state.any():
+        return df
+    category = df["category"].astype(str).to_numpy()
+    trial = [df["participant"].astype(str), df["image"].astype(str), np.char.mod("%.2f", df["response"].to_numpy(dtype=np.float64)),
+             np.char.mod("%.2f", df["gt"].to_numpy(dtype=np.float64)), np.char.mod("%.1f", df["time"].to_numpy(dtype=np.float64))]
+    key = pd.MultiIndex.from_arrays(trial + [category])
+    any_category = pd.MultiIndex.from_arrays(trial)
+    unknown = category == "unknown"
+    duplicate = state & (key.isin(key[~state & ~unknown]) | any_category.isin(any_category[~state & unknown]))
+    return df[~duplicate]
+
+
+def write_table(df, file):
+    df = df.astype({"category": "category", "participant": "category", "kind": "category", "source": "category"})
+    tmp_file = file + ".tmp"
+    if file.endswith(".feather"):
+        df.reset_index(drop=True).to_feather(tmp_file)
+    else:
+        df.to_parquet(tmp_file, index=False)
+    os.replace(tmp_file, file)
+
+
+def aggregate(folders, output, workers=None):
+    """
+    This function updates the aggregated table with the source files that are new or changed since the last run
+    :param folders: participant folders
+    :param output: Parquet (.parquet) or Feather (.feather) file
+    :param workers: number of processes, default is the number of cores
+    :return: aggregated table, number of files read
+    """
+    sources_file = output + ".sources.json"
+    previous_sources = {}
+    previous = None
+    if os.path.exists(output) and os.path.exists(sources_file):
+        with open(sources_file, 'r') as f:
+            previous_sources = json.load(f)
+        previous = analytics.read_table(output)
+
+    sources = {file: signature(file) for file in find_sources(folders)}
+    changed = [file for file, files_signature in sources.items() if previous_sources.get(file) != files_signature]
+    # the states are matched against the results of their participant, they are read again when these change
+    participants = {participant_from_file(file) for file in changed + list(set(previous_sources) - set(sources))}
+    changed += [file for file in sources if file.endswith(".json") and file not in changed and participant_from_file(file) in participants]
+
+    tables = []
+    if previous is not None:
+        unchanged = set(sources) - set(changed)
+        tables.append(previous[previous["source"].astype(str).isin(unchanged)])
+    if changed:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tables.extend(executor.map(read_source, changed))
+
+    df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=["image", "response", "gt", "time", "category", "participant",
+                                                                                   "kind", "source"])
+    df = drop_finished_states(df).reset_index(drop=True)
+    write_table(df, output)
+    with open(sources_file, 'w') as f:
+        json.dump(sources, f)
+    return df, len(changed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume aggregate", description="Aggregate the results of many participants into one table")
+    parser.add_argument("folders", nargs="+", help="folders holding results/ and states/ folders of the participants")
+    parser.add_argument("--output", "-o", type=str, default=os.path.join("results", "aggregated.parquet"),
+                        help="aggregated table, .parquet or .feather (default results/aggregated.parquet)")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="number of processes (default number of cores)")
+    args = parser.parse_args(argv)
+
+    df, read = aggregate(args.folders, args.output, args.workers)
+    print(f"{read} files read, {len(df)} rows from {df['source'].nunique()} files in {args.output}")
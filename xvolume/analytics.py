@@ -0,0 +1,252 @@
+"""
+Vectorized analysis of experimental results
+
+All error metrics are computed as arrays in one pass over a results table, which can hold the results of many participants and
+categories:
+    python -m xvolume analyze results/*.csv states/*_saved_state.json --by category participant --top-k 10
+
+A state is read with its journal (journal.StateJournal), so it holds every trial saved so far.
+
+Results arrays (results/*.npy) also provide the tool, unit, scale and stimulus size of each trial, e.g. `--by category scale`.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from xvolume import results
+from xvolume.class_mapping import Index
+from xvolume.journal import StateJournal
+
+METRICS = ["relative_error", "signed_relative_error", "log_error", "signed_log_error"]
+CSV_COLUMNS = {"Image File": "image", "Response": "response", "GT": "gt", "Time": "time"}
+STATE_SUFFIXES = ("_saved_state.json", "_saved_state.jsonl")
+
+
+def error_metrics(gts, estimates):
+    """
+    This function computes all error metrics of the estimates at once
+    :param gts: ground truth sizes (array-like, percent)
+    :param estimates: estimated sizes (array-like, percent)
+    :return: dict of metric name to ndarray
+    """
+    gts = np.asarray(gts, dtype=np.float64)
+    estimates = np.asarray(estimates, dtype=np.float64)
+    signed_relative_errors = (estimates - gts) / gts
+    signed_log_errors = np.log2(1 + estimates) - np.log2(1 + gts)
+    return {"relative_error": np.abs(signed_relative_errors),
+            "signed_relative_error": signed_relative_errors,
+            "log_error": np.abs(signed_log_errors),
+            "signed_log_error": signed_log_errors}
+
+
+def add_error_metrics(df):
+    """
+    :param df: results table with columns gt and response
+    :return: the table with a column per error metric
+    """
+    return df.assign(**error_metrics(df["gt"].to_numpy(), df["response"].to_numpy()))
+
+
+def category_from_file(file):
+    """The category is the prefix of the file name, e.g. results/bird_train.csv or states/bird_saved_state.json"""
+    prefix = os.path.basename(file).split("_")[0].split(".")[0]
+    return prefix if prefix in Index.mapping else "unknown"
+
+
+def read_results_csv(file):
+    """
+    :param file: result file written by the experiment
+    :return: results table with columns image, response, gt, time, category, participant
+    """
+    df = pd.read_csv(file, usecols=lambda column: column in CSV_COLUMNS,
+                     dtype={"Image File": str, "Response": np.float64, "GT": np.float64, "Time": np.float64})
+    df = df.rename(columns=CSV_COLUMNS)
+    return df.assign(category=category_from_file(file), participant=os.path.splitext(os.path.basename(file))[0])
+
+
+def state_name(file):
+    """
+    :param file: checkpoint (.json) or journal (.jsonl) of a state
+    :return: checkpoint file of the state, the name of both files
+    """
+    return os.path.splitext(file)[0] + ".json"
+
+
+def read_state(file):
+    """
+    :param file: checkpoint (.json) or journal (.jsonl) of the intermediate results saved in the states folder, the state is the checkpoint
+                 and the trials appended to the journal since
+    :return: results table with columns image, response, gt, time, category, participant
+    """
+    file = state_name(file)
+    name = os.path.basename(file)
+    if name.endswith(STATE_SUFFIXES[0]):
+        journal = StateJournal(name[:-len(STATE_SUFFIXES[0])], os.path.dirname(file))
+        journal.load()
+        responses = journal.responses
+    else:
+        # a state saved under another name has no journal
+        with open(file, 'r') as f:
+            responses = json.load(f)["responses"]
+    df = pd.DataFrame(responses, columns=["image", "response", "gt", "time"]).astype({"response": np.float64, "gt": np.float64, "time": np.float64})
+    return df.assign(category=category_from_file(file), participant=os.path.splitext(os.path.basename(file))[0])
+
+
+def read_results_npy(file):
+    """
+    :param file: results array written by the experiment
+    :return: results table with columns image, response, gt, time, category, participant, the trial metadata (tool, unit, scale,
+    input (the response in the input unit), image_width, image_height, window_width) and the trial index
+    """
+    return results_table(results.load(file), os.path.splitext(os.path.basename(file))[0])
+
+
+def read_stations_npz(file):
+    """
+    :param file: results of the stations gathered by `python -m xvolume serve`
+    :return: results table of all the stations, the participant is the name of the station
+    """
+    with np.load(file) as data:
+        return pd.concat([results_table(data[name], name) for name in data.files], ignore_index=True)
+
+
+def results_table(array, participant):
+    """
+    :param array: results array
+    :param participant: name of the participant
+    :return: results table, see read_results_npy
+    """
+    columns = {name: pd.Categorical.from_codes(array[name], categories) for name, categories in results.CODES.items()}
+    return pd.DataFrame({"image": array["image"], "response": array["size"], "gt": array["gt"], "time": array["time"],
+                         "category": columns["category"], "participant": participant,
+                         "tool": columns["tool"], "unit": columns["unit"], "scale": columns["scale"], "input": array["response"],
+                         "image_width": array["image_width"], "image_height": array["image_height"], "window_width": array["window_width"],
+                         "trial": array["index"]})
+
+
+def read_table(file):
+    """
+    :param file: table aggregated with `python -m xvolume aggregate` (.parquet or .feather)
+    :return: results table
+    """
+    if file.endswith(".feather"):
+        return pd.read_feather(file)
+    return pd.read_parquet(file)
+
+
+def read_results(file):
+    if file.endswith((".parquet", ".feather")):
+        return read_table(file)
+    if file.endswith((".json", ".jsonl")):
+        return read_state(file)
+    if file.endswith(".npy"):
+        return read_results_npy(file)
+    if file.endswith(".npz"):
+        return read_stations_npz(file)
+    return read_results_csv(file)
+
+
+def load_results(files):
+    """
+    :param files: result CSV files, results arrays, states (checkpoint or journal) and/or aggregated tables
+    :return: one results table with the error metrics
+    """
+    # the checkpoint and the journal of a state are read once
+    files = list(dict.fromkeys(state_name(file) if file.endswith((".json", ".jsonl")) else file for file in files))
+    return add_error_metrics(pd.concat([read_results(file) for file in files], ignore_index=True))
+
+
+def summarize(df, by=None):
+    """
+    This function computes the statistics of every error metric, per group if `by` is given
+    :param df: results table with the error metrics
+    :param by: list of columns to group by, e.g. category, participant, tool, scale
+    :return: table with a row per group and columns count, time_mean and <metric>_<mean|median|std>
+    """
+    aggregations = {"count": ("gt", "size"), "time_mean": ("time", "mean")}
+    for metric in METRICS:
+        for statistic in ("mean", "median", "std"):
+            aggregations[f"{metric}_{statistic}"] = (metric, statistic)
+    return groupby(df, by).agg(**aggregations)
+
+
+def groupby(df, by=None):
+    """
+    :param df: results table
+    :param by: list of columns, the whole table is one group if empty
+    :return: DataFrameGroupBy, the group names are scalars when grouping by one column and tuples otherwise
+    """
+    if not by:
+        return df.groupby(np.zeros(len(df), dtype=np.int8))
+    return df.groupby(by[0] if len(by) == 1 else list(by), sort=True, observed=True)
+
+
+def top_k_worst(df, k=10, metric="relative_error"):
+    """
+    :param df: results table with the error metrics
+    :param k: number of images
+    :param metric: error metric to rank by
+    :return: the k rows with the largest error, largest first
+    """
+    values = df[metric].to_numpy()
+    k = min(k, len(values))
+    if k == 0:
+        return df.iloc[:0]
+    idx = np.argpartition(-values, k - 1)[:k]
+    idx = idx[np.argsort(-values[idx], kind="stable")]
+    return df.iloc[idx]
+
+
+def print_summary(summary, name, by=("category",)):
+    """
+    This function prints one row of `summarize` in percent
+    :param summary: row of the summary table
+    :param name: name of the group, a tuple when grouping by several columns
+    :param by: columns of the grouping, the whole table if empty
+    """
+    if not by:
+        print("all")
+    else:
+        names = name if isinstance(name, tuple) else (name,)
+        print(", ".join(f"{column}: {value}" for column, value in zip(by, names)))
+    print(f"{int(summary['count'])} data points")
+
+    print("-" * 20 + "relative error" + "-" * 20)
+    print(f"average time: {summary['time_mean']:.1f}")
+    print(f"average relative error: {summary['relative_error_mean'] * 100:.2f}%")
+    print(f"median relative error: {summary['relative_error_median'] * 100:.2f}%")
+    print(f"std relative error: {summary['relative_error_std'] * 100:.2f}%")
+    print(f"average signed relative error: {summary['signed_relative_error_mean'] * 100:.2f}%")
+    print(f"median signed relative error: {summary['signed_relative_error_median'] * 100:.2f}%")
+
+    print("-" * 20 + "log error" + "-" * 20)
+    print(f"average log error: {summary['log_error_mean'] * 100:.2f}%")
+    print(f"median log error: {summary['log_error_median'] * 100:.2f}%")
+    print(f"std log error: {summary['log_error_std'] * 100:.2f}%")
+    print(f"average signed log error: {summary['signed_log_error_mean'] * 100:.2f}%")
+    print(f"median signed log error: {summary['signed_log_error_median'] * 100:.2f}%")
+    print("\n\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume analyze", description="Statistics of the size estimation errors")
+    parser.add_argument("files", nargs="+", help="result CSV files, results arrays (.npy, .npz), states (.json, .jsonl) and/or aggregated tables "
+                                                     "(.parquet, .feather)")
+    parser.add_argument("--by", nargs="*", default=["category"], help="columns to group by (default category)")
+    parser.add_argument("--top-k", type=int, default=0, help="also list the k images with the largest relative error per group")
+    parser.add_argument("--output", "-o", type=str, default=None, help="write the summary table to this CSV file")
+    args = parser.parse_args(argv)
+
+    df = load_results(args.files)
+    summary = summarize(df, args.by)
+    for name, group in groupby(df, args.by):
+        print_summary(summary.loc[name], name if args.by else "all", args.by)
+        if args.top_k:
+            for _, worst in top_k_worst(group, args.top_k).iterrows():
+                print(f"{worst['image']}: {worst['relative_error'] * 100:.2f}% ({worst['signed_relative_error'] * 100:.2f}%)")
+            print()
+    if args.output:
+        summary.to_csv(args.output)
@@ -0,0 +1,28 @@
+"""
+Window, stimuli, keyboard and clocks used by the experiment
+
+The experiment uses `backend.visual`, `backend.event` and `backend.core`, which are the PsychoPy modules unless `use` swaps in another
+implementation with the same interface (e.g. the stubs of the headless mode). PsychoPy takes seconds to import, so it is only imported
+when one of its modules is first used, i.e. when the window is opened.
+"""
+import importlib
+
+MODULES = ("visual", "event", "core")
+_modules = {}
+
+
+def __getattr__(name):
+    if name not in MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name not in _modules:
+        _modules[name] = importlib.import_module(f"psychopy.{name}")
+    return _modules[name]
+
+
+def use(visual_module, event_module, core_module):
+    """
+    :param visual_module: provides Window, ImageStim and TextStim
+    :param event_module: provides waitKeys
+    :param core_module: provides Clock, wait and quit
+    """
+    _modules.update(visual=visual_module, event=event_module, core=core_module)
@@ -0,0 +1,170 @@
+"""
+Micro-benchmarks of the computations run on every trial or keystroke and of the result analysis
+
+    python -m xvolume bench --save  # writes the baseline, benchmarks/baseline.json
+    python -m xvolume bench --threshold 10  # fails if a benchmark is more than 10% slower than the baseline
+
+Inputs are synthetic: VOC-sized images and masks, and response tables. Each benchmark reports the best time per call over several
+repeats, which is the least noisy estimate on a shared machine.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from xvolume import analytics, scheduler
+from xvolume.gt_index import class_counts
+from xvolume.utils import ComputeTool, ImageTool, MeasurementContext, Scale, StatisticsTool, VerificationTool, colorize_mask
+
+DEFAULT_BASELINE_FILE = os.path.join("benchmarks", "baseline.json")
+WINDOW_WIDTH = 1200
+IMAGE_SIZE = (500, 375)  # most common size of the VOC images
+NUM_RESPONSES = 1000
+
+
+def synthetic_image(width, height, rng):
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.stack([(x * rng.uniform(0.2, 0.5) + y * rng.uniform(0.1, 0.4)) % 256 for _ in range(3)], axis=-1)
+    return Image.fromarray(np.clip(image + rng.normal(0, 12, image.shape), 0, 255).astype(np.uint8), "RGB")
+
+
+def synthetic_mask(width, height, rng):
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for index in rng.integers(1, 21, size=3):
+        top, left = rng.integers(0, height // 2), rng.integers(0, width // 2)
+        mask[top:top + rng.integers(20, height // 2), left:left + rng.integers(20, width // 2)] = index
+    mask[:, :2] = 255  # void border
+    return mask
+
+
+def synthetic_responses(n, rng):
+    gts = rng.uniform(0.5, 90, n)
+    estimates = gts * np.exp(rng.normal(0, 0.3, n))
+    times = rng.uniform(1, 20, n)
+    return [(f"2008_{i:06d}.jpg", f"{e:.2f}", f"{g:.2f}", f"{t:.1f}") for i, (e, g, t) in enumerate(zip(estimates, gts, times))]
+
+
+def benchmarks():
+    """
+    :return: dict of benchmark name to the function it times, in the order they run
+    """
+    import process_intermediate_results
+
+    rng = np.random.default_rng(0)
+    image = synthetic_image(*IMAGE_SIZE, rng)
+    resized, width, height = ImageTool.resize_image(*IMAGE_SIZE, WINDOW_WIDTH, image)
+    mask = synthetic_mask(*IMAGE_SIZE, rng)
+    mask_image = Image.fromarray(mask, "L")
+    responses = synthetic_responses(NUM_RESPONSES, rng)
+    estimates = [float(response[1]) for response in responses]
+    gts = [float(response[2]) for response in responses]
+    df = pd.DataFrame({"image": [response[0] for response in responses], "response": estimates, "gt": gts,
+                       "time": [float(response[3]) for response in responses]})
+    df_metrics = analytics.add_error_metrics(df)
+    gt_array, estimate_array = np.asarray(gts), np.asarray(estimates)
+    measurement = MeasurementContext("absbox", "boxes", width, height, WINDOW_WIDTH)
+    widths, heights = np.full(NUM_RESPONSES, width), np.full(NUM_RESPONSES, height)
+    scales = rng.choice([Scale.SMALL.name, Scale.LARGE.name], NUM_RESPONSES)
+    ids = [response[0] for response in responses]
+    uncertainty = rng.exponential(1, NUM_RESPONSES)
+
+    def quiet(function, *args):
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                function(*args)
+        return run
+
+    return {
+        "resize_image": lambda: ImageTool.resize_image(*IMAGE_SIZE, WINDOW_WIDTH, image),
+        "pad_image": lambda: ImageTool.pad_image(WINDOW_WIDTH, resized),
+        "colorize_mask": lambda: colorize_mask(mask),
+        "overlay_mask": lambda: ImageTool.overlay_mask(resized, mask_image, 1),
+        "class_counts": lambda: class_counts(mask_image),
+        "compute_size_absbox": lambda: ComputeTool.compute_size("12.5", "absbox", "boxes", width, height, Scale.SMALL, WINDOW_WIDTH),
+        "compute_size_grid": lambda: ComputeTool.compute_size("12.5", "grid", "boxes", width, height, Scale.LARGE, WINDOW_WIDTH),
+        "compute_ground_truth_image_size": lambda: ComputeTool.compute_ground_truth_image_size(23.4, "absbox", "boxes", width, height,
+                                                                                               Scale.SMALL, WINDOW_WIDTH),
+        "valid_input_absbox": lambda: VerificationTool.valid_input("12.5", "boxes", "absbox", width, height, Scale.SMALL, WINDOW_WIDTH),
+        "valid_input_invalid": lambda: VerificationTool.valid_input("12..5", "percent", "grid", width, height, Scale.SMALL, WINDOW_WIDTH),
+        "measurement_context": lambda: MeasurementContext("absbox", "boxes", width, height, WINDOW_WIDTH),
+        "measurement_valid_input": lambda: measurement.valid_input("12.5", Scale.SMALL),
+        "measurement_size": lambda: measurement.size("12.5", Scale.SMALL),
+        "to_percent": lambda: MeasurementContext.to_percent(estimate_array, "absbox", "boxes", widths, heights, scales, WINDOW_WIDTH),
+        "uncertainty_order": lambda: scheduler.schedule("uncertainty", ids, gt_array, uncertainty),
+        "stratified_order": lambda: scheduler.schedule("stratified", ids, gt_array, uncertainty),
+        "training_statistics": lambda: StatisticsTool.training_experimental_results_statistics(estimates, gts),
+        "experimental_statistics": lambda: StatisticsTool.experimental_results_statistics(responses),
+        "log_error": lambda: process_intermediate_results.log_error(gt_array, estimate_array),
+        "rel_error": lambda: process_intermediate_results.rel_error(gt_array, estimate_array),
+        "process": quiet(process_intermediate_results.process, gts, estimates, df["time"], "bench"),
+        "add_error_metrics": lambda: analytics.add_error_metrics(df),
+        "top_k_worst": lambda: analytics.top_k_worst(df_metrics, 10),
+    }
+
+
+def measure(function, repeat=5):
+    """
+    :param function: function without arguments
+    :param repeat: number of repeats
+    :return: best time per call in seconds
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def compare(results, baseline, threshold):
+    """
+    :param results: dict of benchmark name to seconds per call
+    :param baseline: dict of benchmark name to seconds per call
+    :param threshold: allowed slowdown in percent
+    :return: names of the benchmarks slower than the baseline by more than the threshold
+    """
+    return [name for name, seconds in results.items() if name in baseline and seconds > baseline[name] * (1 + threshold / 100)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume bench", description="Benchmark the per-trial computations and the result analysis")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE_FILE, help=f"baseline JSON file (default {DEFAULT_BASELINE_FILE})")
+    parser.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=10.0, help="slowdown in percent over the baseline that fails the run (default 10)")
+    parser.add_argument("--repeat", type=int, default=5, help="repeats of each benchmark, the best is kept (default 5)")
+    parser.add_argument("-k", type=str, default=None, help="only run the benchmarks whose name contains this string")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)["benchmarks"]
+
+    results = {}
+    print(f"{'benchmark':<34}{'us/call':>12}{'baseline':>12}{'change':>10}")
+    for name, function in benchmarks().items():
+        if args.k is not None and args.k not in name:
+            continue
+        results[name] = measure(function, args.repeat)
+        line = f"{name:<34}{results[name] * 1e6:>12.2f}"
+        if name in baseline:
+            line += f"{baseline[name] * 1e6:>12.2f}{(results[name] / baseline[name] - 1) * 100:>+9.1f}%"
+        print(line)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "processor": platform.processor(),
+                       "benchmarks": {**baseline, **results}}, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmarks are more than {args.threshold:g}% slower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
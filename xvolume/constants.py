@@ -6,6 +6,9 @@ NUM_TRAINING_IMAGES = 30
 
 PROMPT_COLOR = "white"
 GRID_LINE_COLOR = "yellow"
+GRID_LINE_WIDTH = 2
+PAD_COLOR = (128, 128, 128)
+MASK_ALPHA = 0.8
 
 SMALL_SCALE_NUM_ROW = 4
 SMALL_SCALE_NUM_COL = 5
@@ -24,3 +27,9 @@ TIME_TEXT_POSITION = 3.2
 GROUND_TRUTH_TEXT_POSITION = 3.0
 IMAGE_FONT = 55
 INSTRUCTION_WIDTH = 1.4
+
+CATEGORIES = ['aeroplane', 'bicycle', 'bird', 'boat',
+              'bottle', 'bus', 'car', 'cat', 'chair',
+              'cow', 'diningtable', 'dog', 'horse',
+              'motorbike', 'person', 'pottedplant',
+              'sheep', 'sofa', 'train', 'tvmonitor', 'test']
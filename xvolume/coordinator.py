@@ -0,0 +1,295 @@
+"""
+Coordinator of the stations running the same category at the same time
+
+    python -m xvolume serve -dp <path to VOC2012> -c dog --address 0.0.0.0:6000  # on one machine, prints a random key
+    python -m xvolume -c dog --station <coordinator host>:6000 --authkey <key> -f participant1  # on each station
+
+The coordinator decodes and resizes every image of the category once, computes its ground truth and the training mask overlays, and
+writes them to a stimulus store (`cache/sessions/<category>_<window width>`): the pixels of all stimuli in one flat `pixels.npy`, an index
+of their offsets, sizes and ground truth, and `session.json` with the file lists. The stations memory-map the store, so its pages are read
+from the page cache shared by all the processes of the machine (or from the shared folder) instead of each station decoding the dataset,
+and they only pad the images for the absolute boxes. The coordinator also hands out the trial order and gathers the responses of every
+station into one file (`results/<category>_stations.npz`, one results array per station, read by `python -m xvolume analyze`). The messages
+are pickled, so only the holders of the key can connect: the coordinator generates a random key unless one is given with `--authkey`.
+"""
+import argparse
+import json
+import os
+import queue
+import secrets
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from PIL import Image
+
+from xvolume import results
+from xvolume.class_mapping import Index
+from xvolume.constants import NUM_TRAINING_IMAGES
+from xvolume.gt_index import class_counts, image_id
+from xvolume.prefetch import PreparedTrial, SourceImage
+from xvolume.utils import ImageTool, get_args
+
+DEFAULT_ADDRESS = "localhost:6000"
+DEFAULT_STORE_DIR = os.path.join("cache", "sessions")
+
+STORE_INDEX_DTYPE = np.dtype([("offset", np.int64), ("mask_offset", np.int64),  # -1 if the row has no mask overlay
+                              ("width", np.int32), ("height", np.int32), ("gt", np.float64)])
+
+
+def parse_address(address):
+    """
+    :param address: host:port
+    :return: (host, port)
+    """
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def _resized_size(image_file, window_width):
+    with Image.open(image_file) as image:
+        return ImageTool.resized_size(*image.size, window_width)
+
+
+def build_store(store_dir, image_files, gt_files, training_image_files, training_gt_files, category, window_width, gt_index=None,
+                workers=None):
+    """
+    This function prepares the stimuli of a category into a store, the rows are the listed images followed by the training images
+    :param store_dir: folder of the store, replaced if it exists
+    :param gt_index: GroundTruthIndex, the masks of the images it covers are only decoded for the training overlays
+    :param workers: number of threads
+    """
+    class_index = Index.get_index(category)
+    files = list(zip(image_files, gt_files)) + list(zip(training_image_files, training_gt_files))
+    training = np.arange(len(files)) >= len(image_files)
+
+    # the sizes are known from the headers, so every stimulus is written to its place in the store as soon as it is prepared
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        sizes = np.array(list(executor.map(lambda file: _resized_size(file[0], window_width), files)), dtype=np.int64).reshape(-1, 2)
+    index = np.zeros(len(files), dtype=STORE_INDEX_DTYPE)
+    index["width"], index["height"] = sizes[:, 0], sizes[:, 1]
+    nbytes = sizes[:, 0] * sizes[:, 1] * 3
+    blocks = np.where(training, 2 * nbytes, nbytes)
+    index["offset"] = np.cumsum(blocks) - blocks
+    index["mask_offset"] = np.where(training, index["offset"] + nbytes, -1)
+
+    tmp_dir = store_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    pixels = np.lib.format.open_memmap(os.path.join(tmp_dir, "pixels.npy"), mode="w+", dtype=np.uint8, shape=(int(blocks.sum()),))
+
+    def prepare(row):
+        image_file, gt_file = files[row]
+        image, width, height = SourceImage(image_file, window_width).resize()
+        offset = index["offset"][row]
+        pixels[offset:offset + nbytes[row]] = np.asarray(image).reshape(-1)
+        gt = gt_index.percent(image_id(image_file), class_index) if gt_index is not None else None
+        if gt is None or training[row]:
+            with Image.open(gt_file) as gt_image:
+                gt_image.load()
+            if gt is None:
+                gt = class_counts(gt_image)[class_index] / (gt_image.width * gt_image.height) * 100
+            if training[row]:
+                offset = index["mask_offset"][row]
+                pixels[offset:offset + nbytes[row]] = np.asarray(ImageTool.overlay_mask(image, gt_image, class_index)).reshape(-1)
+        return gt
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        index["gt"] = list(executor.map(prepare, range(len(files))))
+    pixels.flush()
+    del pixels
+    np.save(os.path.join(tmp_dir, "index.npy"), index)
+    with open(os.path.join(tmp_dir, "session.json"), 'w') as f:
+        json.dump({"category": category, "window_width": window_width, "image_files": image_files, "gt_files": gt_files,
+                   "training_image_files": training_image_files, "training_gt_files": training_gt_files}, f)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.replace(tmp_dir, store_dir)
+
+
+class StimulusStore:
+    """Read side of a store written by build_store, the pixels are memory-mapped"""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "session.json"), 'r') as f:
+            session = json.load(f)
+        self.category = session["category"]
+        self.window_width = session["window_width"]
+        self.image_files, self.gt_files = session["image_files"], session["gt_files"]
+        self.training_image_files, self.training_gt_files = session["training_image_files"], session["training_gt_files"]
+        self.index = np.load(os.path.join(store_dir, "index.npy"))
+        self.pixels = np.load(os.path.join(store_dir, "pixels.npy"), mmap_mode="r")
+
+    def _image(self, offset, width, height):
+        return Image.fromarray(self.pixels[offset:offset + width * height * 3].reshape(height, width, 3), "RGB")
+
+    def trial(self, k, index, tool, training=False, canvases=None):
+        """
+        :param k: position of the image in the list (experiment or training)
+        :param index: index of the trial
+        :param tool: assistance tool, the stimuli are padded for absbox
+        :param training: training image, with the mask overlay
+        :param canvases: CanvasPool the absbox stimuli are padded into
+        :return: PreparedTrial
+        """
+        row = len(self.image_files) + k if training else k
+        offset, mask_offset, width, height, gt = self.index[row].tolist()
+        image_stimulus = self._image(offset, width, height)
+        mask_stimulus = self._image(mask_offset, width, height) if training else None
+        if tool == "absbox":
+            image_stimulus = ImageTool.pad_image(self.window_width, image_stimulus, canvases.acquire() if canvases is not None else None)
+            if mask_stimulus is not None:
+                mask_stimulus = ImageTool.pad_image(self.window_width, mask_stimulus, canvases.acquire() if canvases is not None else None)
+        image_file = self.training_image_files[k] if training else self.image_files[k]
+        return PreparedTrial(index, image_file, image_stimulus, mask_stimulus, width, height, gt)
+
+
+class Coordinator:
+    """Hands out the store and the trial order to the stations and gathers their responses"""
+
+    def __init__(self, store_dir, order, output):
+        """
+        :param store_dir: folder of the stimulus store
+        :param order: positions of the listed images in presentation order
+        :param output: file the responses of all stations are written to
+        """
+        self.store_dir = os.path.abspath(store_dir)
+        self.order = order
+        self.output = output
+        self.category = StimulusStore(store_dir).category
+        self.stations = {}  # station name to its session: window_width, responses, trials, and tools and units of the responses
+        self.lock = threading.Lock()
+
+    def handle(self, connection):
+        """
+        This function serves one station until it disconnects, the messages are (kind, station, ...) tuples
+        """
+        name = None
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    break
+                kind, name = message[0], message[1]
+                if kind == "hello":
+                    connection.send({"store": self.store_dir, "order": self.order})
+                    print(f"{name} connected")
+                elif kind == "start":
+                    # the state of the station when its experiment starts, replaces what was gathered before (resumed or restarted)
+                    tool, unit, window_width, responses, trials = message[2:]
+                    with self.lock:
+                        self.stations[name] = {"window_width": window_width, "responses": list(responses), "trials": list(trials),
+                                               "tools": [tool] * len(responses), "units": [unit] * len(responses)}
+                elif kind == "result":
+                    # every response carries the tool and unit the station ran it with
+                    response, trial, tool, unit = message[2:]
+                    with self.lock:
+                        station = self.stations.get(name)
+                        if station is None:
+                            print(f"{name} sent a result before starting its experiment, the result is ignored")
+                            continue
+                        station["responses"].append(response)
+                        station["trials"].append(trial)
+                        station["tools"].append(tool)
+                        station["units"].append(unit)
+                elif kind == "done":
+                    break
+                else:
+                    print(f"{name} sent an unknown message {kind!r}, it is ignored")
+        if name is not None:
+            self.save()
+            print(f"{name} disconnected, {len(self.stations.get(name, {}).get('responses', []))} responses")
+
+    def save(self):
+        # under the lock, stations disconnecting at the same time would write the same temporary file
+        with self.lock:
+            arrays = {name: results.to_array(station["responses"], station["trials"], self.category, station["tools"], station["units"],
+                                             station["window_width"]) for name, station in self.stations.items()}
+            os.makedirs(os.path.dirname(self.output) or ".", exist_ok=True)
+            tmp_file = self.output + ".tmp.npz"
+            np.savez(tmp_file, **arrays)
+            os.replace(tmp_file, self.output)
+
+    def serve(self, address, authkey):
+        with Listener(parse_address(address), authkey=authkey.encode()) as listener:
+            print(f"serving {self.category} on {address}")
+            while True:
+                threading.Thread(target=self.handle, args=(listener.accept(),), daemon=True).start()
+
+
+class StationClient:
+    """Connection of a station to the coordinator, the messages are sent on a background thread to keep the socket off the render thread"""
+
+    def __init__(self, address, authkey, name):
+        """
+        :param address: host:port of the coordinator
+        :param name: name of the station in the gathered results
+        """
+        self.name = name
+        self.connection = Client(parse_address(address), authkey=authkey.encode())
+        self.connection.send(("hello", name))
+        session = self.connection.recv()
+        self.store = StimulusStore(session["store"])
+        self.order = session["order"]
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="station", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            message = self.queue.get()
+            try:
+                self.connection.send(message)
+            except OSError:
+                # the coordinator is gone, the station still saves its own results
+                break
+            if message[0] == "done":
+                break
+        self.connection.close()
+
+    def start(self, tool, unit, window_width, responses, trials):
+        self.queue.put(("start", self.name, tool, unit, window_width, list(responses), list(trials)))
+
+    def result(self, response, trial, tool, unit):
+        self.queue.put(("result", self.name, response, trial, tool, unit))
+
+    def close(self):
+        """
+        This function sends the queued messages and disconnects
+        """
+        self.queue.put(("done", self.name))
+        self.thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume serve", description="Prepare the stimuli of a category once and serve them to the stations")
+    parser.add_argument("--address", type=str, default=DEFAULT_ADDRESS, help=f"host:port the stations connect to (default {DEFAULT_ADDRESS})")
+    parser.add_argument("--store-dir", type=str, default=DEFAULT_STORE_DIR, help=f"folder of the stimulus stores (default {DEFAULT_STORE_DIR})")
+    parser.add_argument("--output", "-o", type=str, default=None, help="responses of all stations (default results/<category>_stations.npz)")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="number of threads preparing the stimuli")
+    args, session_argv = parser.parse_known_args(argv)
+    # the dataset, category, window size, order and authentication key are the options of the experiment
+    session_args = get_args(session_argv)
+
+    from xvolume.__main__ import dataset_files
+    from xvolume.scheduler import trial_order
+
+    window_width = int(session_args.window_size.split(",")[0])
+    image_files, gt_files, training_image_files, training_gt_files, gt_index = dataset_files(session_args)
+    training_image_files, training_gt_files = training_image_files[:NUM_TRAINING_IMAGES], training_gt_files[:NUM_TRAINING_IMAGES]
+    store_dir = os.path.join(args.store_dir, f"{session_args.category}_{window_width}")
+    build_store(store_dir, image_files, gt_files, training_image_files, training_gt_files, session_args.category, window_width, gt_index,
+                args.workers)
+    order = trial_order(session_args.order, [image_id(file) for file in image_files], gt_index, Index.get_index(session_args.category),
+                        session_args.history, session_args.category, session_args.budget)
+    print(f"{len(image_files) + len(training_image_files)} stimuli prepared in {store_dir}, {len(order)} images per session")
+
+    output = args.output or os.path.join("results", f"{session_args.category}_stations.npz")
+    authkey = session_args.authkey
+    if authkey is None:
+        # a well-known key would let anyone reaching the address send pickles to the coordinator
+        authkey = secrets.token_hex(16)
+        print(f"stations connect with --authkey {authkey}")
+    Coordinator(store_dir, order, output).serve(args.address, authkey)
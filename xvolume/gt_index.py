@@ -0,0 +1,207 @@
+"""
+Offline index of the ground-truth area of every category in every segmentation mask
+
+Run it once per dataset (and again after new images are added, only those are computed):
+    python -m xvolume index -dp <path to VOC2012>
+
+The index records the dataset it was built from and the modification time and size of every mask. A session ignores an index of another
+dataset, and decodes the masks that changed since they were indexed.
+"""
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from xvolume.class_mapping import Index
+
+NUM_CLASSES = max(Index.mapping.values()) + 1  # background + 20 categories
+DEFAULT_INDEX_FILE = os.path.join("cache", "gt_index.npz")
+
+
+def class_counts(gt):
+    """
+    This function counts the pixels of every class index of a segmentation mask at once. The histogram is computed by PIL on the decoded
+    palette indices, no array of the mask (or boolean array per class) is created.
+    :param gt: palette (P) or grayscale (L) mask image
+    :return: pixel count per class index (ndarray of 256)
+    """
+    if gt.mode not in ("P", "L"):
+        raise ValueError(f"segmentation masks are palette or grayscale images, got mode {gt.mode}")
+    return np.asarray(gt.histogram(), dtype=np.int64)
+
+
+def class_areas(gt_file):
+    """
+    :param gt_file: path to the palette PNG mask
+    :return: pixel count per class index (ndarray of NUM_CLASSES), total number of pixels
+    """
+    with Image.open(gt_file) as gt:
+        counts = class_counts(gt)
+        return counts[:NUM_CLASSES].astype(np.uint32), gt.width * gt.height
+
+
+class GroundTruthIndex:
+    """Per-image, per-class pixel areas keyed by image id (file name without extension)"""
+
+    def __init__(self, ids=(), areas=None, pixels=None, mtimes=None, sizes=None, dataset_path=None):
+        """
+        :param dataset_path: absolute path to the dataset of the masks, None if unknown (indexes written before it was recorded)
+        """
+        self.dataset_path = dataset_path
+        self.ids = np.asarray(ids, dtype=str)
+        n = len(self.ids)
+        self.areas = np.zeros((n, NUM_CLASSES), dtype=np.uint32) if areas is None else areas
+        self.pixels = np.zeros(n, dtype=np.uint32) if pixels is None else pixels
+        self.mtimes = np.zeros(n, dtype=np.float64) if mtimes is None else mtimes
+        self.sizes = np.zeros(n, dtype=np.int64) if sizes is None else sizes
+        self.rows = {image_id: row for row, image_id in enumerate(self.ids.tolist())}
+
+    @classmethod
+    def load(cls, index_file):
+        """Load an index file, an empty index is returned if it does not exist"""
+        if not os.path.exists(index_file):
+            return cls()
+        with np.load(index_file) as data:
+            dataset_path = str(data["dataset_path"]) if "dataset_path" in data.files else None
+            return cls(data["ids"], data["areas"], data["pixels"], data["mtimes"], data["sizes"], dataset_path)
+
+    def save(self, index_file):
+        os.makedirs(os.path.dirname(index_file) or ".", exist_ok=True)
+        tmp_file = index_file + ".tmp.npz"
+        np.savez(tmp_file, ids=self.ids, areas=self.areas, pixels=self.pixels, mtimes=self.mtimes, sizes=self.sizes,
+                 dataset_path=self.dataset_path or "")
+        os.replace(tmp_file, index_file)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, image_id):
+        return image_id in self.rows
+
+    def percent(self, image_id, class_index):
+        """
+        :return: area of the class in percent of the image, None if the image is not indexed
+        """
+        row = self.rows.get(image_id)
+        if row is None:
+            return None
+        return float(self.areas[row, class_index]) / float(self.pixels[row]) * 100
+
+    def percents(self, ids, class_index):
+        """
+        :return: area of the class in percent of each image (ndarray), NaN for the images that are not indexed
+        """
+        rows = np.array([self.rows.get(i, -1) for i in ids], dtype=np.int64)
+        indexed = rows >= 0
+        percents = np.full(len(rows), np.nan)
+        percents[indexed] = self.areas[rows[indexed], class_index] / self.pixels[rows[indexed]].astype(np.float64) * 100
+        return percents
+
+    def is_current(self, image_id, stat):
+        row = self.rows.get(image_id)
+        return row is not None and self.mtimes[row] == stat.st_mtime and self.sizes[row] == stat.st_size
+
+    def unchanged(self, gt_files, workers=32):
+        """
+        :param gt_files: mask files of the session
+        :param workers: number of threads reading the modification times
+        :return: GroundTruthIndex of the masks that did not change since they were indexed, the others are decoded
+        """
+        def current(gt_file):
+            try:
+                return self.is_current(image_id(gt_file), os.stat(gt_file))
+            except OSError:
+                return False
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            ids = [image_id(gt_file) for gt_file, is_current in zip(gt_files, executor.map(current, gt_files)) if is_current]
+        rows = np.array([self.rows[i] for i in dict.fromkeys(ids)], dtype=np.int64)
+        return GroundTruthIndex(self.ids[rows], self.areas[rows], self.pixels[rows], self.mtimes[rows], self.sizes[rows], self.dataset_path)
+
+    def update(self, ids, areas, pixels, mtimes, sizes):
+        """Return a new index with the given rows added or replaced"""
+        replaced = set(ids)
+        keep = np.array([image_id not in replaced for image_id in self.ids.tolist()], dtype=bool)
+        return GroundTruthIndex(np.concatenate([self.ids[keep], np.asarray(ids, dtype=str)]),
+                                np.concatenate([self.areas[keep], np.asarray(areas, dtype=np.uint32).reshape(-1, NUM_CLASSES)]),
+                                np.concatenate([self.pixels[keep], np.asarray(pixels, dtype=np.uint32)]),
+                                np.concatenate([self.mtimes[keep], np.asarray(mtimes, dtype=np.float64)]),
+                                np.concatenate([self.sizes[keep], np.asarray(sizes, dtype=np.int64)]), self.dataset_path)
+
+
+def image_id(file):
+    return os.path.splitext(os.path.basename(file))[0]
+
+
+def listed_image_ids(categories):
+    """Image ids listed in the experiment and training lists of the given categories"""
+    ids = []
+    for category in categories:
+        for name in (f"{category}.txt", f"{category}_training_images.txt"):
+            with open(os.path.join(os.path.dirname(__file__), "data", name), 'r') as f:
+                ids.extend(line.strip().split(".")[0] for line in f if line.strip())
+    return list(dict.fromkeys(ids))
+
+
+def build_index(dataset_path, ids, index_file=DEFAULT_INDEX_FILE, workers=None):
+    """
+    This function indexes the masks of the given image ids, masks that are already indexed and unchanged are skipped. An index of another
+    dataset is replaced
+    :param dataset_path: path to the Pascal dataset
+    :param ids: image ids to index
+    :param index_file: index file to update
+    :param workers: number of processes, default is the number of cores
+    :return: updated GroundTruthIndex, number of masks computed, list of missing mask files
+    """
+    dataset_path = os.path.abspath(dataset_path)
+    gt_dir = os.path.join(dataset_path, "SegmentationClassAug")
+    index = GroundTruthIndex.load(index_file)
+    if index.dataset_path != dataset_path:
+        index = GroundTruthIndex(dataset_path=dataset_path)
+    todo, stats, missing = [], [], []
+    for i in ids:
+        gt_file = os.path.join(gt_dir, i + ".png")
+        try:
+            stat = os.stat(gt_file)
+        except FileNotFoundError:
+            missing.append(gt_file)
+            continue
+        if not index.is_current(i, stat):
+            todo.append(i)
+            stats.append(stat)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(class_areas, [os.path.join(gt_dir, i + ".png") for i in todo], chunksize=64))
+        index = index.update(todo,
+                             [areas for areas, _ in results],
+                             [pixels for _, pixels in results],
+                             [stat.st_mtime for stat in stats],
+                             [stat.st_size for stat in stats])
+        index.save(index_file)
+    return index, len(todo), missing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume index", description="Precompute the ground truth area of all categories in the dataset")
+    parser.add_argument("--dataset-path", "-dp", type=str, required=True, help="path to the Pascal dataset")
+    parser.add_argument("--category", "-c", type=str, nargs="*", choices=list(Index.mapping), default=list(Index.mapping),
+                        help="only index the images listed for these categories (default all)")
+    parser.add_argument("--all", action="store_true", help="index every mask in SegmentationClassAug instead of the listed images")
+    parser.add_argument("--index-file", type=str, default=DEFAULT_INDEX_FILE, help=f"index file to create or update (default {DEFAULT_INDEX_FILE})")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="number of processes (default number of cores)")
+    args = parser.parse_args(argv)
+
+    gt_dir = os.path.join(args.dataset_path, "SegmentationClassAug")
+    if args.all:
+        ids = sorted(image_id(f) for f in glob.glob(os.path.join(gt_dir, "*.png")))
+    else:
+        ids = listed_image_ids(args.category)
+
+    index, computed, missing = build_index(args.dataset_path, ids, args.index_file, args.workers)
+    for gt_file in missing:
+        print(f"missing mask: {gt_file}")
+    print(f"{computed} masks indexed, {len(index)} images in {args.index_file}")
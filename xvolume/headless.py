@@ -0,0 +1,245 @@
+"""
+Headless benchmark of the trial pipeline
+
+Runs the whole experiment of a category (image load, resize/pad, ground truth, validation, state saving) without a display or a human:
+the PsychoPy window, stimuli and keyboard are replaced by stubs and a scripted observer answers each image with the ground truth plus
+noise. Reports the time spent in each stage of the pipeline and the number of trials per second.
+
+    python -m xvolume headless --synthetic -c test
+    python -m xvolume headless -dp <path to VOC2012> -c dog --noise 0.3 --delay-frames 2 --assistance-tool grid --cache-size 0
+
+Options that are not listed by `python -m xvolume headless --help` are passed to the experiment.
+"""
+import argparse
+import math
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from xvolume import backend
+from xvolume.class_mapping import Index
+from xvolume.gt_index import listed_image_ids
+from xvolume.profiling import profiler
+from xvolume.utils import MeasurementContext, Scale, get_args, palette
+
+VOC_IMAGE_SIZES = [(500, 375), (500, 333), (375, 500), (333, 500), (500, 400), (480, 360)]
+
+
+class StubWindow:
+    def __init__(self, size, **kwargs):
+        self.size = tuple(size)
+        self.frames = 0
+        self.frame_times = []
+
+    def flip(self):
+        self.frames += 1
+        self.frame_times.append(time.perf_counter())
+        return self.frame_times[-1]
+
+    def close(self):
+        pass
+
+
+class StubImageStim:
+    created = 0
+
+    def __init__(self, win, image=None, size=None, **kwargs):
+        StubImageStim.created += 1
+        self.win = win
+        self.image = image
+        self.size = size if size is not None else image.size
+
+    @property
+    def image(self):
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+        # the copy stands in for the texture upload of PsychoPy
+        self.texture = np.array(image) if image is not None else None
+
+    @property
+    def size(self):
+        return self._size
+
+    @size.setter
+    def size(self, size):
+        self._size = np.asarray(size, dtype=np.float64)
+
+    def draw(self):
+        pass
+
+
+class StubTextStim:
+    created = 0
+
+    def __init__(self, win, text='', **kwargs):
+        StubTextStim.created += 1
+        self.win = win
+        self.text = text
+
+    def setText(self, text):
+        self.text = text
+
+    def draw(self):
+        pass
+
+
+class StubClock:
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def getTime(self):
+        return time.perf_counter() - self.start
+
+    def addTime(self, t):
+        self.start -= t
+
+
+def stub_quit():
+    raise SystemExit("the experiment was quit")
+
+
+class ScriptedObserver:
+    """
+    Answers each image with the ground truth times a log-normal noise factor, after `delay_frames` polls of the keyboard.
+    Any other screen (instructions, statistics) is dismissed with ENTER.
+    """
+
+    def __init__(self, tool, unit, window_width, noise=0.0, delay_frames=0, skip_training=False, seed=None):
+        self.tool = tool
+        self.unit = unit
+        self.window_width = window_width
+        self.noise = noise
+        self.delay_frames = delay_frames
+        self.skip_training = skip_training
+        self.rng = np.random.default_rng(seed)
+        self.keys = []
+        self.frames_left = 0
+        self.trials = 0
+
+    def show(self, trial, training):
+        """
+        :param trial: PreparedTrial on screen
+        :param training: whether it is a training trial
+        """
+        if training and self.skip_training:
+            self.keys = ['escape']
+            return
+        measurement = MeasurementContext(self.tool, self.unit, trial.new_width, trial.new_height, self.window_width)
+        answer = measurement.ground_truth_in_unit(trial.gt, Scale.SMALL)
+        if self.noise:
+            answer *= math.exp(self.rng.normal(0, self.noise))
+        answer = min(answer, math.floor(measurement.limits[Scale.SMALL] * 100) / 100)
+        self.keys = ['period' if c == '.' else c for c in f"{answer:.2f}"] + ['return']
+        self.frames_left = self.delay_frames
+        self.trials += 1
+
+    def waitKeys(self, maxWait=float('inf'), keyList=None, clearEvents=True, **kwargs):
+        if not self.keys:
+            if keyList is not None and 'return' not in keyList:
+                return [keyList[-1]]
+            return ['return']
+        if self.frames_left > 0 and maxWait != float('inf'):
+            self.frames_left -= 1
+            return None
+        return [self.keys.pop(0)]
+
+
+def make_synthetic_dataset(dataset_path, category, seed=None):
+    """
+    This function writes VOC-like JPEG images and palette PNG masks for the images listed for the category
+    :param dataset_path: folder to create JPEGImages and SegmentationClassAug in
+    :param category: category of the experiment
+    :param seed: seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    class_index = Index.get_index(category)
+    os.makedirs(os.path.join(dataset_path, "JPEGImages"), exist_ok=True)
+    os.makedirs(os.path.join(dataset_path, "SegmentationClassAug"), exist_ok=True)
+    for image_id in listed_image_ids([category]):
+        width, height = VOC_IMAGE_SIZES[rng.integers(len(VOC_IMAGE_SIZES))]
+        # smooth gradients plus noise compress like natural images
+        y, x = np.mgrid[0:height, 0:width]
+        image = np.stack([(x * rng.uniform(0.2, 0.5) + y * rng.uniform(0.1, 0.4) + rng.integers(0, 255)) % 256 for _ in range(3)], axis=-1)
+        image = np.clip(image + rng.normal(0, 12, image.shape), 0, 255).astype(np.uint8)
+        Image.fromarray(image, "RGB").save(os.path.join(dataset_path, "JPEGImages", image_id + ".jpg"), quality=90)
+
+        mask = Image.new("P", (width, height), 0)
+        mask.putpalette(palette)
+        draw = ImageDraw.Draw(mask)
+        for index in (rng.integers(1, 21), class_index):
+            w, h = rng.uniform(0.05, 0.9) * width, rng.uniform(0.05, 0.9) * height
+            left, top = rng.uniform(0, width - w), rng.uniform(0, height - h)
+            draw.ellipse([left, top, left + w, top + h], fill=int(index))
+        mask.save(os.path.join(dataset_path, "SegmentationClassAug", image_id + ".png"))
+
+
+def print_report(summary, trials, elapsed, window):
+    print(f"{'stage':<12}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}")
+    for stage, (count, mean, median, p95, total) in summary.items():
+        print(f"{stage:<12}{count:>8}{mean * 1000:>10.2f}{median * 1000:>10.2f}{p95 * 1000:>10.2f}{total:>10.2f}")
+    print(f"{trials} trials in {elapsed:.2f}s: {trials / elapsed:.1f} trials/s, {window.frames} frames, "
+          f"{StubImageStim.created} image and {StubTextStim.created} text stimuli created")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume headless", description="Benchmark the trial pipeline without a display or a human observer")
+    parser.add_argument("--synthetic", action="store_true", help="run on a synthetic VOC-like dataset generated for the category")
+    parser.add_argument("--noise", type=float, default=0.0, help="standard deviation of the log-normal noise of the answers (default 0)")
+    parser.add_argument("--delay-frames", type=int, default=0, help="keyboard polls before the observer answers (default 0)")
+    parser.add_argument("--skip-training", action="store_true", help="skip the training phase with ESC")
+    parser.add_argument("--seed", type=int, default=None)
+    args, session_argv = parser.parse_known_args(argv)
+
+    from xvolume.__main__ import run
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.synthetic:
+            session_argv = session_argv + ["--dataset-path", os.path.join(workdir, "VOC2012")]
+        session_args = get_args(session_argv)
+        if args.synthetic:
+            make_synthetic_dataset(session_args.dataset_path, session_args.category, args.seed)
+        # the states and results of the run are written to the temporary folder
+        if session_args.dataset_path is not None:
+            session_args.dataset_path = os.path.abspath(session_args.dataset_path)
+        # the index, manifest and cache of a synthetic dataset are also temporary: the images are named like the VOC images, an index of the
+        # real dataset would give them its ground truth
+        base = workdir if args.synthetic else os.getcwd()
+        session_args.gt_index = os.path.join(base, session_args.gt_index)
+        session_args.cache_dir = os.path.join(base, session_args.cache_dir)
+        session_args.manifest = os.path.join(base, session_args.manifest)
+        session_args.history = [os.path.abspath(file) for file in session_args.history]
+
+        window_width = int(session_args.window_size.split(",")[0])
+        observer = ScriptedObserver(session_args.assistance_tool, session_args.unit, window_width, args.noise, args.delay_frames,
+                                    args.skip_training, args.seed)
+        windows = []
+
+        def window(size, **kwargs):
+            windows.append(StubWindow(size, **kwargs))
+            return windows[-1]
+
+        backend.use(SimpleNamespace(Window=window, ImageStim=StubImageStim, TextStim=StubTextStim),
+                    observer,
+                    SimpleNamespace(Clock=StubClock, wait=lambda secs: None, quit=stub_quit))
+        profiler.enable()
+        os.makedirs(os.path.join(workdir, "results"))
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        start = time.perf_counter()
+        try:
+            run(session_args, observer)
+        finally:
+            elapsed = time.perf_counter() - start
+            os.chdir(cwd)
+            if session_args.profile:
+                os.makedirs("results", exist_ok=True)
+                profiler.write(os.path.join("results", session_args.result_file))
+
+    print_report(profiler.summary(), observer.trials, elapsed, windows[0])
@@ -0,0 +1,242 @@
+"""
+Crash-safe intermediate results of an experiment
+
+The state of a category is a checkpoint `states/{category}_saved_state.json` ({'current_index', 'responses', 'elapsed_time'}, the
+format read by process_intermediate_results.py, 'trials', the metadata of each response written to the results array, and 'order', the
+positions of the listed images in the order they are shown) and a journal `states/{category}_saved_state.jsonl` with one line appended per trial
+since the checkpoint. Appending a trial writes one line instead of the whole state, the checkpoint is only rewritten (atomically) every
+`checkpoint_interval` trials and when the experiment is finished.
+
+During the experiment the records are handed to a JournalWriter, which appends them on a background thread so that disk latency stays
+off the render thread.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+
+class StateJournal:
+    def __init__(self, category, state_dir="states", checkpoint_interval=100):
+        self.checkpoint_file = os.path.join(state_dir, f"{category}_saved_state.json")
+        self.journal_file = os.path.join(state_dir, f"{category}_saved_state.jsonl")
+        self.checkpoint_interval = checkpoint_interval
+        self.current_index = -1
+        self.responses = []
+        self.trials = []
+        self.order = None  # None is the order of the list
+        self.order_written = False
+        self.elapsed_time = 0
+        self.journal = None
+        self.journal_end = None  # end of the last complete line of the journal when it was loaded, the rest is cut before appending
+        self.records_since_checkpoint = 0
+
+    def load(self):
+        """
+        This function restores the state from the checkpoint and replays the journal on top of it
+        :return: True if there is a saved state
+        """
+        found = False
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                state = json.load(f)
+            self.current_index = state['current_index']
+            self.responses = state['responses']
+            # states saved before the trial metadata was recorded
+            self.trials = state.get('trials', [None] * len(self.responses))
+            self.order = state.get('order')
+            self.elapsed_time = state['elapsed_time']
+            found = True
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(self.journal_file, 'rb') as f:
+                end = 0
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # the last line was being written when the experiment was interrupted
+                    end += len(line)
+                    # records up to the checkpoint are left over if the experiment stopped while compacting
+                    if 'order' in record:
+                        self.order = record['order']
+                    if record['current_index'] > self.current_index:
+                        self.current_index = record['current_index']
+                        self.responses.append(record['response'])
+                        self.trials.append(record.get('trial'))
+                        self.elapsed_time = record['elapsed_time']
+                        self.records_since_checkpoint += 1
+                        found = True
+            self.journal_end = end
+        except FileNotFoundError:
+            pass
+        self.order_written = found
+        return found
+
+    def reset(self):
+        """
+        This function deletes the saved state to start a new experiment
+        """
+        self.close()
+        for file in (self.checkpoint_file, self.journal_file):
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+        self.current_index = -1
+        self.responses = []
+        self.trials = []
+        self.order = None
+        self.order_written = False
+        self.elapsed_time = 0
+        self.journal_end = None
+        self.records_since_checkpoint = 0
+
+    def append(self, index, response, elapsed_time, trial=None):
+        """
+        This function records the response of a trial, it is on disk when the function returns
+        :param index: index of the image
+        :param response: tuple of image name, estimated size, gt size and time spent on the image
+        :param elapsed_time: elapsed time of the experiment
+        :param trial: metadata of the trial (results.trial_metadata)
+        """
+        self.extend([{'current_index': index, 'response': response, 'elapsed_time': elapsed_time, 'trial': trial}])
+
+    def extend(self, records):
+        """
+        This function records the responses of several trials with a single write
+        :param records: list of dicts with keys current_index, response, elapsed_time and trial, in the order of the trials
+        """
+        for record in records:
+            self.current_index = record['current_index']
+            self.responses.append(record['response'])
+            self.trials.append(record.get('trial'))
+            self.elapsed_time = record['elapsed_time']
+        self.write(records)
+
+    def write(self, records):
+        """
+        This function appends records to the journal and syncs them to disk
+        :param records: list of dicts with keys current_index, response and elapsed_time
+        """
+        if self.journal is None:
+            os.makedirs(os.path.dirname(self.journal_file) or ".", exist_ok=True)
+            self.journal = open(self.journal_file, 'a')
+            if self.journal_end is not None:
+                # a torn last line would be joined to the first new record, and every record after it lost on the next load
+                self.journal.truncate(self.journal_end)
+                self.journal_end = None
+        if not self.order_written and records:
+            # the order of a new experiment is saved with its first response
+            records = [{**records[0], 'order': self.order}] + records[1:]
+            self.order_written = True
+        self.journal.write("".join(json.dumps(record) + "\n" for record in records))
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.records_since_checkpoint += len(records)
+        if self.records_since_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        This function atomically replaces the checkpoint with the current state and empties the journal
+        """
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump({'current_index': self.current_index, 'responses': self.responses, 'elapsed_time': self.elapsed_time,
+                       'trials': self.trials, 'order': self.order}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.checkpoint_file)
+
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_file, 'w')
+        self.journal_end = None
+        self.records_since_checkpoint = 0
+
+    def compact(self):
+        """
+        This function folds the journal into the checkpoint, the experiment is finished
+        """
+        self.checkpoint()
+        self.close()
+        os.remove(self.journal_file)
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+class JournalWriter:
+    """
+    Appends the records of a StateJournal on a background thread. Records queued while a write is in progress are coalesced into one
+    append: a batch is written once `batch_size` records are queued or `flush_interval` seconds after its first record. `close` writes
+    everything that is queued, a record is on disk at the latest `flush_interval` seconds (plus the write) after it was appended. An
+    exception raised by a write is raised again by the next `append` and by `close`.
+    """
+
+    def __init__(self, journal, batch_size=16, flush_interval=0.5):
+        """
+        :param journal: StateJournal, it is only modified by the writer thread until the writer is closed
+        :param batch_size: number of records that triggers a write
+        :param flush_interval: seconds a record waits for more records before it is written
+        """
+        self.journal = journal
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.error = None  # first exception raised by a write, raised again by `append` and `close`
+        self.thread = threading.Thread(target=self._run, name="journal-writer", daemon=True)
+        self.thread.start()
+
+    def append(self, index, response, elapsed_time, trial=None):
+        """
+        :param index: index of the image
+        :param response: tuple of image name, estimated size, gt size and time spent on the image
+        :param elapsed_time: elapsed time of the experiment
+        :param trial: metadata of the trial (results.trial_metadata)
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put({'current_index': index, 'response': response, 'elapsed_time': elapsed_time, 'trial': trial})
+
+    def _run(self):
+        closed = False
+        while not closed:
+            record = self.queue.get()
+            if record is None:
+                break
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if record is None:
+                    closed = True
+                    break
+                batch.append(record)
+            try:
+                self.journal.extend(batch)
+            except Exception as e:
+                # e.g. a full disk or a record that is not JSON serializable, the thread keeps draining the queue so `close` returns
+                if self.error is None:
+                    self.error = e
+
+    def close(self):
+        """
+        This function writes the queued records and stops the thread, it can be called more than once
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,243 @@
+"""
+Manifest of the dataset: the image and mask files listed for every category, resolved, checked and measured once
+
+    python -m xvolume manifest -dp <path to VOC2012>
+
+For every listed image the manifest records the paths, the dimensions, byte sizes and modification times of the image and its mask, and
+the pixel area of every class (the ground truth index). A session started with it loads this one file instead of building the file lists,
+and it refuses to start if files of its category are missing instead of stopping halfway through. Running it again only decodes the
+images and masks that are new or changed.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from xvolume.class_mapping import Index
+from xvolume.gt_index import NUM_CLASSES, GroundTruthIndex, class_areas
+
+DEFAULT_MANIFEST_FILE = os.path.join("cache", "manifest.npz")
+MAX_PRINTED_PROBLEMS = 10  # a wrong dataset path makes every listed file missing
+
+
+def read_list(name):
+    with open(os.path.join(os.path.dirname(__file__), "data", name), 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def listed_files(dataset_path, category, training=False):
+    """
+    :param dataset_path: path to the Pascal dataset
+    :param category: category of the experiment
+    :param training: files of the training images instead of the experiment images
+    :return: image files, mask files
+    """
+    image_dir = os.path.join(dataset_path, "JPEGImages")
+    gt_dir = os.path.join(dataset_path, "SegmentationClassAug")
+    names = read_list(f"{category}_training_images.txt" if training else f"{category}.txt")
+    return [os.path.join(image_dir, name + ".jpg") for name in names], [os.path.join(gt_dir, name.split(".")[0] + ".png") for name in names]
+
+
+def find_missing(files, workers=32):
+    """
+    :param files: files that must exist
+    :param workers: number of threads probing the files
+    :return: files that do not exist
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [file for file, exists in zip(files, executor.map(os.path.isfile, files)) if not exists]
+
+
+def _stat(file):
+    try:
+        return os.stat(file)
+    except OSError:
+        return None
+
+
+def measure(image_file, gt_file):
+    """
+    :return: width and height of the image (from its header), pixel count per class of the mask and its number of pixels
+    """
+    with Image.open(image_file) as img:
+        width, height = img.size
+    areas, pixels = class_areas(gt_file)
+    return width, height, areas, pixels
+
+
+class Manifest:
+    def __init__(self, dataset_path, ids, image_files, gt_files, widths, heights, image_sizes, image_mtimes, missing, gt_index, lists):
+        """
+        :param dataset_path: absolute path to the dataset
+        :param ids: image ids, one row per image
+        :param missing: rows whose image or mask is missing or unreadable
+        :param gt_index: GroundTruthIndex of the masks, with the same rows
+        :param lists: dict of list name (category, or category_training) to its image ids in order
+        """
+        self.dataset_path = dataset_path
+        self.ids = np.asarray(ids, dtype=str)
+        self.image_files = np.asarray(image_files, dtype=str)
+        self.gt_files = np.asarray(gt_files, dtype=str)
+        self.widths = np.asarray(widths, dtype=np.int32)
+        self.heights = np.asarray(heights, dtype=np.int32)
+        self.image_sizes = np.asarray(image_sizes, dtype=np.int64)
+        self.image_mtimes = np.asarray(image_mtimes, dtype=np.float64)
+        self.missing = np.asarray(missing, dtype=bool)
+        self.gt_index = gt_index
+        self.lists = lists
+        self.rows = gt_index.rows
+
+    @classmethod
+    def load(cls, manifest_file):
+        """Load a manifest file, None if it does not exist"""
+        if not os.path.exists(manifest_file):
+            return None
+        with np.load(manifest_file) as data:
+            gt_index = GroundTruthIndex(data["ids"], data["areas"], data["pixels"], data["gt_mtimes"], data["gt_sizes"])
+            lists = {key[len("list_"):]: data[key].tolist() for key in data.files if key.startswith("list_")}
+            return cls(str(data["dataset_path"]), data["ids"], data["image_files"], data["gt_files"], data["widths"], data["heights"],
+                       data["image_sizes"], data["image_mtimes"], data["missing"], gt_index, lists)
+
+    def save(self, manifest_file):
+        os.makedirs(os.path.dirname(manifest_file) or ".", exist_ok=True)
+        tmp_file = manifest_file + ".tmp.npz"
+        np.savez(tmp_file, dataset_path=self.dataset_path, ids=self.ids, image_files=self.image_files, gt_files=self.gt_files,
+                 widths=self.widths, heights=self.heights, image_sizes=self.image_sizes, image_mtimes=self.image_mtimes, missing=self.missing,
+                 areas=self.gt_index.areas, pixels=self.gt_index.pixels, gt_mtimes=self.gt_index.mtimes, gt_sizes=self.gt_index.sizes,
+                 **{"list_" + name: np.asarray(ids, dtype=str) for name, ids in self.lists.items()})
+        os.replace(tmp_file, manifest_file)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def files(self, category, training=False):
+        """
+        :param category: category of the experiment
+        :param training: files of the training images instead of the experiment images
+        :return: image files, mask files
+        """
+        rows = [self.rows[i] for i in self.lists[f"{category}_training" if training else category]]
+        return self.image_files[rows].tolist(), self.gt_files[rows].tolist()
+
+    def incomplete(self, category):
+        """
+        :return: ids of the images of the category (experiment and training) whose image or mask was missing or unreadable
+        """
+        ids = dict.fromkeys(self.lists[category] + self.lists[f"{category}_training"])
+        return [i for i in ids if self.missing[self.rows[i]]]
+
+    def is_current(self, row, image_stat, gt_stat):
+        return not self.missing[row] and self.image_mtimes[row] == image_stat.st_mtime and self.image_sizes[row] == image_stat.st_size \
+            and self.gt_index.mtimes[row] == gt_stat.st_mtime and self.gt_index.sizes[row] == gt_stat.st_size
+
+
+def print_problems(problems, limit=MAX_PRINTED_PROBLEMS):
+    """
+    :param problems: lines describing the missing or unreadable files
+    :param limit: number of lines printed, the others are counted
+    """
+    for line in problems[:limit]:
+        print(line)
+    if len(problems) > limit:
+        print(f"... and {len(problems) - limit} more")
+
+
+def build_manifest(dataset_path, categories, previous=None, workers=None):
+    """
+    This function resolves and measures the files listed for the categories, the rows of the previous manifest are reused for the files that
+    did not change and the other categories of the previous manifest are kept as they are
+    :param dataset_path: path to the Pascal dataset
+    :param categories: categories to include
+    :param previous: Manifest to update
+    :param workers: number of processes, default is the number of cores
+    :return: Manifest, number of images measured, problems (file, message) of the missing or unreadable files
+    """
+    dataset_path = os.path.abspath(dataset_path)
+    if previous is not None and previous.dataset_path != dataset_path:
+        previous = None
+    lists = {}
+    files = {}
+    for category in categories:
+        for training in (False, True):
+            image_files, gt_files = listed_files(dataset_path, category, training)
+            ids = [os.path.splitext(os.path.basename(gt_file))[0] for gt_file in gt_files]
+            lists[f"{category}_training" if training else category] = ids
+            files.update(zip(ids, zip(image_files, gt_files)))
+    ids = list(files)
+    n = len(ids)
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        image_stats = list(executor.map(_stat, [files[i][0] for i in ids]))
+        gt_stats = list(executor.map(_stat, [files[i][1] for i in ids]))
+
+    widths = np.zeros(n, dtype=np.int32)
+    heights = np.zeros(n, dtype=np.int32)
+    areas = np.zeros((n, NUM_CLASSES), dtype=np.uint32)
+    pixels = np.zeros(n, dtype=np.uint32)
+    missing = np.zeros(n, dtype=bool)
+    problems = []
+    todo = []
+    for row, (i, image_stat, gt_stat) in enumerate(zip(ids, image_stats, gt_stats)):
+        if image_stat is None or gt_stat is None:
+            missing[row] = True
+            problems.extend((file, "missing") for file, stat in zip(files[i], (image_stat, gt_stat)) if stat is None)
+            continue
+        previous_row = previous.rows.get(i) if previous is not None else None
+        if previous_row is not None and previous.is_current(previous_row, image_stat, gt_stat):
+            widths[row], heights[row] = previous.widths[previous_row], previous.heights[previous_row]
+            areas[row], pixels[row] = previous.gt_index.areas[previous_row], previous.gt_index.pixels[previous_row]
+        else:
+            todo.append(row)
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(measure, *files[ids[row]]) for row in todo]
+            for row, future in zip(todo, futures):
+                try:
+                    widths[row], heights[row], areas[row], pixels[row] = future.result()
+                except (OSError, ValueError) as e:
+                    missing[row] = True
+                    problems.append((files[ids[row]][0], str(e)))
+
+    def column(stats, field, dtype):
+        return np.array([getattr(stat, field) if stat is not None else 0 for stat in stats], dtype=dtype)
+
+    image_files, gt_files = [files[i][0] for i in ids], [files[i][1] for i in ids]
+    image_sizes, image_mtimes = column(image_stats, "st_size", np.int64), column(image_stats, "st_mtime", np.float64)
+    gt_mtimes, gt_sizes = column(gt_stats, "st_mtime", np.float64), column(gt_stats, "st_size", np.int64)
+    if previous is not None:
+        # the categories that are not rebuilt keep their lists and rows
+        kept = {name: list_ids for name, list_ids in previous.lists.items() if name not in lists}
+        rows = np.array([previous.rows[i] for i in dict.fromkeys(i for list_ids in kept.values() for i in list_ids) if i not in files],
+                        dtype=np.int64)
+        lists.update(kept)
+        ids = ids + previous.ids[rows].tolist()
+        image_files, gt_files = image_files + previous.image_files[rows].tolist(), gt_files + previous.gt_files[rows].tolist()
+        widths, heights = np.concatenate([widths, previous.widths[rows]]), np.concatenate([heights, previous.heights[rows]])
+        image_sizes = np.concatenate([image_sizes, previous.image_sizes[rows]])
+        image_mtimes = np.concatenate([image_mtimes, previous.image_mtimes[rows]])
+        missing = np.concatenate([missing, previous.missing[rows]])
+        areas, pixels = np.concatenate([areas, previous.gt_index.areas[rows]]), np.concatenate([pixels, previous.gt_index.pixels[rows]])
+        gt_mtimes = np.concatenate([gt_mtimes, previous.gt_index.mtimes[rows]])
+        gt_sizes = np.concatenate([gt_sizes, previous.gt_index.sizes[rows]])
+
+    gt_index = GroundTruthIndex(ids, areas, pixels, gt_mtimes, gt_sizes)
+    manifest = Manifest(dataset_path, ids, image_files, gt_files, widths, heights, image_sizes, image_mtimes, missing, gt_index, lists)
+    return manifest, len(todo), problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume manifest", description="Resolve, check and measure the image and mask files of the dataset")
+    parser.add_argument("--dataset-path", "-dp", type=str, required=True, help="path to the Pascal dataset")
+    parser.add_argument("--category", "-c", type=str, nargs="*", choices=list(Index.mapping), default=list(Index.mapping),
+                        help="only include the images listed for these categories (default all)")
+    parser.add_argument("--manifest", type=str, default=DEFAULT_MANIFEST_FILE, help=f"manifest file to create or update (default {DEFAULT_MANIFEST_FILE})")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="number of processes (default number of cores)")
+    args = parser.parse_args(argv)
+
+    manifest, measured, problems = build_manifest(args.dataset_path, args.category, Manifest.load(args.manifest), args.workers)
+    manifest.save(args.manifest)
+    print_problems([f"{file}: {message}" for file, message in problems])
+    print(f"{measured} images measured, {len(manifest)} images in {args.manifest}, {int(manifest.missing.sum())} incomplete")
@@ -0,0 +1,284 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+import numpy as np
+from PIL import Image
+
+from xvolume.gt_index import class_counts, image_id
+from xvolume.profiling import profiler
+from xvolume.utils import ImageTool
+
+
+class PreparedTrial(NamedTuple):
+    index: int
+    image_file: str
+    image_stimulus: Optional[Image.Image]
+    mask_stimulus: Optional[Image.Image]
+    new_width: int
+    new_height: int
+    gt: float
+    error: Optional[OSError] = None
+
+
+class SourceImage:
+    """
+    The image of a trial, decoded and resized on first use. It is shared by the stimulus and the mask overlay, and not decoded at all if
+    both are cached.
+    """
+
+    def __init__(self, image_file, window_width):
+        self.image_file = image_file
+        self.window_width = window_width
+        self.resized = None
+
+    def resize(self):
+        """
+        :return: image resized to the displayed size, its width and height
+        """
+        if self.resized is None:
+            trial = image_id(self.image_file)
+            with profiler.span("decode", trial):
+                img, original_width, original_height = ImageTool.load_image(self.image_file, self.window_width)
+            with profiler.span("resize", trial):
+                self.resized = ImageTool.resize_image(original_width, original_height, self.window_width, img)
+        return self.resized
+
+
+def image_stimulus_from_image(source, window_width, tool, canvases=None):
+    """
+    :param source: SourceImage of the trial
+    :param canvases: CanvasPool the image is padded into for absbox
+    :return: resized (and padded for absbox) image, width and height of the resized image
+    """
+    image_stimulus, new_width, new_height = source.resize()
+    if tool == 'absbox':
+        with profiler.span("pad", image_id(source.image_file)):
+            image_stimulus = ImageTool.pad_image(window_width, image_stimulus, canvases.acquire() if canvases is not None else None)
+    return image_stimulus, new_width, new_height
+
+
+def mask_stimulus_from_image(source, gt_image, class_index, window_width, tool, canvases=None):
+    """
+    :param source: SourceImage of the trial
+    :param gt_image: segmentation mask
+    :return: image blended with the ground truth mask of the category at the displayed size (and padded for absbox)
+    """
+    mask_stimulus = ImageTool.overlay_mask(source.resize()[0], gt_image, class_index)
+    if tool == 'absbox':
+        mask_stimulus = ImageTool.pad_image(window_width, mask_stimulus, canvases.acquire() if canvases is not None else None)
+    return mask_stimulus
+
+
+def cached(cache, key, build):
+    """
+    :param cache: StimulusCache or None
+    :param key: cache key of the stimulus
+    :param build: callable returning the stimulus, width and height of the resized image if it is not cached
+    :return: stimulus (PIL image), width and height of the resized image
+    """
+    if cache is None:
+        return build()
+    with profiler.span("cache_read"):
+        entry = cache.get(key)
+    if entry is not None:
+        buffer, width, height = entry
+        return Image.fromarray(buffer, "RGB"), width, height
+    stimulus, width, height = build()
+    cache.put(key, np.asarray(stimulus), width, height)
+    return stimulus, width, height
+
+
+def prepare_trial(index, image_file, gt_file, class_index, window_width, tool, with_mask=False, gt_index=None, cache=None, canvases=None):
+    """
+    This function does all the per-trial work that does not need the window: load, resize and pad the image and compute the ground truth
+    :param index: index of the trial
+    :param image_file: path to the JPEG image
+    :param gt_file: path to the segmentation mask
+    :param class_index: index of the category in the segmentation mask
+    :param window_width: width of window
+    :param tool: assistance tool
+    :param with_mask: also prepare the image blended with the ground truth mask (training feedback)
+    :param gt_index: GroundTruthIndex, the mask is only decoded if the image is not indexed or the mask overlay is needed and not cached
+    :param cache: StimulusCache of the prepared stimuli
+    :param canvases: CanvasPool the absbox stimuli are padded into
+    :return: PreparedTrial, `error` is set instead of raising if a file cannot be read
+    """
+    source = SourceImage(image_file, window_width)
+
+    try:
+        image_key = cache.key([image_file], window_width, tool) if cache is not None else None
+        image_stimulus, new_width, new_height = cached(cache, image_key, lambda: image_stimulus_from_image(source, window_width, tool, canvases))
+
+        mask_key = cache.key([image_file, gt_file], window_width, tool, f"overlay{class_index}") if cache is not None and with_mask else None
+        mask_entry = cache.get(mask_key) if mask_key is not None else None
+
+        with profiler.span("gt", image_id(image_file)):
+            gt = gt_index.percent(image_id(image_file), class_index) if gt_index is not None else None
+            if gt is None or (with_mask and mask_entry is None):
+                with Image.open(gt_file) as gt_image:
+                    gt_image.load()
+                if gt is None:
+                    gt = class_counts(gt_image)[class_index] / (gt_image.width * gt_image.height) * 100
+
+        mask_stimulus = None
+        if mask_entry is not None:
+            mask_stimulus = Image.fromarray(mask_entry[0], "RGB")
+        elif with_mask:
+            with profiler.span("mask", image_id(image_file)):
+                mask_stimulus = mask_stimulus_from_image(source, gt_image, class_index, window_width, tool, canvases)
+            if cache is not None:
+                cache.put(mask_key, np.asarray(mask_stimulus), new_width, new_height)
+    except OSError as e:
+        return PreparedTrial(index, image_file, None, None, 0, 0, 0.0, error=e)
+    return PreparedTrial(index, image_file, image_stimulus, mask_stimulus, new_width, new_height, float(gt))
+
+
+class CanvasPool:
+    """
+    Gray canvases of the padded stimulus size, reused across trials. A canvas is handed back with `release` once its stimulus has been
+    uploaded to a texture, so the padded frame is not allocated (and its pages faulted in) again for every trial.
+    """
+
+    def __init__(self, window_width, size=4):
+        """
+        :param window_width: width of window
+        :param size: number of free canvases kept
+        """
+        self.side = ImageTool.padded_size(window_width)
+        self.size = size
+        self.free = []
+        self.issued = {}
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        :return: canvas to pad a stimulus into, a new one if none is free
+        """
+        with self.lock:
+            canvas = self.free.pop() if self.free else Image.new("RGB", (self.side, self.side))
+            self.issued[id(canvas)] = canvas
+        return canvas
+
+    def release(self, canvas):
+        """
+        :param canvas: stimulus that is no longer read, images that do not come from the pool (e.g. cached stimuli) are ignored
+        """
+        with self.lock:
+            if self.issued.pop(id(canvas), None) is canvas and len(self.free) < self.size:
+                self.free.append(canvas)
+
+    def release_trial(self, trial):
+        """
+        :param trial: PreparedTrial whose stimuli are not shown, e.g. prepared ahead and discarded when the prefetcher is closed
+        """
+        for stimulus in (trial.image_stimulus, trial.mask_stimulus):
+            if stimulus is not None:
+                self.release(stimulus)
+
+
+class TrialCanvases:
+    """
+    The canvases of the stimuli of the trial on screen. Each is handed back to the pool once, with `release` as soon as its stimulus is
+    uploaded, and the ones still held when the trial ends (e.g. skipped with ESC before the feedback) when the context exits.
+    """
+
+    def __init__(self, pool, trial):
+        """
+        :param pool: CanvasPool, None if the stimuli are not padded into canvases
+        :param trial: PreparedTrial on screen
+        """
+        self.pool = pool
+        self.held = [stimulus for stimulus in (trial.image_stimulus, trial.mask_stimulus) if stimulus is not None] if pool is not None else []
+
+    def release(self, stimulus):
+        """
+        :param stimulus: stimulus of the trial that is no longer read
+        """
+        if any(held is stimulus for held in self.held):
+            self.held = [held for held in self.held if held is not stimulus]
+            self.pool.release(stimulus)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for stimulus in self.held:
+            self.pool.release(stimulus)
+        self.held = []
+
+
+class TrialPrefetcher:
+    """
+    Prepares the next `depth` trials on worker threads while the observer is answering the current one.
+    Decoding and resizing in PIL release the GIL, so threads are enough to keep the render thread free.
+    """
+
+    def __init__(self, prepare, n, depth=2, discard=None):
+        """
+        :param prepare: callable taking the trial index and returning a PreparedTrial
+        :param n: number of trials
+        :param depth: number of trials prepared ahead, 0 prepares each trial synchronously when it is requested
+        :param discard: callable given the prepared trials that are never returned when the prefetcher is closed, e.g.
+                        CanvasPool.release_trial
+        """
+        self.prepare = prepare
+        self.n = n
+        self.depth = max(depth, 0)
+        self.discard = discard
+        self.futures = {}
+        self.executor = ThreadPoolExecutor(max_workers=self.depth, thread_name_prefix="prefetch") if self.depth else None
+
+    def _submit(self, i):
+        if 0 <= i < self.n and i not in self.futures:
+            self.futures[i] = self.executor.submit(self.prepare, i)
+
+    def start(self, i):
+        """Start preparing trials from index `i` before they are requested"""
+        if self.executor is not None:
+            for j in range(i, i + self.depth):
+                self._submit(j)
+
+    def get(self, i):
+        """
+        Return the prepared trial `i`, blocking only if it is not ready yet, and queue the trials that follow it
+        :param i: trial index
+        :return: PreparedTrial
+        """
+        if self.executor is None:
+            return self.prepare(i)
+        self._submit(i)
+        for j in range(i + 1, i + 1 + self.depth):
+            self._submit(j)
+        return self.futures.pop(i).result()
+
+    def _discard(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.discard(future.result())
+
+    def close(self):
+        if self.executor is not None:
+            for future in self.futures.values():
+                # the trials being prepared are discarded once they are ready
+                if not future.cancel() and self.discard is not None:
+                    future.add_done_callback(self._discard)
+            self.futures.clear()
+            self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def warm_cache(prepare, n, workers=None):
+    """
+    This function prepares all the trials once so that their stimuli are cached ahead of a session
+    :param prepare: callable taking the trial index and returning a PreparedTrial
+    :param n: number of trials
+    :param workers: number of threads
+    :return: errors of the trials that could not be prepared
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [trial.error for trial in executor.map(prepare, range(n)) if trial.error is not None]
@@ -0,0 +1,121 @@
+"""
+Timings of the stages of each trial (load, resize, pad, ground truth, texture upload, ...)
+
+Stages are wrapped in `profiler.span(stage, trial)` and window flips go through `profiler.flip(window, trial)`. The profiler is disabled
+unless a benchmark or profiling run (`--profile`) enables it, a disabled span is a shared no-op context manager and a disabled flip is
+a plain `window.flip()`.
+"""
+import csv
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+NULL_SPAN = nullcontext()
+DROPPED_FRAME_FACTOR = 1.5  # a flip blocking longer than 1.5 frame periods missed at least one refresh
+DEFAULT_FRAME_PERIOD = 1 / 60
+
+
+class Span:
+    __slots__ = ("profiler", "stage", "trial", "start")
+
+    def __init__(self, profiler, stage, trial):
+        self.profiler = profiler
+        self.stage = stage
+        self.trial = trial
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.record(self.stage, self.trial, time.perf_counter() - self.start)
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        self.records = []
+
+    def span(self, stage, trial=None):
+        """
+        :param stage: name of the stage
+        :param trial: image the stage works on
+        :return: context manager timing the stage
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage, trial)
+
+    def record(self, stage, trial, duration):
+        """
+        :param stage: name of the stage
+        :param trial: image the stage works on
+        :param duration: seconds
+        """
+        if self.enabled:
+            with self.lock:
+                self.records.append((stage, trial, duration))
+
+    def flip(self, window, trial=None):
+        """
+        This function flips the window and records the time the flip blocked, flips that missed a refresh are recorded as dropped frames
+        :param window: window
+        :param trial: image on screen
+        :return: time of the flip
+        """
+        if not self.enabled:
+            return window.flip()
+        start = time.perf_counter()
+        flip_time = window.flip()
+        duration = time.perf_counter() - start
+        self.record("flip", trial, duration)
+        if duration > DROPPED_FRAME_FACTOR * (getattr(window, "monitorFramePeriod", None) or DEFAULT_FRAME_PERIOD):
+            self.record("dropped_frame", trial, duration)
+        return flip_time
+
+    def summary(self):
+        """
+        :return: dict of stage to (count, mean, median, 95th percentile, total) in seconds, in the order the stages first ran
+        """
+        durations = {}
+        for stage, _, duration in self.records:
+            durations.setdefault(stage, []).append(duration)
+        summary = {}
+        for stage, values in durations.items():
+            values = np.asarray(values)
+            summary[stage] = (len(values), values.mean(), np.median(values), np.percentile(values, 95), values.sum())
+        return summary
+
+    def write(self, prefix):
+        """
+        This function writes the timings of every stage of every trial to <prefix>_profile.csv and their summary to <prefix>_profile.json
+        :param prefix: path and name of the result file without extension
+        """
+        with self.lock:
+            records = list(self.records)
+        with open(prefix + "_profile.csv", 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Stage', 'Image', 'Milliseconds'])
+            for stage, trial, duration in records:
+                writer.writerow([stage, "" if trial is None else trial, f"{duration * 1000:.3f}"])
+
+        dropped_frames = {}
+        for stage, trial, _ in records:
+            if stage == "dropped_frame":
+                dropped_frames[trial] = dropped_frames.get(trial, 0) + 1
+        summary = {stage: {"count": int(count), "mean_ms": mean * 1000, "median_ms": median * 1000, "p95_ms": p95 * 1000, "total_s": total}
+                   for stage, (count, mean, median, p95, total) in self.summary().items()}
+        with open(prefix + "_profile.json", 'w') as f:
+            json.dump({"stages": summary, "dropped_frames": sum(dropped_frames.values()), "dropped_frames_per_image": dropped_frames}, f,
+                      indent=2)
+
+
+profiler = Profiler()
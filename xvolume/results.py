@@ -0,0 +1,129 @@
+"""
+Typed, columnar results of a session
+
+Next to `results/<result file>.csv` the experiment writes `results/<result file>.npy`, a NumPy structured array (RESULT_DTYPE) with one
+row per trial. The values keep their full precision, the category, tool, unit and scale are small integer codes and the geometry of the
+stimulus (displayed image size, window width) is kept, so a response can be converted between units after the fact. The file is memory
+mapped when it is read, e.g. by `python -m xvolume analyze results/*.npy`, and it is exported to CSV without loss with
+
+    python -m xvolume export results/responses.npy  # writes results/responses_trials.csv
+"""
+import argparse
+import csv
+import os
+
+import numpy as np
+
+from xvolume.constants import CATEGORIES
+from xvolume.utils import Scale
+
+TOOLS = ["grid", "absbox", "none"]
+UNITS = ["boxes", "percent"]
+SCALES = [scale.name for scale in Scale]
+# names of the values of the coded columns, the code is the position in the list
+CODES = {"category": CATEGORIES, "tool": TOOLS, "unit": UNITS, "scale": SCALES}
+UNKNOWN = -1  # code of the scale of trials restored from a state saved without trial metadata
+
+RESULT_DTYPE = np.dtype([("index", np.int32), ("image", "U32"),
+                         ("category", np.int8), ("tool", np.int8), ("unit", np.int8), ("scale", np.int8),
+                         ("response", np.float64),  # response in the input unit, NaN if unknown
+                         ("size", np.float64), ("gt", np.float64), ("time", np.float64),  # estimated and ground truth size in percent, seconds
+                         ("image_width", np.int32), ("image_height", np.int32), ("window_width", np.int32)])
+
+
+def trial_metadata(response, size, gt, scale, image_width, image_height, time):
+    """
+    :param response: response in the input unit
+    :param size: estimated size in percent, not rounded
+    :param gt: ground truth size in percent
+    :param scale: Scale of the assistance tool when the response was entered
+    :param image_width: width of the displayed image
+    :param image_height: height of the displayed image
+    :param time: seconds spent on the image
+    :return: JSON serializable metadata of a trial, saved with its response in the state of the experiment
+    """
+    return {"response": float(response), "size": size, "gt": gt, "scale": scale.name, "image_width": image_width, "image_height": image_height,
+            "time": time}
+
+
+def to_array(responses, trials, category, tool, unit, window_width):
+    """
+    :param responses: responses of the experiment, tuples of image name, estimated size, gt size and time
+    :param trials: trial_metadata of the responses, None for the responses saved without it
+    :param category: category of the experiment
+    :param tool: assistance tool, or list of the assistance tool of each response
+    :param unit: input unit, or list of the input unit of each response
+    :param window_width: width of window
+    :return: structured array of RESULT_DTYPE
+    """
+    array = np.zeros(len(responses), dtype=RESULT_DTYPE)
+    array["index"] = np.arange(len(responses))
+    array["category"] = CATEGORIES.index(category)
+    array["tool"] = TOOLS.index(tool) if isinstance(tool, str) else [TOOLS.index(name) for name in tool]
+    array["unit"] = UNITS.index(unit) if isinstance(unit, str) else [UNITS.index(name) for name in unit]
+    array["window_width"] = window_width
+    array["scale"] = UNKNOWN
+    array["response"] = np.nan
+    for row, ((image, size, gt, time), trial) in enumerate(zip(responses, trials)):
+        array["image"][row] = image
+        if trial is None:
+            array["size"][row], array["gt"][row], array["time"][row] = size, gt, time
+        else:
+            array["size"][row], array["gt"][row], array["time"][row] = trial["size"], trial["gt"], trial["time"]
+            array["response"][row] = trial["response"]
+            array["scale"][row] = SCALES.index(trial["scale"])
+            array["image_width"][row], array["image_height"][row] = trial["image_width"], trial["image_height"]
+    return array
+
+
+def save(file, array):
+    """Atomically write a results array"""
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    tmp_file = file + ".tmp.npy"
+    np.save(tmp_file, array)
+    os.replace(tmp_file, file)
+
+
+def load(file):
+    """
+    :param file: results file written by `save`
+    :return: read-only structured array, memory mapped
+    """
+    return np.load(file, mmap_mode="r")
+
+
+def decode(array, column):
+    """
+    :return: names of the values of a coded column, '' for unknown values
+    """
+    names = np.array(CODES[column] + [""], dtype=str)  # the unknown code -1 picks the last name
+    return names[array[column]]
+
+
+def export_csv(array, csv_file):
+    """
+    This function writes every column of a results array to CSV, floats are written with as many digits as needed to read them back exactly
+    :param array: structured array of RESULT_DTYPE
+    :param csv_file: output file
+    """
+    columns = [decode(array, name) if name in CODES else array[name] for name in RESULT_DTYPE.names]
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_DTYPE.names)
+        writer.writerows(zip(*(column.tolist() for column in columns)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume export", description="Export results files (.npy) to CSV with all trial metadata")
+    parser.add_argument("files", nargs="+", help="results files written by the experiment")
+    parser.add_argument("--output-dir", "-o", type=str, default=None, help="folder of the CSV files (default next to each results file)")
+    args = parser.parse_args(argv)
+
+    for file in args.files:
+        csv_file = os.path.splitext(file)[0] + "_trials.csv"
+        if args.output_dir is not None:
+            os.makedirs(args.output_dir, exist_ok=True)
+            csv_file = os.path.join(args.output_dir, os.path.basename(csv_file))
+        array = load(file)
+        export_csv(array, csv_file)
+        print(f"{len(array)} trials written to {csv_file}")
@@ -0,0 +1,105 @@
+"""
+Order of the trials of a session
+
+By default the images are shown in the order of `xvolume/data/{category}.txt`. With `--order` the order is computed at startup from the
+results of earlier sessions (`--history`, any file read by `python -m xvolume analyze`), so that the images whose size is least known
+come first, and `--budget` keeps only the first images of the order:
+
+    python -m xvolume -dp .../VOC2012/ -c dog --order stratified --history results/aggregated.parquet --budget 200
+
+The uncertainty of an image is the squared standard error of its mean signed log error over the earlier responses, it is infinite for the
+images with less than 2 responses. Orders are functions in ORDERS taking the uncertainty and the ground truth size (percent, NaN if
+unknown) of every listed image and returning the listed positions in presentation order, each runs in O(n log n).
+"""
+import numpy as np
+
+from xvolume.gt_index import image_id
+
+NUM_GT_BINS = 5
+
+
+def listed_order(uncertainty, gts):
+    """The images in the order of the list"""
+    return np.arange(len(uncertainty))
+
+
+def uncertainty_order(uncertainty, gts):
+    """The most uncertain images first, in the order of the list among equally uncertain images"""
+    return np.lexsort((np.arange(len(uncertainty)), -uncertainty))
+
+
+def stratified_order(uncertainty, gts, bins=NUM_GT_BINS):
+    """
+    The images are split into bins of ground truth size with the same number of images (images without a ground truth form their own bin)
+    and taken from the bins in turn, the most uncertain image of each bin first. Any number of first images covers the sizes evenly.
+    """
+    n = len(uncertainty)
+    known = ~np.isnan(gts)
+    strata = np.full(n, bins, dtype=np.int64)
+    if known.any():
+        edges = np.quantile(gts[known], np.linspace(0, 1, bins + 1)[1:-1])
+        strata[known] = np.searchsorted(edges, gts[known], side="right")
+    # rank of each image within its bin by uncertainty
+    rank = np.empty(n, dtype=np.int64)
+    rank[uncertainty_order(uncertainty, gts)] = np.arange(n)
+    by_stratum = np.lexsort((rank, strata))
+    sorted_strata = strata[by_stratum]
+    rank[by_stratum] = np.arange(n) - np.searchsorted(sorted_strata, sorted_strata, side="left")
+    return np.lexsort((strata, rank))
+
+
+ORDERS = {"listed": listed_order, "uncertainty": uncertainty_order, "stratified": stratified_order}
+
+
+def image_uncertainty(history_files, category, ids):
+    """
+    :param history_files: results of earlier sessions
+    :param category: category of the experiment, results of other categories are ignored (results whose category is unknown are kept)
+    :param ids: listed image ids
+    :return: uncertainty and mean ground truth size of every listed image (NaN if it has no response)
+    """
+    from xvolume import aggregate, analytics  # pandas is only imported when there is a history
+
+    df = analytics.load_results(history_files)
+    if "kind" in df.columns:
+        # a finished session is in the results and in the state of an aggregated table (tables written before they were deduplicated), a
+        # response counted twice would look like two answers that agree
+        df = aggregate.drop_finished_states(df)
+    df = df[df["category"].astype(str).isin([category, "unknown"])]
+    stats = df.assign(image=df["image"].map(image_id)).groupby("image").agg(count=("signed_log_error", "count"),
+                                                                           var=("signed_log_error", "var"), gt=("gt", "mean")).reindex(ids)
+    uncertainty = np.where(stats["count"].to_numpy() >= 2, (stats["var"] / stats["count"]).to_numpy(dtype=np.float64), np.inf)
+    return uncertainty, stats["gt"].to_numpy(dtype=np.float64)
+
+
+def trial_order(order, ids, gt_index, class_index, history_files=(), category=None, budget=None):
+    """
+    :param order: name of the order in ORDERS
+    :param ids: listed image ids
+    :param gt_index: GroundTruthIndex of the masks, the mean ground truth of the history is used for the images it does not cover
+    :param class_index: index of the category in the segmentation mask
+    :param history_files: results of earlier sessions
+    :param category: category of the experiment
+    :param budget: number of images of the session, all if None
+    :return: list of positions in the list, in presentation order
+    """
+    gts = gt_index.percents(ids, class_index)
+    uncertainty = None
+    if history_files and order != "listed":
+        uncertainty, history_gts = image_uncertainty(history_files, category, ids)
+        gts = np.where(np.isnan(gts), history_gts, gts)
+    return schedule(order, ids, gts, uncertainty, budget)
+
+
+def schedule(order, ids, gts, uncertainty=None, budget=None):
+    """
+    :param order: name of the order in ORDERS
+    :param ids: listed image ids
+    :param gts: ground truth size of every listed image in percent, NaN if unknown
+    :param uncertainty: uncertainty of every listed image, all images are equally uncertain if None
+    :param budget: number of images of the session, all if None
+    :return: list of positions in the list, in presentation order
+    """
+    uncertainty = np.full(len(ids), np.inf) if uncertainty is None else np.asarray(uncertainty, dtype=np.float64)
+    positions = ORDERS[order](uncertainty, np.asarray(gts, dtype=np.float64))
+    return positions[:budget].tolist()
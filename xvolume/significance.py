@@ -0,0 +1,168 @@
+"""
+Bootstrap confidence intervals and permutation tests of the estimation errors
+
+Resamples are drawn as index matrices of shape (B, n) and reduced along axis 1, in chunks that bound the memory use. Large numbers of
+resamples can be spread across processes, each process draws from its own independent random stream.
+
+    python -m xvolume significance results/aggregated.parquet --compare tool --by category -B 10000
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from xvolume import analytics
+
+STATISTICS = {"mean": np.mean, "median": np.median}
+MAX_CHUNK_ELEMENTS = 2 ** 24  # elements of one resampled (B, n) matrix
+
+
+def _chunks(total, n):
+    chunk = max(1, MAX_CHUNK_ELEMENTS // max(n, 1))
+    return [min(chunk, total - start) for start in range(0, total, chunk)]
+
+
+def _split(total, workers):
+    return [total // workers + (1 if i < total % workers else 0) for i in range(workers)]
+
+
+def _bootstrap(values, statistic, resamples, seed):
+    rng = np.random.default_rng(seed)
+    n = len(values)
+    reduce = STATISTICS[statistic]
+    return np.concatenate([reduce(values[rng.integers(0, n, size=(b, n))], axis=1) for b in _chunks(resamples, n)])
+
+
+def _permutation(a, b, statistic, permutations, seed):
+    rng = np.random.default_rng(seed)
+    pooled = np.concatenate([a, b])
+    reduce = STATISTICS[statistic]
+    differences = []
+    for chunk in _chunks(permutations, len(pooled)):
+        permuted = rng.permuted(np.tile(pooled, (chunk, 1)), axis=1)
+        differences.append(reduce(permuted[:, :len(a)], axis=1) - reduce(permuted[:, len(a):], axis=1))
+    return np.concatenate(differences)
+
+
+def _run(function, args, total, seed, workers, executor=None):
+    """
+    Run `function(*args, count, seed)` for `total` draws, split across `workers` processes of `executor` (a process pool is created for
+    the call if it is None)
+    """
+    seeds = np.random.SeedSequence(seed).spawn(max(workers, 1))
+    if workers <= 1:
+        return function(*args, total, seeds[0])
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return _run(function, args, total, seed, workers, executor)
+    futures = [executor.submit(function, *args, count, s) for count, s in zip(_split(total, workers), seeds) if count]
+    return np.concatenate([future.result() for future in futures])
+
+
+def bootstrap_ci(values, statistic="mean", resamples=10000, confidence=0.95, seed=None, workers=1, executor=None):
+    """
+    This function computes the percentile bootstrap confidence interval of a statistic
+    :param values: sample (array-like)
+    :param statistic: mean or median
+    :param resamples: number of bootstrap resamples B
+    :param confidence: confidence level of the interval
+    :param seed: seed of the random generator
+    :param workers: number of processes
+    :param executor: ProcessPoolExecutor shared by the calls, with `workers` processes
+    :return: statistic of the sample, lower bound, upper bound
+    """
+    values = np.asarray(values, dtype=np.float64)
+    distribution = _run(_bootstrap, (values, statistic), resamples, seed, workers, executor)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(distribution, [alpha, 1 - alpha])
+    return STATISTICS[statistic](values), low, high
+
+
+def permutation_test(a, b, statistic="mean", permutations=10000, seed=None, workers=1, executor=None):
+    """
+    This function tests whether the statistic differs between two samples (two-sided)
+    :param a: first sample (array-like)
+    :param b: second sample (array-like)
+    :param statistic: mean or median
+    :param permutations: number of random permutations
+    :param seed: seed of the random generator
+    :param workers: number of processes
+    :param executor: ProcessPoolExecutor shared by the calls, with `workers` processes
+    :return: difference of the statistic (a - b), p-value
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    observed = STATISTICS[statistic](a) - STATISTICS[statistic](b)
+    differences = _run(_permutation, (a, b, statistic), permutations, seed, workers, executor)
+    p_value = (np.count_nonzero(np.abs(differences) >= abs(observed)) + 1) / (len(differences) + 1)
+    return observed, p_value
+
+
+def confidence_intervals(df, by, metrics, statistics, resamples=10000, confidence=0.95, seed=None, workers=1, executor=None):
+    """
+    :param df: results table with the error metrics
+    :param by: columns defining the cells, e.g. category and tool
+    :return: table with a row per cell, metric and statistic
+    """
+    rows = []
+    for name, group in analytics.groupby(df, by):
+        for metric in metrics:
+            for statistic in statistics:
+                value, low, high = bootstrap_ci(group[metric].to_numpy(), statistic, resamples, confidence, seed, workers, executor)
+                rows.append({**dict(zip(by, name if isinstance(name, tuple) else (name,))), "metric": metric, "statistic": statistic,
+                             "n": len(group), "value": value, "low": low, "high": high})
+    return pd.DataFrame(rows)
+
+
+def compare(df, compare_by, by, metrics, statistics, permutations=10000, seed=None, workers=1, executor=None):
+    """
+    This function runs a permutation test between every pair of values of `compare_by` (e.g. absbox vs grid) within each group
+    :return: table with a row per group, pair, metric and statistic
+    """
+    rows = []
+    for name, group in analytics.groupby(df, by):
+        samples = {key: sample for key, sample in group.groupby(compare_by, observed=True)}
+        for key_a, key_b in combinations(sorted(samples), 2):
+            for metric in metrics:
+                for statistic in statistics:
+                    difference, p_value = permutation_test(samples[key_a][metric].to_numpy(), samples[key_b][metric].to_numpy(), statistic,
+                                                           permutations, seed, workers, executor)
+                    rows.append({**dict(zip(by, name if isinstance(name, tuple) else (name,))), "a": key_a, "b": key_b, "metric": metric,
+                                 "statistic": statistic, "difference": difference, "p_value": p_value})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume significance", description="Bootstrap confidence intervals and permutation tests")
+    parser.add_argument("files", nargs="+", help="result CSV files, state JSON files and/or aggregated tables (.parquet, .feather)")
+    parser.add_argument("--compare", type=str, default="tool", help="column whose values are compared, e.g. tool or scale (default tool)")
+    parser.add_argument("--by", nargs="*", default=["category"], help="columns defining the groups (default category)")
+    parser.add_argument("--metric", nargs="+", default=["relative_error", "log_error"], choices=analytics.METRICS)
+    parser.add_argument("--statistic", nargs="+", default=["mean", "median"], choices=list(STATISTICS))
+    parser.add_argument("--resamples", "-B", type=int, default=10000, help="number of bootstrap resamples and permutations (default 10000)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level (default 0.95)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", "-j", type=int, default=1, help="number of processes (default 1)")
+    parser.add_argument("--output", "-o", type=str, default=None, help="prefix of the CSV files for the intervals and the tests")
+    args = parser.parse_args(argv)
+
+    df = analytics.load_results(args.files)
+    missing = [column for column in list(args.by) + [args.compare] if column not in df.columns]
+    if missing:
+        parser.error(f"the results have no column {', '.join(missing)}, choose from {', '.join(df.columns)} (the tool, unit and scale are "
+                     f"only in results arrays and tables aggregated from them)")
+    # one pool of processes for all the cells and tests
+    with ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else nullcontext() as executor:
+        intervals = confidence_intervals(df, list(args.by) + [args.compare], args.metric, args.statistic, args.resamples, args.confidence,
+                                         args.seed, args.workers, executor)
+        tests = compare(df, args.compare, args.by, args.metric, args.statistic, args.resamples, args.seed, args.workers, executor)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(intervals.to_string(index=False))
+        print()
+        print(tests.to_string(index=False))
+    if args.output:
+        intervals.to_csv(args.output + "_intervals.csv", index=False)
+        tests.to_csv(args.output + "_tests.csv", index=False)
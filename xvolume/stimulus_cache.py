@@ -0,0 +1,145 @@
+"""
+On-disk cache of prepared (resized and padded) stimuli
+
+Entries are raw uint8 `.npy` buffers that are memory-mapped when read. The key is derived from the source files' mtime and size, the
+window width and the assistance tool, so an entry is never stale: a changed image or another configuration simply gets another key.
+The least recently used entries are evicted once the cache grows beyond its size cap.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join("cache", "stimuli")
+
+
+class StimulusCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=1024 ** 3):
+        """
+        :param cache_dir: folder of the cache entries
+        :param max_bytes: size cap of the cache, least recently used entries are evicted above it
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # the folder is scanned on first use, by the first prefetched trial rather than before the window opens
+        self._entries = None
+        self.total_bytes = 0
+
+    @property
+    def entries(self):
+        """LRU order of the entries, key to (width, height, bytes), the caller holds the lock"""
+        if self._entries is None:
+            # file names are `<key>.<width>x<height>.npy`, the access time of an entry is its mtime
+            found = []
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    parts = entry.name.split(".")
+                    if parts[-1] == "tmp":
+                        # left over by a session that stopped while writing an entry, or being written by another session whose put
+                        # then fails and is skipped
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    elif len(parts) == 3 and parts[2] == "npy":
+                        stat = entry.stat()
+                        width, height = map(int, parts[1].split("x"))
+                        found.append((stat.st_mtime, parts[0], width, height, stat.st_size))
+            self._entries = OrderedDict()
+            for _, key, width, height, size in sorted(found):
+                self._entries[key] = (width, height, size)
+                self.total_bytes += size
+        return self._entries
+
+    @staticmethod
+    def key(files, window_width, tool, variant="image"):
+        """
+        :param files: source files of the stimulus (image, and mask for the ground truth overlay)
+        :param window_width: width of window
+        :param tool: assistance tool
+        :param variant: kind of stimulus prepared from the files
+        :return: cache key
+        """
+        parts = []
+        for file in files:
+            stat = os.stat(file)
+            parts.append(f"{os.path.basename(file)}:{stat.st_mtime_ns}:{stat.st_size}")
+        parts.extend([str(window_width), tool, variant])
+        return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+    def _path(self, key, width, height):
+        return os.path.join(self.cache_dir, f"{key}.{width}x{height}.npy")
+
+    def get(self, key):
+        """
+        :param key: cache key
+        :return: read-only memory-mapped RGB buffer, width and height of the resized image, or None if the key is not cached
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            width, height, _ = self.entries[key]
+            self.entries.move_to_end(key)
+        path = self._path(key, width, height)
+        try:
+            buffer = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            # removed or truncated by another session
+            with self.lock:
+                self._discard(key)
+            return None
+        return buffer, width, height
+
+    def put(self, key, buffer, width, height):
+        """
+        :param key: cache key
+        :param buffer: prepared RGB stimulus (uint8 array)
+        :param width: width of the resized image
+        :param height: height of the resized image
+        :return: True if the stimulus is cached, the cache is best-effort and a failed write (full disk, read-only folder, entry memory-mapped
+                 by another session on Windows) only leaves the stimulus uncached
+        """
+        path = self._path(key, width, height)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(buffer, dtype=np.uint8))
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        with self.lock:
+            self._discard(key, remove=False)
+            self.entries[key] = (width, height, size)
+            self.total_bytes += size
+            self._evict()
+        return True
+
+    def _discard(self, key, remove=True):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        width, height, size = entry
+        self.total_bytes -= size
+        if remove:
+            try:
+                os.remove(self._path(key, width, height))
+            except OSError:
+                pass  # already removed, or memory-mapped by a session on Windows and evicted again by a later scan
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self._discard(next(iter(self.entries)))
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
@@ -0,0 +1,45 @@
+"""
+Stimuli that live for the whole session
+
+Creating a visual.ImageStim or visual.TextStim allocates a GL texture (and font resources for text), so the trial loops keep one
+stimulus per role (the image, the mask overlay, the labels) and only swap its pixels or its text.
+"""
+from xvolume import backend
+
+
+class StimulusPool:
+    def __init__(self, window):
+        self.window = window
+        self.images = {}
+        self.texts = {}
+
+    def image(self, role, image):
+        """
+        :param role: name of the stimulus, stimuli of different roles can be on screen at the same time (e.g. "image" and "mask")
+        :param image: PIL image
+        :return: ImageStim showing the image at its size
+        """
+        stimulus = self.images.get(role)
+        if stimulus is None:
+            stimulus = self.images[role] = backend.visual.ImageStim(win=self.window, image=image, size=image.size)
+            return stimulus
+        if stimulus.image is image:
+            # ImageStim skips an image equal to its current one, but a pooled canvas is refilled in place
+            stimulus.image = None
+        stimulus.image = image
+        stimulus.size = image.size
+        return stimulus
+
+    def text(self, role, text='', **kwargs):
+        """
+        :param role: name of the label (e.g. "input" or "counter")
+        :param text: text of the label
+        :param kwargs: position, height, color... of the label, only used when it is created
+        :return: TextStim
+        """
+        stimulus = self.texts.get(role)
+        if stimulus is None:
+            stimulus = self.texts[role] = backend.visual.TextStim(win=self.window, text=text, **kwargs)
+        else:
+            stimulus.setText(text)
+        return stimulus
@@ -1,30 +1,75 @@
 import argparse
 import math
+import os
 import re
 import numpy as np
-from PIL import Image
-from psychopy import visual, event
+from PIL import Image, ImageColor
 from enum import Enum, auto
 
+from xvolume import backend
 from xvolume.constants import *
+from xvolume.manifest import read_list
+from xvolume.scheduler import ORDERS
 
 
-def get_args():
+class ListCategoriesAction(argparse.Action):
+    """Prints the categories with the number of experiment and training images listed for them, then exits"""
+
+    def __init__(self, option_strings, dest, **kwargs):
+        super().__init__(option_strings, dest, nargs=0, default=argparse.SUPPRESS, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        for category in CATEGORIES:
+            training = min(NUM_TRAINING_IMAGES, len(read_list(f"{category}_training_images.txt")))
+            print(f"{category:<12}{len(read_list(f'{category}.txt')):>6} images{training:>4} training images")
+        parser.exit()
+
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser("Size Estimation Experiment")
-    parser.add_argument("--dataset-path", "-dp", type=str, required=True, help="path to the Pascal dataset")
+    parser.add_argument("--dataset-path", "-dp", type=str, help="path to the Pascal dataset, required unless the session is run with --station")
     parser.add_argument("--category", "-c", type=str, required=True, help="choose the category for the experiment",
-                        choices=['aeroplane', 'bicycle', 'bird', 'boat',
-                                 'bottle', 'bus', 'car', 'cat', 'chair',
-                                 'cow', 'diningtable', 'dog', 'horse',
-                                 'motorbike', 'person', 'pottedplant',
-                                 'sheep', 'sofa', 'train', 'tvmonitor', 'test'])
+                        choices=CATEGORIES)
     parser.add_argument("--window-size", '-ws', type=str, help="size of the display window, default is 1200,900", default="1200,900")
     parser.add_argument("--unit", '-u', type=str, help="input unit", default="boxes", choices=["boxes", "percent"])
     parser.add_argument("--result-file", '-f', type=str, help="file name to store the experimental results", default="responses")
     parser.add_argument("--assistance-tool", '-at', type=str, help="The type of assistance tool to use. Choose from grid, and box with absolute size",
                         default="absbox",
                         choices=["grid", "absbox", "none"])
-    args = parser.parse_args()
+    parser.add_argument("--prefetch", '-pf', type=int, help="number of upcoming images prepared in the background, 0 disables prefetching (default 2)",
+                        default=2)
+    parser.add_argument("--gt-index", type=str, help="ground truth index created with `python -m xvolume index` (default cache/gt_index.npz)",
+                        default=os.path.join("cache", "gt_index.npz"))
+    parser.add_argument("--manifest", type=str, help="dataset manifest created with `python -m xvolume manifest`, it replaces the ground truth index "
+                                                     "(default cache/manifest.npz)", default=os.path.join("cache", "manifest.npz"))
+    parser.add_argument("--cache-dir", type=str, help="folder of the prepared stimuli cache (default cache/stimuli)", default=os.path.join("cache", "stimuli"))
+    parser.add_argument("--cache-size", type=int, help="size cap of the prepared stimuli cache in MB, 0 disables the cache (default 1024)", default=1024)
+    parser.add_argument("--warm-cache", action="store_true", help="prepare and cache all the stimuli of the category, then exit")
+    parser.add_argument("--profile", action="store_true",
+                        help="write the timings of each stage of each trial and the dropped frames to results/<result file>_profile.csv/.json")
+    parser.add_argument("--order", type=str, choices=list(ORDERS), default="listed",
+                        help="order of the images: listed (order of the category list, default), uncertainty (images whose size is least known in "
+                             "the history first) or stratified (uncertainty first within bins of ground truth size, taken in turn)")
+    parser.add_argument("--history", type=str, nargs="*", default=[],
+                        help="results of earlier sessions the order is computed from (result CSV files, results arrays, aggregated tables)")
+    parser.add_argument("--budget", type=int, default=None, help="number of images of the session, the first ones of the order (default all)")
+    parser.add_argument("--station", type=str, default=None,
+                        help="host:port of a coordinator started with `python -m xvolume serve`, the stimuli, ground truth and order of the images "
+                             "are read from its store and the responses are also sent to it (the result file name is the name of the station)")
+    parser.add_argument("--authkey", type=str, default=None,
+                        help="key shared by the coordinator and the stations, required with --station (default a random key printed by the coordinator)")
+    parser.add_argument("--list-categories", action=ListCategoriesAction, help="list the categories and their number of images, then exit")
+    parser.add_argument("--dry-run", action="store_true", help="check the arguments and the dataset files of the category, then exit without "
+                                                               "opening the window")
+    args = parser.parse_args(argv)
+    if args.dataset_path is None and args.station is None:
+        parser.error("the following arguments are required: --dataset-path/-dp")
+    if args.station is not None and args.authkey is None:
+        parser.error("--authkey is required with --station, use the key given to or printed by the coordinator")
+    if args.budget is not None and args.budget < 1:
+        parser.error("--budget must be a positive number of images")
+    assert "," in args.window_size and len(args.window_size.split(",")) == 2 and all([s.isdigit() for s in args.window_size.split(",")]), \
+        "window size argument must be two positive integers separated by ',' representing the display window size."
     if args.assistance_tool == "absbox": assert args.unit == "boxes", "Input unit should be boxes if the assistance tool is absolute boxes"
     if args.assistance_tool == "none": args.unit = "percent"
     return args
@@ -36,9 +81,18 @@ class Scale(Enum):
 
 
 class AssistanceTool:
+    """
+    The lines of the assistance tool are rendered once per (stimulus size, scale) into a transparent texture which is drawn on top of the
+    stimulus with a single draw call. There is one overlay stimulus per scale for the whole session: when the stimulus size changes its
+    texture is replaced, and toggling the scale switches between the two overlays rendered for the current size.
+    """
+
     def __init__(self, tool, window):
         self.tool = tool
         self.window = window
+        self.stimuli = {}  # scale to its overlay ImageStim
+        self.size = None  # stimulus size the overlays are rendered for
+        self.overlays = {}  # scale to its overlay at the current size, None if the tool has no lines
 
         if tool == "grid":
             self.assistance_tool = self.assistance_tool_grid
@@ -49,7 +103,11 @@ class AssistanceTool:
         else:
             raise NotImplementedError
 
-    def assistance_tool_grid(self, stimulus, scale):
+    def assistance_tool_grid(self, image_width, image_height, scale):
+        """
+        This function provides the grid lines which split the image into patches of the same size
+        :return: y positions of the horizontal lines, x positions of the vertical lines (the center of the image is 0)
+        """
         # assign number of rows and columns as per the aspect ratio
         if scale == Scale.LARGE:
             num_row, num_col = LARGE_SCALE_NUM_ROW, LARGE_SCALE_NUM_COL
@@ -57,40 +115,26 @@ class AssistanceTool:
             num_row, num_col = SMALL_SCALE_NUM_ROW, SMALL_SCALE_NUM_COL
         else:
             raise NotImplementedError
-        if stimulus.size[0] > stimulus.size[1]:
+        if image_width > image_height:
             # width > height
             row, col = num_row, num_col
         else:
             # width <= height
             row, col = num_col, num_row
 
-        # Draw a grid over the image
-        image_width = stimulus.size[0]  # width of the image in pixels
-        image_height = stimulus.size[1]  # height of the image in pixels
-
         # Calculate the distance between lines for the grid
         dx = image_width / col
         dy = image_height / row
 
-        # Horizontal lines
-        for i in range(row + 1):
-            y_pos = i * dy - (image_height / 2)  # Adjusting position relative to the center of the image
-            line = visual.Line(self.window, start=(-image_width / 2, y_pos), end=(image_width / 2, y_pos), lineColor=GRID_LINE_COLOR)
-            line.draw()
+        # Adjusting positions relative to the center of the image
+        y_positions = [i * dy - (image_height / 2) for i in range(row + 1)]
+        x_positions = [i * dx - (image_width / 2) for i in range(col + 1)]
+        return y_positions, x_positions
 
-        # Vertical lines
-        for i in range(col + 1):
-            x_pos = i * dx - (image_width / 2)  # Adjusting position relative to the center of the image
-            line = visual.Line(self.window, start=(x_pos, -image_height / 2), end=(x_pos, image_height / 2), lineColor=GRID_LINE_COLOR)
-            line.draw()
-
-    def assistance_tool_abs_boxes(self, stimulus, scale):
+    def assistance_tool_abs_boxes(self, image_width, image_height, scale):
         """
-        This function provides boxes with absolute size on the image to assist the estimation
-        :param mywin: window
-        :param stimulus: image stimulus
-        :param window_width: window_width
-        :return: None
+        This function provides the lines of boxes with absolute size on the image to assist the estimation
+        :return: y positions of the horizontal lines, x positions of the vertical lines (the center of the image is 0)
         """
         if scale == Scale.LARGE:
             image_width_over_box_length = LARGE_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
@@ -100,38 +144,188 @@ class AssistanceTool:
             raise NotImplementedError
 
         window_width = self.window.size[0]
-        image_width, image_height = stimulus.size
         box_size = window_width // image_width_over_box_length  # each box's size is 1/10 of the window width (image width is always 1/2 of the window width)
 
         # set initial line position
         if scale == Scale.LARGE:
-            y_pos = 0.5 * box_size  # center of the image is 0
-            x_pos = 0.5 * box_size
+            start = 0.5 * box_size  # center of the image is 0
         else:
-            y_pos = 0
-            x_pos = 0
+            start = 0
 
-        # Horizontal lines
+        y_positions = []
+        y_pos = start
         while y_pos <= (image_height / 2):
-            line = visual.Line(self.window, start=(-image_width / 2, y_pos), end=(image_width / 2, y_pos), lineColor=GRID_LINE_COLOR)
-            line.draw()
-            line = visual.Line(self.window, start=(-image_width / 2, -y_pos), end=(image_width / 2, -y_pos), lineColor=GRID_LINE_COLOR)
-            line.draw()
+            y_positions.extend([y_pos, -y_pos])
             y_pos += box_size
 
-        # Vertical lines
+        x_positions = []
+        x_pos = start
         while x_pos <= (image_width / 2):
-            line = visual.Line(self.window, start=(x_pos, -image_height / 2), end=(x_pos, image_height / 2), lineColor=GRID_LINE_COLOR)
-            line.draw()
-            line = visual.Line(self.window, start=(-x_pos, -image_height / 2), end=(-x_pos, image_height / 2), lineColor=GRID_LINE_COLOR)
-            line.draw()
+            x_positions.extend([x_pos, -x_pos])
             x_pos += box_size
+        return y_positions, x_positions
+
+    def assistance_tool_none(self, image_width, image_height, scale):
+        return [], []
 
-    def assistance_tool_none(self, stimulus, scale):
-        pass
+    def overlay(self, image_width, image_height, scale):
+        """
+        This function renders the lines of the assistance tool into a transparent texture of the size of the stimulus
+        :return: overlay stimulus, None if the tool has no lines
+        """
+        if self.size != (image_width, image_height):
+            self.size = (image_width, image_height)
+            self.overlays.clear()
+        if scale not in self.overlays:
+            y_positions, x_positions = self.assistance_tool(image_width, image_height, scale)
+            if not y_positions and not x_positions:
+                self.overlays[scale] = None
+                return None
+
+            texture = np.zeros((image_height, image_width, 4), dtype=np.uint8)
+            color = ImageColor.getrgb(GRID_LINE_COLOR) + (255,)
+            for y_pos in y_positions:
+                row = min(max(int(round(image_height / 2 - y_pos)) - GRID_LINE_WIDTH // 2, 0), image_height - GRID_LINE_WIDTH)
+                texture[row:row + GRID_LINE_WIDTH, :] = color
+            for x_pos in x_positions:
+                col = min(max(int(round(image_width / 2 + x_pos)) - GRID_LINE_WIDTH // 2, 0), image_width - GRID_LINE_WIDTH)
+                texture[:, col:col + GRID_LINE_WIDTH] = color
+            image = Image.fromarray(texture, "RGBA")
+            stimulus = self.stimuli.get(scale)
+            if stimulus is None:
+                stimulus = self.stimuli[scale] = backend.visual.ImageStim(win=self.window, image=image, size=(image_width, image_height),
+                                                                          interpolate=False)
+            else:
+                stimulus.image = image
+                stimulus.size = (image_width, image_height)
+            self.overlays[scale] = stimulus
+        return self.overlays[scale]
 
     def __call__(self, stimulus, scale):
-        self.assistance_tool(stimulus, scale)
+        overlay = self.overlay(int(stimulus.size[0]), int(stimulus.size[1]), scale)
+        if overlay is not None:
+            overlay.draw()
+
+
+# a response is a non-negative decimal number without leading zeros
+NUMBER_PATTERN = re.compile(r"^(0|[1-9][0-9]*)(\.[0-9]+)?$")
+
+# scale to (image width over box length of the absolute boxes, percent per grid box, number of grid boxes)
+SCALES = {Scale.SMALL: (SMALL_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH, SMALL_SCALE_PERCENT_PER_BOX, SMALL_SCALE_NUMBER_OF_PATCHES),
+          Scale.LARGE: (LARGE_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH, LARGE_SCALE_PERCENT_PER_BOX, LARGE_SCALE_NUMBER_OF_PATCHES)}
+
+
+def percent_per_unit(tool, unit, image_width, image_height, scale, window_width):
+    """
+    This function computes how many percent of the image one unit of the response is, the image sizes can be NumPy arrays
+    :param tool: assistance tool
+    :param unit: input unit (boxes or percent)
+    :param image_width: width of image
+    :param image_height: height of image
+    :param scale: Scale of the assistance tool
+    :param window_width: width of window
+    :return: percent of the image per box, 1 if the unit is percent
+    """
+    if scale not in SCALES:
+        raise NotImplementedError
+    image_width_over_box_length, percent_per_box, _ = SCALES[scale]
+    if tool == "absbox":
+        # box_size is always 1/10 of window width, image_width is always 1/2 window width
+        box_length = window_width / image_width_over_box_length
+        return box_length ** 2 / (image_width * image_height) * 100
+    if tool == "grid":
+        return percent_per_box if unit == "boxes" else 1
+    if tool == "none":
+        return 1
+    raise NotImplementedError
+
+
+class MeasurementContext:
+    """
+    Conversions between the responses and the percent of the image for one stimulus, built once when its size is known. The factor and the
+    largest valid response of both scales are computed up front, so checking and converting a response are lookups. The absolute boxes are
+    converted with the box area in the order of operations of ComputeTool, so the sizes are rounded to the same digits.
+    """
+    __slots__ = ("unit", "pixels", "box_areas", "factors", "limits", "invalid_messages")
+
+    def __init__(self, tool, unit, image_width, image_height, window_width):
+        """
+        :param tool: assistance tool
+        :param unit: input unit (boxes or percent)
+        :param image_width: width of image
+        :param image_height: height of image
+        :param window_width: width of window
+        """
+        self.unit = unit
+        self.pixels = image_width * image_height
+        self.box_areas = {}  # area of an absolute box, None for the other tools
+        self.factors = {}
+        self.limits = {}
+        self.invalid_messages = {}
+        for scale, (image_width_over_box_length, _, number_of_patches) in SCALES.items():
+            self.box_areas[scale] = (window_width / image_width_over_box_length) ** 2 if tool == "absbox" else None
+            self.factors[scale] = percent_per_unit(tool, unit, image_width, image_height, scale, window_width)
+            if tool == "absbox":
+                limit = image_width * image_height / (window_width / image_width_over_box_length) ** 2
+            elif tool == "grid" and unit == "boxes":
+                limit = number_of_patches
+            else:
+                limit = 100
+            self.limits[scale] = limit
+            self.invalid_messages[scale] = f"Please enter a valid number between 0 and {math.floor(limit * 10) / 10:.1f}. \nTry again."
+
+    def valid_input(self, string, scale):
+        return NUMBER_PATTERN.fullmatch(string) is not None and float(string) <= self.limits[scale]
+
+    def percent(self, response, scale):
+        """
+        :param response: user's response (number of boxes or percentage)
+        :return: object size in percent
+        """
+        box_area = self.box_areas[scale]
+        if box_area is None:
+            return float(response) * self.factors[scale]
+        return float(response) * box_area / self.pixels * 100
+
+    def size(self, response, scale):
+        """
+        :param response: user's response (number of boxes or percentage)
+        :return: object size in percent, rounded to 2 decimals
+        """
+        return str(round(self.percent(response, scale), 2))
+
+    def ground_truth_in_unit(self, gt, scale):
+        """
+        :param gt: ground truth size in percent
+        :return: ground truth size in number of boxes or percent
+        """
+        box_area = self.box_areas[scale]
+        if box_area is None:
+            return gt / self.factors[scale]
+        return (gt / 100) * self.pixels / box_area
+
+    def ground_truth_text(self, gt, scale):
+        return f"Correct object size is {self.ground_truth_in_unit(gt, scale):.2f} {self.unit} \n Press ENTER to see the next image"
+
+    @staticmethod
+    def to_percent(responses, tool, unit, image_widths, image_heights, scales, window_width):
+        """
+        This function converts stored responses to percent of the image in bulk, e.g. in the analysis of the results
+        :param responses: responses in the input unit
+        :param image_widths: width of the stimulus of each response
+        :param image_heights: height of the stimulus of each response
+        :param scales: name of the Scale of each response (SMALL or LARGE)
+        :return: array of sizes in percent
+        """
+        responses = np.asarray(responses, dtype=float)
+        image_widths, image_heights = np.asarray(image_widths, dtype=float), np.asarray(image_heights, dtype=float)
+        large = np.asarray(scales) == Scale.LARGE.name
+        if tool == "absbox":
+            box_areas = np.where(large, (window_width / SCALES[Scale.LARGE][0]) ** 2, (window_width / SCALES[Scale.SMALL][0]) ** 2)
+            return responses * box_areas / (image_widths * image_heights) * 100
+        factors = np.where(large, percent_per_unit(tool, unit, image_widths, image_heights, Scale.LARGE, window_width),
+                           percent_per_unit(tool, unit, image_widths, image_heights, Scale.SMALL, window_width))
+        return responses * factors
 
 
 class ComputeTool:
@@ -147,100 +341,29 @@ class ComputeTool:
         :param image_height: width of image
         :return: object size
         """
-        if scale == Scale.LARGE:
-            percent_per_box = LARGE_SCALE_PERCENT_PER_BOX
-            image_width_over_box_length = LARGE_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
-        elif scale == Scale.SMALL:
-            percent_per_box = SMALL_SCALE_PERCENT_PER_BOX
-            image_width_over_box_length = SMALL_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
-        else:
-            raise NotImplementedError
-
-        if tool == "absbox":
-            # box_size is always 1/10 of window width, image_width is always 1/2 window width
-            box_length = window_width / image_width_over_box_length
-            num_boxes = float(response)
-            size = num_boxes * box_length ** 2 / (image_width * image_height) * 100
-        elif tool == "grid":
-            if unit == "boxes":
-                num_boxes = float(response)
-                size = num_boxes * percent_per_box
-            else:
-                size = float(response)
-        elif tool == "none":
-            size = float(response)
-        else:
-            raise NotImplementedError
-        return str(round(size, 2))
+        return MeasurementContext(tool, unit, image_width, image_height, window_width).size(response, scale)
 
     @staticmethod
     def compute_ground_truth_image_size(gt, tool, unit, image_width, image_height, scale, window_width):
-        if scale == Scale.LARGE:
-            percent_per_box = LARGE_SCALE_PERCENT_PER_BOX
-            image_width_over_box_length = LARGE_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
-        elif scale == Scale.SMALL:
-            percent_per_box = SMALL_SCALE_PERCENT_PER_BOX
-            image_width_over_box_length = SMALL_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
-        else:
-            raise NotImplementedError
+        return MeasurementContext(tool, unit, image_width, image_height, window_width).ground_truth_text(gt, scale)
 
-        if tool == "absbox":
-            box_length = window_width / image_width_over_box_length
-            box_area = box_length ** 2
-            gt = (gt / 100) * (image_width * image_height) / box_area
-        else:
-            gt = gt / percent_per_box if unit == "boxes" else gt
-        return f"Correct object size is {gt:.2f} {unit} \n Press ENTER to see the next image"
+    @staticmethod
+    def ground_truth_in_unit(gt, tool, unit, image_width, image_height, scale, window_width):
+        """
+        This function converts the ground truth size to the input unit, it is the inverse of compute_size
+        :param gt: ground truth size in percent
+        :return: ground truth size in number of boxes or percent
+        """
+        return MeasurementContext(tool, unit, image_width, image_height, window_width).ground_truth_in_unit(gt, scale)
 
 class VerificationTool:
     @staticmethod
     def valid_input(string, unit, tool, image_width, image_height, scale, window_width):
-        pattern = r"^(0|[1-9][0-9]*)(\.[0-9]+)?$"
-        match = re.fullmatch(pattern, string)
-        if not match:
-            return False
-
-        if scale == Scale.LARGE:
-            image_width_over_box_length = LARGE_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
-            number_of_patches = LARGE_SCALE_NUMBER_OF_PATCHES
-        elif scale == Scale.SMALL:
-            image_width_over_box_length = SMALL_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
-            number_of_patches = SMALL_SCALE_NUMBER_OF_PATCHES
-        else:
-            raise NotImplementedError
-
-        num = float(string)
-        if tool == "absbox":
-            box_size = window_width / image_width_over_box_length
-            box_area = box_size ** 2
-            return 0 <= num <= (image_width * image_height / box_area)
-        elif tool == "grid":
-            if unit == "boxes":
-                return 0 <= num <= number_of_patches
-            else:
-                return 0 <= num <= 100
-        else:
-            return 0 <= num <= 100
-
+        return MeasurementContext(tool, unit, image_width, image_height, window_width).valid_input(string, scale)
 
     @staticmethod
     def invalid_input_value(unit, tool, image_width, image_height, scale, window_width):
-        if scale == Scale.LARGE:
-            number_patches = LARGE_SCALE_NUMBER_OF_PATCHES
-            image_width_over_box_length = LARGE_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
-        elif scale == Scale.SMALL:
-            number_patches = SMALL_SCALE_NUMBER_OF_PATCHES
-            image_width_over_box_length = SMALL_SCALE_IMAGE_WIDTH_OVER_BOX_LENGTH
-        else:
-            raise NotImplementedError
-
-        if tool == "absbox":
-            box_size = window_width / image_width_over_box_length
-            box_area = box_size ** 2
-            limit = image_width * image_height / box_area
-        else:
-            limit = number_patches if unit == "boxes" else 100
-        return f"Please enter a valid number between 0 and {math.floor(limit * 10) / 10:.1f}. \nTry again."
+        return MeasurementContext(tool, unit, image_width, image_height, window_width).invalid_messages[scale]
 
     @staticmethod
     def is_digit_or_dot(s: str):
@@ -253,18 +376,23 @@ class VerificationTool:
 
 
 class DisplayTool:
+    @staticmethod
+    def wait_for_return():
+        """
+        This function blocks until ENTER is pressed, other keys pressed meanwhile are discarded
+        """
+        while 'return' not in backend.event.waitKeys(clearEvents=False):
+            pass
+
     @staticmethod
     def display_instructions(window, instruction):
         # Display a prompt above the image
-        prompt = visual.TextStim(win=window, text=instruction, pos=(0, 0), height=window.size[0] // 45, wrapWidth=window.size[0] / 1.5, color=PROMPT_COLOR)
+        prompt = backend.visual.TextStim(win=window, text=instruction, pos=(0, 0), height=window.size[0] // 45, wrapWidth=window.size[0] / 1.5, color=PROMPT_COLOR)
 
-        # Draw the prompt
-        while True:
-            prompt.draw()
-            window.flip()
-            keys = event.getKeys()
-            if 'return' in keys:
-                break
+        # Draw the prompt once, it stays on screen until ENTER is pressed
+        prompt.draw()
+        window.flip()
+        DisplayTool.wait_for_return()
 
     @staticmethod
     def display_training_statistics(window, avg):
@@ -275,15 +403,12 @@ class DisplayTool:
         """
         # Display a prompt above the image
         instruction = f"Your average relative error is {avg * 100:.2f}% \n\n press 'Enter' to continue"
-        prompt = visual.TextStim(win=window, text=instruction, pos=(0, 0), height=window.size[0] // 40, wrapWidth=window.size[0] / 1.6, color='white')
+        prompt = backend.visual.TextStim(win=window, text=instruction, pos=(0, 0), height=window.size[0] // 40, wrapWidth=window.size[0] / 1.6, color='white')
 
-        # Draw the prompt
-        while True:
-            prompt.draw()
-            window.flip()
-            keys = event.getKeys()
-            if 'return' in keys:
-                break
+        # Draw the prompt once, it stays on screen until ENTER is pressed
+        prompt.draw()
+        window.flip()
+        DisplayTool.wait_for_return()
 
     @staticmethod
     def display_final_statistics(window, avg, total_time):
@@ -295,29 +420,23 @@ class DisplayTool:
         """
         # Display a prompt above the image
         instruction = f"Your average relative error is {avg * 100:.2f}%, Your total time spend on the experiment is {total_time:.2f}s \n\n press 'Enter' to continue"
-        prompt = visual.TextStim(win=window, text=instruction, pos=(0, 0), height=window.size[0] // 40, wrapWidth=window.size[0] / 1.6, color='white')
+        prompt = backend.visual.TextStim(win=window, text=instruction, pos=(0, 0), height=window.size[0] // 40, wrapWidth=window.size[0] / 1.6, color='white')
 
-        # Draw the prompt
-        while True:
-            prompt.draw()
-            window.flip()
-            keys = event.getKeys()
-            if 'return' in keys:
-                break
+        # Draw the prompt once, it stays on screen until ENTER is pressed
+        prompt.draw()
+        window.flip()
+        DisplayTool.wait_for_return()
 
     @staticmethod
     def display_file_not_found(window, filename):
         exception = f"{filename} file is not found in your directory. Press ENTER to quit the experiment."
         # Display a prompt above the image
-        prompt = visual.TextStim(win=window, text=exception, pos=(0, 0), height=window.size[0] // 45, wrapWidth=window.size[0] / 1.5, color=PROMPT_COLOR)
+        prompt = backend.visual.TextStim(win=window, text=exception, pos=(0, 0), height=window.size[0] // 45, wrapWidth=window.size[0] / 1.5, color=PROMPT_COLOR)
 
-        # Draw the prompt
-        while True:
-            prompt.draw()
-            window.flip()
-            keys = event.getKeys()
-            if 'return' in keys:
-                break
+        # Draw the prompt once, it stays on screen until ENTER is pressed
+        prompt.draw()
+        window.flip()
+        DisplayTool.wait_for_return()
 
 class StatisticsTool:
     @staticmethod
@@ -358,14 +477,13 @@ class StatisticsTool:
 
 class ImageTool:
     @staticmethod
-    def resize_image(original_width, original_length, window_width, image):
+    def resized_size(original_width, original_length, window_width):
         """
-        This function is used to resize the original image such that the longer side of the image equals the `img_size` which is 1/2 of the window width
+        This function computes the size of the displayed image, its longer side equals 1/2 of the window width
         :param original_width: width of original image
         :param original_length: length of original image
-        :param img_size: target image size indicating the longer side of the image should be half of the window width
-        :param image: input image
-        :return: resized image (ndarray)
+        :param window_width: width of window
+        :return: width, height of the displayed image
         """
         img_size = window_width // 2
         if original_length >= original_width:
@@ -374,39 +492,95 @@ class ImageTool:
         else:
             width = int(img_size)
             height = int(img_size * original_length / original_width)
+        return width, height
 
+    @staticmethod
+    def load_image(image_file, window_width):
+        """
+        This function decodes the image to RGB. JPEG images displayed smaller than their size are decoded at a reduced resolution
+        (1/2, 1/4 or 1/8 DCT scaling), which is still at least the displayed size
+        :param image_file: path to the image
+        :param window_width: width of window
+        :return: decoded image, width and height of the original image
+        """
+        with Image.open(image_file) as image:
+            original_width, original_height = image.size
+            image.draft("RGB", ImageTool.resized_size(original_width, original_height, window_width))
+            image.load()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return image, original_width, original_height
+
+    @staticmethod
+    def resize_image(original_width, original_length, window_width, image):
+        """
+        This function is used to resize the original image such that the longer side of the image equals the `img_size` which is 1/2 of the window width
+        :param original_width: width of original image
+        :param original_length: length of original image
+        :param img_size: target image size indicating the longer side of the image should be half of the window width
+        :param image: input image, it can be decoded at a reduced resolution
+        :return: resized image (ndarray)
+        """
+        width, height = ImageTool.resized_size(original_width, original_length, window_width)
         return image.resize((width, height), Image.Resampling.BILINEAR), width, height
 
     @staticmethod
-    def pad_image(window_width, image):
+    def overlay_mask(image, gt_image, class_index, alpha=MASK_ALPHA):
+        """
+        This function blends the color of the category over its pixels, the other pixels are blended with black. The mask is resized to
+        the image (nearest neighbour) and colored with a palette lookup table, so the blend runs at the displayed size
+        :param image: RGB image resized to the displayed size
+        :param gt_image: segmentation mask of the original image (palette image of class indices)
+        :param class_index: index of the category in the segmentation mask
+        :param alpha: weight of the mask color
+        :return: blended image
+        """
+        mask = np.asarray(gt_image.resize(image.size, Image.Resampling.NEAREST))
+        # one 32-bit RGBX gather per pixel, only the category has a color
+        lut = np.zeros(256, dtype=np.uint32)
+        lut[class_index] = PALETTE_LUT.view(np.uint32)[class_index, 0]
+        colors = Image.frombytes("RGB", image.size, lut.take(mask), "raw", "RGBX")
+        return Image.blend(image, colors, alpha)
+
+    @staticmethod
+    def padded_size(window_width):
+        """
+        :param window_width: width of window
+        :return: side of the padded square image, 6 boxes of 1/5 of the image size
+        """
+        img_size = window_width // 2
+        box_size = int(img_size / 5)
+        return box_size * 6
+
+    @staticmethod
+    def pad_image(window_width, image, canvas=None):
         """
         This function is used to pad the given image with gray values into a square image of size (6 x image_size) x (6 x image_size)
         :param img_size: image_size equals half of the window width.
         :param image: input image to be padded
+        :param canvas: RGB image of the padded size that is reused (e.g. from a CanvasPool), a new one is created if None
         :return: return padded image
         """
-        img_size = window_width // 2
-        box_size = int(img_size / 5)
-        padded_image_size = box_size * 6
+        padded_image_size = ImageTool.padded_size(window_width)
         image_width, image_height = image.size
-        img_arr = np.array(image)
-
-        width_padding = (padded_image_size - image_width) // 2
-        height_padding = (padded_image_size - image_height) // 2
-
-        width_offset = 1 if image_width % 2 == 1 else 0
-        height_offset = 1 if image_height % 2 == 1 else 0
 
-        padded_image_arr = np.pad(img_arr,
-                                  ((height_padding, height_padding + height_offset), (width_padding, width_padding + width_offset), (0, 0)),
-                                  constant_values=128)
-        padded_image = Image.fromarray(padded_image_arr, "RGB")
-        return padded_image
+        if canvas is None:
+            canvas = Image.new("RGB", (padded_image_size, padded_image_size), PAD_COLOR)
+        else:
+            canvas.paste(PAD_COLOR, (0, 0, padded_image_size, padded_image_size))
+        # an odd remainder goes to the bottom and right borders
+        canvas.paste(image, ((padded_image_size - image_width) // 2, (padded_image_size - image_height) // 2))
+        return canvas
 
 palette = [0, 0, 0, 128, 0, 0, 0, 128, 0, 128, 128, 0, 0, 0, 128, 128, 0, 128, 0, 128, 128,
            128, 128, 128, 64, 0, 0, 192, 0, 0, 64, 128, 0, 192, 128, 0, 64, 0, 128, 192, 0, 128,
            64, 128, 128, 192, 128, 128, 0, 64, 0, 128, 64, 0, 0, 192, 0, 128, 192, 0, 0, 64, 128]
 
+# RGBX color of each class index, indices without a color are black
+PALETTE_LUT = np.zeros((256, 4), dtype=np.uint8)
+PALETTE_LUT[:len(palette) // 3, :3] = np.reshape(palette, (-1, 3))
+
+
 def colorize_mask(mask):
     new_mask = Image.fromarray(mask.astype(np.uint8)).convert('P')
     new_mask.putpalette(palette)
@@ -0,0 +1,348 @@
+"""
+Live statistics of the experiments in progress
+
+    python -m xvolume watch  # every category with a state in the states folder
+    python -m xvolume watch -c bird dog --interval 2 --top-k 5
+
+The state of every category (see journal.StateJournal) is tailed: each poll reads the lines appended to the journal since the last poll
+and folds the new trials into running statistics, the count, mean and standard deviation of the time and of every error metric (Welford),
+a P² estimate of the median of every error metric and the k images with the largest relative error. A poll costs O(1) per new trial
+however many trials are on disk, the checkpoint is only parsed at start and when the journal was compacted before its last lines were read.
+The medians are estimates, `python -m xvolume analyze` computes the exact values.
+"""
+import argparse
+import bisect
+import glob
+import heapq
+import json
+import math
+import os
+import sys
+import time
+
+from xvolume import analytics
+
+STATE_SUFFIX = "_saved_state"
+DEFAULT_INTERVAL = 5
+
+
+class RunningMoments:
+    """Count, mean and sample variance of a stream of values (Welford), NaN values are skipped"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def push(self, value):
+        if math.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else math.nan
+
+    @property
+    def value(self):
+        return self.mean if self.count else math.nan
+
+
+class P2Quantile:
+    """
+    Streaming estimate of a quantile with 5 markers (P² algorithm of Jain and Chlamtac), exact for less than 5 values. NaN values are
+    skipped
+    """
+
+    def __init__(self, p=0.5):
+        """
+        :param p: quantile, 0.5 is the median
+        """
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def push(self, value):
+        if math.isnan(value):
+            return
+        q = self.heights
+        if len(q) < 5:
+            bisect.insort(q, value)
+            return
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = bisect.bisect_right(q, value) - 1
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                                                             + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    # the parabolic prediction is out of order, move the marker linearly
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    @property
+    def value(self):
+        q = self.heights
+        if not q:
+            return math.nan
+        if len(q) < 5 or self.positions[4] == 5:
+            # exact quantile of the first values, interpolated like pandas
+            position = (len(q) - 1) * self.p
+            low = math.floor(position)
+            return q[low] + (q[min(low + 1, len(q) - 1)] - q[low]) * (position - low)
+        return q[2]
+
+
+class TopK:
+    """The k largest values of a stream with their labels, NaN values are skipped"""
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []  # min-heap of (value, sequence number, label), the smallest of the k largest values first
+        self.pushed = 0
+
+    def push(self, value, label):
+        if self.k <= 0 or math.isnan(value):
+            return
+        self.pushed += 1
+        item = (value, self.pushed, label)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item[0] > self.heap[0][0]:
+            heapq.heapreplace(self.heap, item)
+
+    def items(self):
+        """
+        :return: list of (value, label), largest first, the first pushed first among equal values
+        """
+        return [(value, label) for value, _, label in sorted(self.heap, key=lambda item: (-item[0], item[1]))]
+
+
+class RunningStatistics:
+    """Statistics of the responses of an experiment, updated with each new trial"""
+
+    def __init__(self, top_k=10):
+        """
+        :param top_k: number of images with the largest relative error that are kept
+        """
+        self.count = 0
+        self.time = RunningMoments()
+        self.moments = {metric: RunningMoments() for metric in analytics.METRICS}
+        self.medians = {metric: P2Quantile(0.5) for metric in analytics.METRICS}
+        self.worst = TopK(top_k)
+
+    def extend(self, responses):
+        """
+        :param responses: new responses, lists of image name, estimated size, gt size and time
+        """
+        if not responses:
+            return
+        images, estimates, gts, times = zip(*responses)
+        metrics = analytics.error_metrics(gts, estimates)
+        columns = {metric: values.tolist() for metric, values in metrics.items()}
+        for row, (image, seconds) in enumerate(zip(images, times)):
+            self.count += 1
+            self.time.push(float(seconds))
+            for metric, column in columns.items():
+                self.moments[metric].push(column[row])
+                self.medians[metric].push(column[row])
+            self.worst.push(columns["relative_error"][row], (image, columns["signed_relative_error"][row]))
+
+    def summary(self):
+        """
+        :return: dict with the keys of a row of analytics.summarize
+        """
+        summary = {"count": self.count, "time_mean": self.time.value}
+        for metric in analytics.METRICS:
+            summary[f"{metric}_mean"] = self.moments[metric].value
+            summary[f"{metric}_median"] = self.medians[metric].value
+            summary[f"{metric}_std"] = self.moments[metric].std
+        return summary
+
+
+class StateTail:
+    """
+    Follows the state files of a category. The journal is read from the offset of the last poll, a record is new if its index is past the
+    last index read. The journal is emptied when the checkpoint is written: after a new checkpoint, the checkpoint is only parsed if the
+    journal does not continue from the last index read (its last lines were compacted before they were read, the tail started on a saved
+    state or the state was reset). An empty journal is looked at again at the next poll before the checkpoint is parsed. A reset is
+    noticed as long as the new experiment has not gone past the last index read between two polls.
+    """
+
+    def __init__(self, category, state_dir="states", top_k=10):
+        self.category = category
+        self.checkpoint_file = os.path.join(state_dir, f"{category}{STATE_SUFFIX}.json")
+        self.journal_file = os.path.join(state_dir, f"{category}{STATE_SUFFIX}.jsonl")
+        self.top_k = top_k
+        self.statistics = RunningStatistics(top_k)
+        self.last_index = -1
+        self.last_image = None
+        self.elapsed_time = 0
+        self.offset = 0
+        self.head = b""  # first line of the journal, it changes when the journal is emptied or replaced
+        self.checkpoint_signature = None
+        self.deferred = False
+
+    def _restart(self):
+        """A new experiment of the category was started"""
+        self.statistics = RunningStatistics(self.top_k)
+        self.last_index = -1
+        self.last_image = None
+
+    def _read_journal(self):
+        """
+        :return: records of the complete lines appended since the last read, None if there is no journal
+        """
+        try:
+            with open(self.journal_file, 'rb') as f:
+                head = f.readline()
+                if not head.endswith(b"\n"):
+                    head = b""
+                if head != self.head:
+                    self.offset = 0  # emptied by a checkpoint or written by a new experiment
+                    self.head = head
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            self.offset, self.head = 0, b""
+            return None
+        end = data.rfind(b"\n") + 1  # the last line may still be written
+        self.offset += end
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+        return records
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_file, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        responses = state["responses"]
+        if state["current_index"] < self.last_index or (self.last_index >= 0 and responses[self.last_index][0] != self.last_image):
+            self._restart()  # the checkpoint is of another experiment
+        if state["current_index"] > self.last_index:
+            self.statistics.extend(responses[self.last_index + 1:])
+            self.last_index = state["current_index"]
+            self.last_image = responses[-1][0]
+            self.elapsed_time = state["elapsed_time"]
+
+    def poll(self):
+        """
+        This function reads the trials recorded since the last poll
+        :return: number of new trials
+        """
+        count = self.statistics.count
+        try:
+            stat = os.stat(self.checkpoint_file)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        checkpointed = signature != self.checkpoint_signature
+        if checkpointed:
+            self.offset = 0
+        records = self._read_journal()
+        self.checkpoint_signature = signature
+        if checkpointed and signature is not None:
+            if records == [] and not self.deferred:
+                # the journal was just emptied, the next trial continues it unless the state changed
+                self.checkpoint_signature, self.deferred = None, True
+            elif not records or records[0]["current_index"] != self.last_index + 1:
+                self._read_checkpoint()
+        if records:
+            self.deferred = False
+
+        responses = []
+        for record in records or []:
+            if record["current_index"] <= self.last_index:
+                if "order" not in record:
+                    continue  # already read from the checkpoint or left over from a compaction
+                # the first record of an experiment carries its order, the index went back because the state was reset
+                self.statistics.extend(responses)
+                responses = []
+                self._restart()
+            responses.append(record["response"])
+            self.last_index = record["current_index"]
+            self.last_image = record["response"][0]
+            self.elapsed_time = record["elapsed_time"]
+        self.statistics.extend(responses)
+        return self.statistics.count - count
+
+
+def state_categories(state_dir):
+    """
+    :return: sorted categories with a checkpoint or a journal in the states folder
+    """
+    files = glob.glob(os.path.join(state_dir, f"*{STATE_SUFFIX}.json")) + glob.glob(os.path.join(state_dir, f"*{STATE_SUFFIX}.jsonl"))
+    return sorted({os.path.basename(file).rsplit(STATE_SUFFIX, 1)[0] for file in files})
+
+
+def print_status(tails, new_trials, interval):
+    """
+    This function prints the statistics of every category in the format of `python -m xvolume analyze`
+    :param tails: StateTail of each category
+    :param new_trials: number of trials of each category read by the last poll
+    :param interval: seconds between the polls
+    """
+    if sys.stdout.isatty():
+        print("\033[2J\033[H", end="")  # clear the terminal
+    print(time.strftime("%H:%M:%S"))
+    for category, tail in tails.items():
+        statistics = tail.statistics
+        if not statistics.count:
+            continue
+        print(f"{category}: trial {tail.last_index + 1}, {tail.elapsed_time / 60:.1f} min, {new_trials.get(category, 0)} new trials in "
+              f"the last {interval:g} s")
+        analytics.print_summary(statistics.summary(), category)
+        for relative_error, (image, signed_relative_error) in statistics.worst.items():
+            print(f"{image}: {relative_error * 100:.2f}% ({signed_relative_error * 100:.2f}%)")
+        print()
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser("xvolume watch", description="Statistics of the experiments in progress, refreshed as trials are saved")
+    parser.add_argument("--categories", "-c", nargs="*", default=None, help="categories to watch (default every category with a state)")
+    parser.add_argument("--state-dir", type=str, default="states", help="folder of the states of the experiments (default states)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help=f"seconds between the refreshes of the summary (default {DEFAULT_INTERVAL})")
+    parser.add_argument("--top-k", type=int, default=10, help="number of images with the largest relative error (default 10)")
+    parser.add_argument("--once", action="store_true", help="print the summary of the saved states and exit")
+    args = parser.parse_args(argv)
+
+    tails = {}
+    try:
+        while True:
+            for category in args.categories or state_categories(args.state_dir):
+                if category not in tails:
+                    tails[category] = StateTail(category, args.state_dir, args.top_k)
+            new_trials = {category: tail.poll() for category, tail in tails.items()}
+            print_status(tails, new_trials, args.interval)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass